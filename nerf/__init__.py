@@ -0,0 +1,59 @@
+"""
+3D scene reconstruction and novel view rendering with Neural Radiance Fields.
+
+Importing the package has no side effects (no download, training or plotting), the entry point is the
+CLI of nerf.cli (python -m nerf train/render/eval/bake/bench).
+"""
+
+from .encoding import positional_encoding, positional_encoding_loop, normalize_coord, HashGridEncoding
+from .rays import get_rays, get_pixel_rays, scale_intrinsics, RayCache
+from .sampling import stratified_sampling, sample_pdf
+from .model import nerf_model, weights_init
+from .rendering import (get_batches, volumetric_rendering, volumetric_rendering_cumprod, CompositeRays, run_network, march_rays,
+                        shade_samples, render_rays, render_rays_adaptive, one_forward_pass, estimate_bytes_per_ray, render_image_streaming)
+from .inference import FusedNerfMLP, InferenceModel, build_inference_models
+from .checks import check_composite_rays, check_inference_model, run_checks
+from .distill import (StudentMLP, GridStudent, prune_model, distill, compare_models, macs_per_point, save_compact_model,
+                      load_compact_model)
+from .occupancy import get_scene_aabb, intersect_aabb, estimate_ray_bounds, OccupancyGrid
+from .progressive import render_progressive
+from .profiling import Profiler, profiling, stage, count, trace_profiler
+from .baking import bake_sparse_grid, save_baked_grid, load_baked_grid, query_baked_grid, render_baked
+from .camera_path import look_at, generate_orbit_path, load_camera_path, render_camera_path
+from .dataset import ViewDataset, RayBatchPrefetcher, open_dataset, write_memmap_dataset, convert_npz_dataset
+from .ray_store import RayStore, RayStorePrefetcher, build_ray_store, open_ray_store
+from .checkpoint import CheckpointWriter, latest_checkpoint, load_checkpoint, make_checkpoint, restore_checkpoint
+from .render_cache import RenderCache, WeightsFingerprint, reproject, render_cached
+from .server import RayBatcher, RenderServer
+from .config import NerfConfig, get_device, build_models, load_models
+from .data import load_data, save_image, plot_all_poses, volumetric_sanity_check
+from .distributed import all_reduce_gradients, broadcast_parameters, sync_occupancy_grid
+from .evaluation import make_render_fn, build_occupancy_grid, HeldOutView, evaluate_held_out, BackgroundEvaluator
+from .train import train, train_distributed
+from .cli import main
+
+__all__ = [
+    'positional_encoding', 'positional_encoding_loop', 'normalize_coord', 'HashGridEncoding',
+    'get_rays', 'get_pixel_rays', 'scale_intrinsics', 'RayCache',
+    'stratified_sampling', 'sample_pdf',
+    'nerf_model', 'weights_init',
+    'get_batches', 'volumetric_rendering', 'volumetric_rendering_cumprod', 'CompositeRays', 'run_network', 'march_rays', 'shade_samples', 'render_rays', 'render_rays_adaptive',
+    'one_forward_pass', 'estimate_bytes_per_ray', 'render_image_streaming',
+    'FusedNerfMLP', 'InferenceModel', 'build_inference_models',
+    'check_composite_rays', 'check_inference_model', 'run_checks',
+    'StudentMLP', 'GridStudent', 'prune_model', 'distill', 'compare_models', 'macs_per_point', 'save_compact_model', 'load_compact_model',
+    'get_scene_aabb', 'intersect_aabb', 'estimate_ray_bounds', 'OccupancyGrid', 'render_progressive',
+    'Profiler', 'profiling', 'stage', 'count', 'trace_profiler',
+    'bake_sparse_grid', 'save_baked_grid', 'load_baked_grid', 'query_baked_grid', 'render_baked',
+    'look_at', 'generate_orbit_path', 'load_camera_path', 'render_camera_path',
+    'ViewDataset', 'RayBatchPrefetcher', 'open_dataset', 'write_memmap_dataset', 'convert_npz_dataset',
+    'RayStore', 'RayStorePrefetcher', 'build_ray_store', 'open_ray_store',
+    'CheckpointWriter', 'latest_checkpoint', 'load_checkpoint', 'make_checkpoint', 'restore_checkpoint',
+    'RenderCache', 'WeightsFingerprint', 'reproject', 'render_cached',
+    'RayBatcher', 'RenderServer',
+    'NerfConfig', 'get_device', 'build_models', 'load_models',
+    'load_data', 'save_image', 'plot_all_poses', 'volumetric_sanity_check',
+    'all_reduce_gradients', 'broadcast_parameters', 'sync_occupancy_grid',
+    'make_render_fn', 'build_occupancy_grid', 'HeldOutView', 'evaluate_held_out', 'BackgroundEvaluator',
+    'train', 'train_distributed', 'main',
+]
@@ -0,0 +1,234 @@
+"""
+Baking of a trained network into a sparse voxel grid of densities and spherical harmonics
+coefficients, and rendering of novel views from the grid without the network.
+"""
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .encoding import positional_encoding
+from .rays import get_rays
+from .rendering import volumetric_rendering
+from .sampling import stratified_sampling
+
+
+# Constants of the real spherical harmonics up to degree 2
+SH_C0 = 0.28209479177387814
+SH_C1 = 0.4886025119029199
+SH_C2 = [1.0925484305920792, -1.0925484305920792, 0.31539156525252005, -1.0925484305920792, 0.5462742152960396]
+
+
+def eval_sh_basis(directions, sh_degree):
+
+    """
+    Evaluate the real spherical harmonics basis functions up to the given degree.
+
+    Args:
+    directions: Unit viewing directions. Shape: (..., 3).
+    sh_degree: Degree of the spherical harmonics (0, 1 or 2).
+
+    Returns:
+    (torch.Tensor): Value of every basis function. Shape: (..., (sh_degree + 1) ** 2).
+    """
+
+    x, y, z = directions[..., 0], directions[..., 1], directions[..., 2]
+    basis = [torch.full_like(x, SH_C0)]
+    if sh_degree >= 1:
+        basis += [-SH_C1 * y, SH_C1 * z, -SH_C1 * x]
+    if sh_degree >= 2:
+        basis += [SH_C2[0] * x * y, SH_C2[1] * y * z, SH_C2[2] * (2 * z * z - x * x - y * y),
+                  SH_C2[3] * x * z, SH_C2[4] * (x * x - y * y)]
+
+    return torch.stack(basis, -1)
+
+
+def fibonacci_directions(num_directions, device=None):
+
+    """
+    Evenly spread unit directions over the sphere (Fibonacci lattice). Shape: (num_directions, 3).
+    """
+
+    i = torch.arange(num_directions, dtype=torch.float32, device=device) + 0.5
+    z = 1 - 2 * i / num_directions
+    r = torch.sqrt(1 - z * z)
+    phi = np.pi * (1 + 5 ** 0.5) * i
+
+    return torch.stack([r * torch.cos(phi), r * torch.sin(phi), z], -1)
+
+
+def bake_sparse_grid(model, num_x_frequencies, num_d_frequencies, aabb, resolution=128, sh_degree=2,
+                     density_threshold=0.5, num_directions=32, chunksize=2**15):
+
+    """
+    Evaluate the trained network once at the vertices of a regular grid over the scene bounding box,
+    keep only the vertices that have (or neighbour) density above density_threshold and fit the
+    view-dependent color of each of them with low-order spherical harmonics.
+
+    Args:
+    model: The trained NeRF network.
+    num_x_frequencies: Number of frequencies used to encode the sample positions.
+    num_d_frequencies: Number of frequencies used to encode the ray directions.
+    aabb: Minimum and maximum corner of the scene bounding box. Shape: (2, 3).
+    resolution (optional, int): Number of grid vertices along each axis.
+    sh_degree (optional, int): Degree of the spherical harmonics used for the color (0, 1 or 2).
+    density_threshold (optional, float): Vertices with a lower density are dropped.
+    num_directions (optional, int): Number of viewing directions used to fit the spherical harmonics.
+    chunksize (optional, int): Number of points evaluated at once.
+
+    Returns:
+    baked (dict): The sparse grid as numpy arrays: 'aabb', 'resolution', 'sh_degree', the linear
+      'indices' of the kept vertices, their 'sigma' and their 'sh' coefficients of shape (num_kept, num_basis, 3).
+    """
+
+    device = aabb.device
+    res = resolution
+
+    def vertex_positions(indices):
+        coords = torch.stack([indices // (res * res), (indices // res) % res, indices % res], -1).float()
+        return aabb[0] + coords / (res - 1) * (aabb[1] - aabb[0])
+
+    with torch.no_grad():
+        # Density at every vertex, the density does not depend on the viewing direction
+        sigma_batches = []
+        for j in range(0, res ** 3, chunksize):
+            points = vertex_positions(torch.arange(j, min(j + chunksize, res ** 3), device=device))
+            directions = torch.zeros_like(points)
+            directions[:, 2] = 1.
+            _, sigma_batch = model(positional_encoding(points, num_x_frequencies), positional_encoding(directions, num_d_frequencies))
+            sigma_batches.append(sigma_batch.reshape(-1))
+        sigma = torch.cat(sigma_batches).reshape(res, res, res)
+
+        # Keep the occupied vertices and their neighbours, so that trilinear lookups near surfaces get their color
+        occupied = (sigma > density_threshold).float()
+        keep = F.max_pool3d(occupied[None, None], kernel_size=3, stride=1, padding=1)[0, 0] > 0
+        indices = torch.nonzero(keep.reshape(-1)).reshape(-1)
+
+        # Fit the spherical harmonics of every kept vertex to its color seen from num_directions directions
+        directions = fibonacci_directions(num_directions, device=device)
+        basis = eval_sh_basis(directions, sh_degree)
+        basis_pinv = torch.linalg.pinv(basis)
+        directions_encoded = positional_encoding(directions, num_d_frequencies)
+
+        sh_batches = []
+        vertices_per_chunk = max(1, chunksize // num_directions)
+        for j in range(0, indices.shape[0], vertices_per_chunk):
+            points = vertex_positions(indices[j:j + vertices_per_chunk])
+            points_encoded = positional_encoding(points, num_x_frequencies)
+            num_points = points.shape[0]
+            rgb, _ = model(points_encoded[:, None, :].expand(num_points, num_directions, -1).reshape(num_points * num_directions, -1),
+                           directions_encoded[None].expand(num_points, num_directions, -1).reshape(num_points * num_directions, -1))
+            rgb = rgb.reshape(num_points, num_directions, 3)
+            sh_batches.append(torch.einsum('bk,nkc->nbc', basis_pinv, rgb))
+        sh = torch.cat(sh_batches) if sh_batches else torch.zeros(0, (sh_degree + 1) ** 2, 3, device=device)
+
+    print("Baked %d of %d grid vertices (%.1f%%)" % (indices.shape[0], res ** 3, 100 * indices.shape[0] / res ** 3))
+
+    return {
+        'aabb': aabb.cpu().numpy().astype(np.float32),
+        'resolution': np.array(res),
+        'sh_degree': np.array(sh_degree),
+        'indices': indices.cpu().numpy().astype(np.int32),
+        'sigma': sigma.reshape(-1)[indices].cpu().numpy().astype(np.float16),
+        'sh': sh.cpu().numpy().astype(np.float16),
+    }
+
+
+def save_baked_grid(baked, path):
+    np.savez_compressed(path, **baked)
+
+
+def load_baked_grid(path, device=None):
+
+    """
+    Load a grid saved by save_baked_grid and build the dense vertex lookup table used for rendering.
+
+    Returns:
+    baked (dict): 'aabb', 'resolution', 'sh_degree' and the 'sigma' and 'sh' tables as tensors, with
+      an extra all-zero entry at the end for the dropped vertices, and 'lookup', which maps every
+      linear vertex index to its entry in the tables.
+    """
+
+    data = np.load(path)
+    res = int(data['resolution'])
+    indices = torch.from_numpy(data['indices'].astype(np.int64)).to(device)
+    sigma = torch.from_numpy(data['sigma'].astype(np.float32)).to(device)
+    sh = torch.from_numpy(data['sh'].astype(np.float32)).to(device)
+
+    lookup = torch.full((res ** 3,), indices.shape[0], dtype=torch.int64, device=device)
+    lookup[indices] = torch.arange(indices.shape[0], device=device)
+
+    return {
+        'aabb': torch.from_numpy(data['aabb']).to(device),
+        'resolution': res,
+        'sh_degree': int(data['sh_degree']),
+        'sigma': torch.cat([sigma, torch.zeros_like(sigma[:1])]),
+        'sh': torch.cat([sh, torch.zeros_like(sh[:1])]),
+        'lookup': lookup,
+    }
+
+
+def query_baked_grid(baked, points, directions):
+
+    """
+    Trilinearly interpolate the density and spherical harmonics of the baked grid, and evaluate the color.
+
+    Args:
+    baked: Grid returned by load_baked_grid.
+    points: 3D points. Shape: (N, 3).
+    directions: Unit viewing direction of every point. Shape: (N, 3).
+
+    Returns:
+    rgb: RGB color at each point. Shape: (N, 3).
+    sigma: Volume density at each point, zero outside the grid. Shape: (N).
+    """
+
+    res = baked['resolution']
+    aabb = baked['aabb']
+
+    coords = (points - aabb[0]) / (aabb[1] - aabb[0]) * (res - 1)
+    inside = torch.all((coords >= 0) & (coords <= res - 1), dim=-1)
+    corner = torch.floor(coords).long().clamp(0, res - 2)
+    frac = (coords - corner).clamp(0, 1)
+
+    sigma = torch.zeros(points.shape[0], device=points.device)
+    sh = torch.zeros(points.shape[0], *baked['sh'].shape[1:], device=points.device)
+    for dx in (0, 1):
+        for dy in (0, 1):
+            for dz in (0, 1):
+                offset = torch.tensor([dx, dy, dz], device=points.device)
+                vertex = corner + offset
+                entry = baked['lookup'][(vertex[:, 0] * res + vertex[:, 1]) * res + vertex[:, 2]]
+                weight = torch.prod(torch.where(offset.bool(), frac, 1 - frac), -1)
+                sigma = sigma + weight * baked['sigma'][entry]
+                sh = sh + weight[:, None, None] * baked['sh'][entry]
+
+    basis = eval_sh_basis(directions, baked['sh_degree'])
+    rgb = torch.clamp(torch.sum(basis[..., None] * sh, -2), 0., 1.)
+
+    return rgb, torch.where(inside, sigma, torch.zeros_like(sigma))
+
+
+def render_baked(baked, height, width, intrinsics, pose, near, far, samples, chunksize=2**12):
+
+    """
+    Render a novel view from the baked grid, with trilinear lookups instead of network evaluations.
+
+    Returns:
+    rec_image: The rendered image. Shape: (height, width, 3)
+    """
+
+    with torch.no_grad():
+        ray_origins, ray_directions = get_rays(height, width, intrinsics, pose[:3, :3], pose[:3, 3])
+        ray_origins = ray_origins.reshape(-1, 3)
+        ray_directions = ray_directions.reshape(-1, 3)
+
+        rec_batches = []
+        for j in range(0, ray_origins.shape[0], chunksize):
+            ray_points, depth_points = stratified_sampling(ray_origins[j:j + chunksize], ray_directions[j:j + chunksize], near, far, samples)
+            directions = ray_directions[j:j + chunksize] / torch.norm(ray_directions[j:j + chunksize], dim=-1, keepdim=True)
+            directions = directions[:, None, :].expand(ray_points.shape)
+            rgb, sigma = query_baked_grid(baked, ray_points.reshape(-1, 3), directions.reshape(-1, 3))
+            rec_batches.append(volumetric_rendering(rgb.reshape(ray_points.shape), sigma.reshape(depth_points.shape), depth_points))
+
+    return torch.cat(rec_batches).reshape(height, width, 3)
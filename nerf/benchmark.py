@@ -0,0 +1,268 @@
+"""
+Benchmarks of the NeRF pipeline.
+
+run_benchmarks times get_rays, stratified_sampling, positional_encoding, get_batches, the nerf_model
+forward and forward/backward passes, the inference network in each precision and volumetric_rendering
+separately, across image resolutions, sample counts and chunk sizes, on synthetic data (no dataset
+download). benchmark_positional_encoding compares the loop and vectorized positional encodings. The
+'bench' command of the CLI writes the results as JSON (--encoding adds the encoding comparison):
+
+    python -m nerf bench --resolutions 100 200 --samples 32 64 --chunk-sizes 4096 32768 --output bench.json
+    python -m nerf bench --encoding
+"""
+
+import os
+import platform
+import resource
+import threading
+import time
+
+import numpy as np
+import torch
+
+from .encoding import positional_encoding, positional_encoding_loop
+from .inference import InferenceModel
+from .model import nerf_model
+from .rays import get_rays
+from .rendering import get_batches, volumetric_rendering, volumetric_rendering_cumprod
+from .sampling import stratified_sampling
+
+
+def synthetic_camera(height, width, device):
+
+    """
+    Intrinsics and pose of a camera at distance 1.33 from the origin looking at it, in the convention of get_rays.
+    """
+
+    focal = 1.2 * width
+    intrinsics = torch.tensor([[focal, 0., width / 2], [0., focal, height / 2], [0., 0., 1.]], device=device)
+    pose = torch.eye(4, device=device)
+    pose[2, 3] = -1.33
+
+    return intrinsics, pose
+
+
+def process_peak_rss_mb():
+    # High-water mark of the resident memory of the process since it started (kilobytes on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def current_rss_mb():
+    # Resident memory of the process now, None where /proc is not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+class StageMemory:
+
+    """
+    Peak memory of the block above the memory in use when it started: the memory allocated by torch on a
+    GPU, the resident memory of the process sampled every interval seconds on the CPU (None without /proc).
+    """
+
+    def __init__(self, device, interval=0.001):
+        self.device = device
+        self.interval = interval
+        self.peak_mb = None
+
+    def __enter__(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            self.start_mb = torch.cuda.memory_allocated(self.device) / 2**20
+            torch.cuda.reset_peak_memory_stats(self.device)
+            return self
+
+        self.start_mb = current_rss_mb()
+        if self.start_mb is not None:
+            self.sampled_mb = self.start_mb
+            self.stopped = threading.Event()
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.sampled_mb = max(self.sampled_mb, current_rss_mb())
+
+    def __exit__(self, *exc_info):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            self.peak_mb = torch.cuda.max_memory_allocated(self.device) / 2**20 - self.start_mb
+        elif self.start_mb is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.peak_mb = max(self.sampled_mb, current_rss_mb()) - self.start_mb
+
+
+def time_stage(fn, repeats, device):
+
+    """
+    Run fn once to warm up, then repeats times. Returns the mean and minimum wall time in seconds and the
+    peak memory of the runs above the memory in use before them (see StageMemory), in MB.
+    """
+
+    with StageMemory(device) as memory:
+        fn()
+        times = []
+        for _ in range(repeats):
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            t = time.perf_counter()
+            fn()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            times.append(time.perf_counter() - t)
+
+    return float(np.mean(times)), float(np.min(times)), memory.peak_mb
+
+
+def run_benchmarks(resolutions=(100,), sample_counts=(64,), chunk_sizes=(2**15,), repeats=3,
+                   num_x_frequencies=10, num_d_frequencies=4, device=None):
+
+    """
+    Benchmark every stage of the pipeline for each combination of resolution, sample count and chunk size.
+
+    Returns:
+    results (list): One record per stage and configuration with the mean and minimum time, the
+      points (or rays) processed per second, the peak memory of the stage (stage_peak_memory_mb, see
+      StageMemory) and the high-water mark of the resident memory of the process so far (process_peak_rss_mb).
+    """
+
+    device = device or torch.device('cpu')
+    model = nerf_model(num_x_frequencies=num_x_frequencies, num_d_frequencies=num_d_frequencies).to(device)
+
+    # Fused inference versions of the network, int8 only runs on the CPU
+    precisions = ('fp32', 'bf16', 'int8') if device.type == 'cpu' else ('fp32', 'bf16')
+    inference_models = {precision: InferenceModel(model, precision) for precision in precisions}
+
+    results = []
+
+    def record(stage, measurements, items, **config):
+        mean_seconds, min_seconds, stage_peak_memory_mb = measurements
+        results.append(dict(stage=stage, mean_seconds=mean_seconds, min_seconds=min_seconds, items_per_sec=items / mean_seconds,
+                            stage_peak_memory_mb=stage_peak_memory_mb, process_peak_rss_mb=process_peak_rss_mb(), **config))
+        print("%-24s %-45s %10.4f s %12.0f items/sec" % (stage, config, mean_seconds, items / mean_seconds))
+
+    for resolution in resolutions:
+        height = width = resolution
+        intrinsics, pose = synthetic_camera(height, width, device)
+        num_rays = height * width
+
+        record('get_rays', time_stage(lambda: get_rays(height, width, intrinsics, pose[:3, :3], pose[:3, 3]), repeats, device),
+               num_rays, resolution=resolution)
+        ray_origins, ray_directions = get_rays(height, width, intrinsics, pose[:3, :3], pose[:3, 3])
+
+        for samples in sample_counts:
+            config = dict(resolution=resolution, samples=samples)
+            num_points = num_rays * samples
+
+            record('stratified_sampling', time_stage(
+                lambda: stratified_sampling(ray_origins, ray_directions, 0.667, 2., samples), repeats, device), num_points, **config)
+            ray_points, depth_points = stratified_sampling(ray_origins, ray_directions, 0.667, 2., samples)
+            points_flat = ray_points.reshape(-1, 3)
+
+            record('positional_encoding_x', time_stage(
+                lambda: positional_encoding(points_flat, num_x_frequencies), repeats, device), num_points, **config)
+            record('positional_encoding_d', time_stage(
+                lambda: positional_encoding(points_flat, num_d_frequencies), repeats, device), num_points, **config)
+
+            rgb = torch.rand(*depth_points.shape, 3, device=device)
+            sigma = torch.rand(depth_points.shape, device=device)
+            record('volumetric_rendering', time_stage(
+                lambda: volumetric_rendering(rgb, sigma, depth_points), repeats, device), num_points, **config)
+            record('volumetric_rendering_cumprod', time_stage(
+                lambda: volumetric_rendering_cumprod(rgb, sigma, depth_points), repeats, device), num_points, **config)
+
+            # Compositing with gradients, as in training
+            rgb_grad = rgb.clone().requires_grad_()
+            sigma_grad = sigma.clone().requires_grad_()
+            record('volumetric_rendering_backward', time_stage(
+                lambda: volumetric_rendering(rgb_grad, sigma_grad, depth_points).sum().backward(), repeats, device), num_points, **config)
+            record('volumetric_rendering_cumprod_backward', time_stage(
+                lambda: volumetric_rendering_cumprod(rgb_grad, sigma_grad, depth_points).sum().backward(), repeats, device), num_points, **config)
+
+            for chunksize in chunk_sizes:
+                chunk_config = dict(config, chunksize=chunksize)
+                record('get_batches', time_stage(
+                    lambda: get_batches(ray_points, ray_directions, num_x_frequencies, num_d_frequencies, chunksize=chunksize),
+                    repeats, device), num_points, **chunk_config)
+
+                # The network is timed on one chunk
+                x = positional_encoding(points_flat[:chunksize], num_x_frequencies)
+                d = positional_encoding(points_flat[:chunksize], num_d_frequencies)
+
+                def forward():
+                    with torch.no_grad():
+                        model(x, d)
+
+                def forward_backward():
+                    rgb_chunk, sigma_chunk = model(x, d)
+                    (rgb_chunk.sum() + sigma_chunk.sum()).backward()
+                    model.zero_grad(set_to_none=True)
+
+                record('nerf_model_forward', time_stage(forward, repeats, device), x.shape[0], **chunk_config)
+                record('nerf_model_forward_backward', time_stage(forward_backward, repeats, device), x.shape[0], **chunk_config)
+
+                for precision, inference_model in inference_models.items():
+                    def inference_forward():
+                        with torch.no_grad():
+                            inference_model(x, d)
+
+                    record('inference_model_forward_' + precision, time_stage(inference_forward, repeats, device), x.shape[0], **chunk_config)
+
+    return results
+
+
+def benchmark_positional_encoding(num_points=2**16, frequencies=(4, 6, 10), repeats=20, device=None):
+
+    """
+    Micro-benchmark of positional_encoding_loop against positional_encoding, with and without an output
+    buffer reused across calls, on num_points random 3D points. Prints and returns the points/sec.
+    """
+
+    device = device or torch.device('cpu')
+    x = torch.rand(num_points, 3, device=device)
+    results = []
+    for num_frequencies in frequencies:
+        out = torch.empty(num_points, 3 + 2 * 3 * num_frequencies, device=device)
+        variants = [('loop', lambda: positional_encoding_loop(x, num_frequencies)),
+                    ('vectorized', lambda: positional_encoding(x, num_frequencies)),
+                    ('vectorized + buffer', lambda: positional_encoding(x, num_frequencies, out=out))]
+
+        for name, encode in variants:
+            encode()  # warm up
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            t = time.time()
+            for _ in range(repeats):
+                encode()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            points_per_sec = num_points * repeats / (time.time() - t)
+
+            print("L=%2d (%3d dims) %-20s %8.2f M points/sec" % (num_frequencies, out.shape[-1], name, points_per_sec / 1e6))
+            results.append({'stage': 'positional_encoding_variants', 'num_frequencies': num_frequencies, 'variant': name,
+                            'num_points': num_points, 'points_per_sec': points_per_sec})
+
+    return results
+
+
+def benchmark_report(results, device):
+
+    """
+    Machine-readable report of benchmark results, with the environment they were measured in.
+    """
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'torch_version': torch.__version__,
+            'device': str(device),
+            'num_threads': torch.get_num_threads(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
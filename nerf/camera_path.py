@@ -0,0 +1,169 @@
+"""
+Camera paths (orbits around the scene or poses loaded from a file) and their rendering with a pool
+of worker processes.
+"""
+
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+
+from .rendering import render_image_streaming
+
+
+def look_at(camera_position, target, up):
+
+    """
+    Camera to world transformation of a camera at camera_position looking at target, in the convention
+    of get_rays (x right, y down, z forward). Shape: (4, 4).
+    """
+
+    forward = target - camera_position
+    forward = forward / torch.norm(forward)
+    right = torch.linalg.cross(forward, up)
+    right = right / torch.norm(right)
+    down = torch.linalg.cross(forward, right)
+
+    pose = torch.eye(4, dtype=camera_position.dtype, device=camera_position.device)
+    pose[:3, :3] = torch.stack([right, down, forward], -1)
+    pose[:3, 3] = camera_position
+
+    return pose
+
+
+def generate_orbit_path(poses, num_frames=120, spiral_height=0.):
+
+    """
+    Generate a circular orbit (or a spiral if spiral_height > 0) around the scene from the distribution
+    of the training poses: the cameras orbit the point closest to all optical axes, around the average
+    up vector of the cameras, at their average distance and height.
+
+    Args:
+    poses: Camera to world transformations of the training images. Shape: (num_images, 4, 4).
+    num_frames (optional, int): Number of poses of the path.
+    spiral_height (optional, float): Amplitude of the up and down motion of the cameras along the path.
+
+    Returns:
+    path_poses (torch.Tensor): Camera to world transformations along the path. Shape: (num_frames, 4, 4).
+    """
+
+    poses = poses.double()
+    origins = poses[:, :3, 3]
+    forwards = poses[:, :3, 2] / torch.norm(poses[:, :3, 2], dim=-1, keepdim=True)
+    up = -poses[:, :3, 1].mean(0)
+    up = up / torch.norm(up)
+
+    # Least-squares point closest to all optical axes
+    projections = torch.eye(3, dtype=poses.dtype, device=poses.device) - forwards[:, :, None] * forwards[:, None, :]
+    center = torch.linalg.solve(projections.sum(0), (projections @ origins[:, :, None]).sum(0))[:, 0]
+
+    offsets = origins - center
+    height = (offsets @ up).mean()
+    radius = torch.norm(offsets - (offsets @ up)[:, None] * up, dim=-1).mean()
+
+    # Orthonormal basis of the orbit plane, starting from the first training camera
+    axis_1 = offsets[0] - (offsets[0] @ up) * up
+    axis_1 = axis_1 / torch.norm(axis_1)
+    axis_2 = torch.linalg.cross(up, axis_1)
+
+    path_poses = []
+    for theta in np.linspace(0, 2 * np.pi, num_frames, endpoint=False):
+        camera_position = center + (height + spiral_height * np.sin(2 * theta)) * up + \
+                          radius * (np.cos(theta) * axis_1 + np.sin(theta) * axis_2)
+        path_poses.append(look_at(camera_position, center, up))
+
+    return torch.stack(path_poses).float()
+
+
+def load_camera_path(path):
+
+    """
+    Load camera to world transformations from a .npy file, the 'poses' array of a .npz file or a text
+    file of 16 values per pose. Shape: (num_frames, 4, 4).
+    """
+
+    if path.endswith('.npy'):
+        path_poses = np.load(path)
+    elif path.endswith('.npz'):
+        path_poses = np.load(path)['poses']
+    else:
+        path_poses = np.loadtxt(path)
+
+    return torch.from_numpy(np.asarray(path_poses, dtype=np.float32).reshape(-1, 4, 4))
+
+
+# State of a render worker process, set once by init_render_worker
+render_worker = {}
+
+
+def init_render_worker(path_poses, render_args, render_kwargs, num_threads):
+    torch.set_num_threads(num_threads)
+    render_worker['path_poses'] = path_poses
+    render_worker['render_args'] = render_args
+    render_worker['render_kwargs'] = render_kwargs
+
+
+def render_path_frame(frame_index):
+    height, width, intrinsics, near, far, samples, model, num_x_frequencies, num_d_frequencies = render_worker['render_args']
+    rec_image = render_image_streaming(height, width, intrinsics, render_worker['path_poses'][frame_index], near, far, samples,
+                                       model, num_x_frequencies, num_d_frequencies, **render_worker['render_kwargs'])
+
+    return (255 * rec_image.clamp(0, 1).numpy()).astype(np.uint8)
+
+
+def render_camera_path(path_poses, height, width, intrinsics, near, far, samples, model, num_x_frequencies, num_d_frequencies,
+                       output_path='novel_views.gif', num_workers=None, fps=30, model_fine=None, fine_samples=0, memory_budget_mb=512,
+                       aabb=None, min_samples=0, occupancy_grid=None):
+
+    """
+    Render every pose of a camera path on the CPU with a pool of worker processes and write the frames,
+    in the order of the path, to a GIF or video file.
+
+    The pool is CPU only: the workers render CPU copies of the networks and of the occupancy grid (those of
+    the caller are left where they are). They are spawned rather than forked, forking after torch started
+    its OpenMP or CUDA threads can deadlock, so a script calling this function must guard its entry point
+    with if __name__ == '__main__'. They share the weights of the model through shared memory (the traced
+    inference networks are copied to every worker), each of them renders whole frames with its share of the
+    CPU cores.
+
+    Args:
+    path_poses: Camera to world transformations along the path. Shape: (num_frames, 4, 4).
+    output_path (optional, str): GIF or video file the frames are written to.
+    num_workers (optional, int): Number of worker processes, one per CPU core by default.
+    fps (optional, int): Frame rate of the output.
+    The other arguments are the ones of render_image_streaming.
+
+    Returns:
+    frames (list): The rendered frames as uint8 arrays of shape (height, width, 3).
+    """
+
+    num_workers = num_workers or os.cpu_count()
+    num_threads = max(1, os.cpu_count() // num_workers)
+
+    model = copy.deepcopy(model).cpu().eval()
+    model.share_memory()
+    if model_fine is not None:
+        model_fine = copy.deepcopy(model_fine).cpu().eval()
+        model_fine.share_memory()
+
+    render_args = (height, width, intrinsics.cpu(), near, far, samples, model, num_x_frequencies, num_d_frequencies)
+    if occupancy_grid is not None:
+        occupancy_grid = copy.copy(occupancy_grid)
+        occupancy_grid.aabb, occupancy_grid.density, occupancy_grid.occupied = \
+            occupancy_grid.aabb.cpu(), occupancy_grid.density.cpu(), occupancy_grid.occupied.cpu()
+    render_kwargs = dict(model_fine=model_fine, fine_samples=fine_samples, memory_budget_mb=memory_budget_mb / num_workers,
+                         aabb=aabb.cpu() if aabb is not None else None, min_samples=min_samples, occupancy_grid=occupancy_grid)
+
+    t = time.time()
+    context = torch.multiprocessing.get_context('spawn')
+    with context.Pool(num_workers, initializer=init_render_worker, initargs=(path_poses.cpu(), render_args, render_kwargs, num_threads)) as pool:
+        # imap returns the frames in the order of the path, whatever worker renders them
+        frames = list(pool.imap(render_path_frame, range(path_poses.shape[0])))
+    print("Rendered %d frames with %d workers: %.2f frames/sec" % (len(frames), num_workers, len(frames) / (time.time() - t)))
+
+    import imageio.v2 as imageio
+    imageio.mimwrite(output_path, frames, fps=fps)
+
+    return frames
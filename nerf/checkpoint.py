@@ -0,0 +1,180 @@
+"""
+Training checkpoints: the networks, the optimizer, the occupancy grid, the random number generators,
+the iteration and the PSNR history, so that an interrupted run continues exactly where it left off.
+
+The state is copied to the CPU in the training loop and written by a background thread, to a temporary
+file renamed over the final one (a crash never leaves a partial checkpoint). Only the most recent
+checkpoints are kept.
+"""
+
+import copy
+import glob
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+
+
+def cpu_copy(obj):
+
+    """
+    Copy the tensors of a (nested) state to the CPU, so that training can modify the originals while the
+    copy is written.
+    """
+
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: cpu_copy(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_copy(value) for value in obj)
+    return obj
+
+
+def get_rng_state():
+    rng_state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'python': random.getstate()}
+    if torch.cuda.is_available():
+        rng_state['cuda'] = torch.cuda.get_rng_state_all()
+    return rng_state
+
+
+def set_rng_state(rng_state):
+    torch.set_rng_state(rng_state['torch'])
+    np.random.set_state(rng_state['numpy'])
+    random.setstate(rng_state['python'])
+    if 'cuda' in rng_state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng_state['cuda'])
+
+
+def checkpoint_path(directory, iteration):
+    return os.path.join(directory, 'checkpoint_%08d.pt' % iteration)
+
+
+def list_checkpoints(directory):
+
+    """
+    Checkpoints of a directory, from the oldest to the most recent.
+    """
+
+    return sorted(glob.glob(os.path.join(directory, 'checkpoint_*.pt')))
+
+
+def latest_checkpoint(directory):
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1] if checkpoints else None
+
+
+def load_checkpoint(path):
+
+    # On the CPU: the random number generator states must stay there, load_state_dict moves the rest
+    return torch.load(path, map_location='cpu', weights_only=False)
+
+
+class CheckpointWriter:
+
+    """
+    Write checkpoints from a background thread, with an atomic rename, keeping the keep most recent ones.
+
+    save() returns once the state is copied to the CPU. It only waits if the previous checkpoint is still
+    being written, so at most two copies of the state are in memory.
+    """
+
+    def __init__(self, directory, keep=3):
+        self.directory = directory
+        self.keep = keep
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+        self.pending = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            iteration, state = item
+            try:
+                self.write(iteration, state)
+            except Exception as error:
+                # Raised in the training loop by the next save() or close()
+                self.error = error
+            finally:
+                self.pending.task_done()
+
+    def write(self, iteration, state):
+        path = checkpoint_path(self.directory, iteration)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        for old_path in list_checkpoints(self.directory)[:-self.keep] if self.keep > 0 else []:
+            os.remove(old_path)
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def save(self, iteration, state):
+        self.check()
+        self.pending.put((iteration, cpu_copy(state)))
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        self.check()
+
+
+def make_checkpoint(iteration, model, model_fine, optimizer, occupancy_grid, psnr_history, ray_batch_seed=None):
+
+    """
+    State of a training run at the end of an iteration. psnr_history holds the full resolution and quick
+    PSNRs of the held-out view apart (see nerf.evaluation.new_psnr_history).
+    """
+
+    return {
+        'iteration': iteration,
+        'model': model.state_dict(),
+        'model_fine': model_fine.state_dict() if model_fine is not None else None,
+        'optimizer': optimizer.state_dict(),
+        'occupancy_grid': {'density': occupancy_grid.density, 'occupied': occupancy_grid.occupied} if occupancy_grid is not None else None,
+        'psnr_history': copy.deepcopy(psnr_history),
+        'ray_batch_seed': ray_batch_seed,
+        'rng': get_rng_state(),
+    }
+
+
+def restore_checkpoint(checkpoint, model, model_fine, optimizer, occupancy_grid):
+
+    """
+    Load the state of a checkpoint into the objects of a new training run and restore the random number
+    generators. Call it after everything else that consumes random numbers (e.g. the weight initialization).
+
+    Returns:
+    A tuple (iteration, psnr_history, ray_batch_seed) of the checkpoint.
+    """
+
+    model.load_state_dict(checkpoint['model'])
+    if model_fine is not None:
+        model_fine.load_state_dict(checkpoint['model_fine'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    if occupancy_grid is not None and checkpoint['occupancy_grid'] is not None:
+        occupancy_grid.density.copy_(checkpoint['occupancy_grid']['density'])
+        occupancy_grid.occupied.copy_(checkpoint['occupancy_grid']['occupied'])
+    set_rng_state(checkpoint['rng'])
+
+    if 'psnr_history' in checkpoint:
+        psnr_history = checkpoint['psnr_history']
+    else:
+        # Checkpoints with a single history, of the full resolution evaluations
+        psnr_history = {'full': {'iternums': checkpoint['iternums'], 'psnrs': checkpoint['psnrs']}, 'quick': {'iternums': [], 'psnrs': []}}
+
+    return checkpoint['iteration'], psnr_history, checkpoint['ray_batch_seed']
@@ -0,0 +1,122 @@
+"""
+Numerical self-checks of the hand-written kernels, run by python -m nerf check (non-zero exit status on
+failure), on small random inputs and without the dataset:
+
+- the backward pass of CompositeRays, against finite differences (torch.autograd.gradcheck, in double
+  precision) and against autograd through volumetric_rendering_cumprod;
+- InferenceModel (the fused, traced network) in each precision, against the nerf_model it is built from.
+"""
+
+import torch
+
+from .encoding import positional_encoding
+from .inference import InferenceModel
+from .model import nerf_model
+from .rendering import CompositeRays, volumetric_rendering, volumetric_rendering_cumprod
+
+# Largest error of the inference network relative to the largest output of the eager one, per precision
+INFERENCE_TOLERANCES = {'fp32': 1e-4, 'bf16': 5e-2, 'int8': 1e-1}
+
+
+def random_samples(num_rays=4, samples=8, dtype=torch.float64, seed=0):
+
+    """
+    Colors, positive densities (away from the kink of the relu) and sorted depths of random samples.
+    """
+
+    generator = torch.Generator().manual_seed(seed)
+    rgb = torch.rand(num_rays, samples, 3, generator=generator, dtype=dtype)
+    sigma = 0.1 + 2 * torch.rand(num_rays, samples, generator=generator, dtype=dtype)
+    depth_points, _ = torch.sort(0.667 + 1.333 * torch.rand(num_rays, samples, generator=generator, dtype=dtype), -1)
+
+    return rgb, sigma, depth_points
+
+
+def check_composite_rays(tolerance=1e-6):
+
+    """
+    Check the backward pass of CompositeRays against finite differences, and its color and color gradients
+    against the cumulative product reference.
+
+    Returns:
+    A list of (name, error, tolerance, passed).
+    """
+
+    rgb, sigma, depth_points = random_samples()
+    rgb.requires_grad_()
+    sigma.requires_grad_()
+
+    # Every output (color, depth, opacity, weights) and every input that gets a gradient (the depths get none)
+    gradcheck_passed = torch.autograd.gradcheck(lambda rgb, sigma: CompositeRays.apply(rgb, sigma, depth_points), (rgb, sigma),
+                                                eps=1e-6, atol=tolerance, raise_exception=False)
+    results = [('CompositeRays gradcheck', None, tolerance, gradcheck_passed)]
+
+    grad_output = torch.rand(rgb.shape[0], 3, generator=torch.Generator().manual_seed(1), dtype=rgb.dtype)
+    gradients = []
+    outputs = []
+    for render in (volumetric_rendering, volumetric_rendering_cumprod):
+        rec_image = render(rgb, sigma, depth_points)
+        outputs.append(rec_image.detach())
+        gradients.append(torch.autograd.grad(rec_image, (rgb, sigma), grad_output))
+
+    # The reference adds 1e-10 to every transmittance factor, the differences are of that order
+    error = (outputs[0] - outputs[1]).abs().max().item()
+    results.append(('CompositeRays color vs cumprod', error, tolerance, error <= tolerance))
+    for name, grad, grad_reference in zip(('rgb', 'sigma'), *gradients):
+        error = (grad - grad_reference).abs().max().item()
+        results.append(('CompositeRays grad %s vs cumprod' % name, error, tolerance, error <= tolerance))
+
+    return results
+
+
+def check_inference_model(num_points=1024, tolerances=None):
+
+    """
+    Check InferenceModel in each precision against the randomly initialized nerf_model it is built from,
+    with the sinusoidal and the hash encodings. int8 is only checked if a quantized engine is available.
+
+    Returns:
+    A list of (name, error, tolerance, passed), with the error relative to the largest eager output.
+    """
+
+    tolerances = dict(INFERENCE_TOLERANCES, **(tolerances or {}))
+    precisions = ['fp32', 'bf16']
+    if torch.backends.quantized.engine != 'none':
+        precisions.append('int8')
+
+    torch.manual_seed(0)
+    aabb = torch.tensor([[-1., -1., -1.], [1., 1., 1.]])
+    points = 2 * torch.rand(num_points, 3) - 1
+    directions = torch.nn.functional.normalize(torch.randn(num_points, 3), dim=-1)
+
+    results = []
+    for encoding in ('sinusoidal', 'hash'):
+        model = nerf_model(encoding=encoding, aabb=aabb, hash_log2_table_size=14).eval()
+        x = positional_encoding(points, model.num_x_frequencies)
+        d = positional_encoding(directions, model.num_d_frequencies)
+        with torch.no_grad():
+            reference = torch.cat([output.reshape(num_points, -1) for output in model(x, d)], -1)
+            scale = reference.abs().max().item() + 1e-6
+            for precision in precisions:
+                output = torch.cat([output.reshape(num_points, -1) for output in InferenceModel(model, precision)(x, d)], -1)
+                error = (output - reference).abs().max().item() / scale
+                results.append(('InferenceModel %s %s' % (encoding, precision), error, tolerances[precision], error <= tolerances[precision]))
+
+    return results
+
+
+def run_checks():
+
+    """
+    Run every check and print its result.
+
+    Returns:
+    True if all of them passed.
+    """
+
+    results = check_composite_rays() + check_inference_model()
+    for name, error, tolerance, passed in results:
+        print("%-40s %-6s error: %s (tolerance: %.0e)" % (name, 'ok' if passed else 'FAILED',
+                                                             '%.2e' % error if error is not None else '-', tolerance))
+
+    return all(passed for _, _, _, passed in results)
@@ -0,0 +1,351 @@
+"""
+Command line interface of the nerf package:
+
+    python -m nerf train [--iterations 3000 --hierarchical ...]
+    python -m nerf render [--camera-path path.npy --frames 120 --output novel_views.gif]
+    python -m nerf eval [--baked] [--sanity-check]
+    python -m nerf bake [--bake-resolution 128]
+    python -m nerf distill [--method student|grid|prune --width 64 --depth 3]
+    python -m nerf convert lego_data.npz lego_data/
+    python -m nerf serve [--port 8000 --max-batch-rays 16384 --cache-mb 256 --reproject-distance 0.05]
+    python -m nerf bench [--resolutions 100 200 --samples 32 64 --encoding]
+    python -m nerf check
+
+Every field of NerfConfig is an option of train, render, eval, bake, distill and serve.
+"""
+
+import argparse
+import asyncio
+import copy
+import dataclasses
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from .benchmark import run_benchmarks, benchmark_positional_encoding, benchmark_report
+from .camera_path import generate_orbit_path, load_camera_path, render_camera_path
+from .checks import run_checks
+from .config import NerfConfig, get_device, load_models
+from .data import save_image, volumetric_sanity_check
+from .dataset import open_dataset, convert_npz_dataset
+from .distill import (StudentMLP, GridStudent, prune_model, distill, compare_models, format_comparison, save_compact_model,
+                      load_compact_model)
+from .evaluation import render_test_view, make_render_fn, build_occupancy_grid, compute_psnr
+from .inference import build_inference_models
+from .occupancy import get_scene_aabb
+from .profiling import Profiler, profiling
+from .progressive import render_progressive
+from .render_cache import RenderCache, WeightsFingerprint
+from .server import RenderServer
+from .train import train, train_distributed, bake_model, evaluate_baked
+
+
+def add_config_arguments(parser):
+    for config_field in dataclasses.fields(NerfConfig):
+        option = '--' + config_field.name.replace('_', '-')
+        help_text = config_field.metadata.get('help')
+        if config_field.type is bool:
+            parser.add_argument(option, action=argparse.BooleanOptionalAction, default=config_field.default, help=help_text)
+        else:
+            parser.add_argument(option, type=config_field.type, default=config_field.default,
+                                help="%s (default: %s)" % (help_text, config_field.default))
+
+
+def config_from_args(args):
+    return NerfConfig(**{config_field.name: getattr(args, config_field.name) for config_field in dataclasses.fields(NerfConfig)})
+
+
+def load_trained(config, device):
+
+    """
+    Load the dataset and the trained network(s) of a configuration. The fused inference network is only
+    built from a nerf_model (or a pruned one): for a distilled student, config.inference_precision is
+    reset to 'none' with a warning.
+    """
+
+    dataset = open_dataset(config.data_path, device, config.num_train_images)
+    test_image, test_pose = dataset.load_image(config.test_index), dataset.poses[config.test_index]
+    scene_aabb = get_scene_aabb(dataset.poses, config.far)
+    if config.compact_model_path:
+        model, model_fine = load_compact_model(config.compact_model_path, device)
+        if config.inference_precision != 'none' and model.encoding not in ('sinusoidal', 'hash'):
+            print("Warning: --inference-precision %s ignored, %s is a %s and not a (pruned) nerf_model" %
+                  (config.inference_precision, config.compact_model_path, type(model).__name__))
+            config.inference_precision = 'none'
+    else:
+        model, model_fine = load_models(config, scene_aabb, device)
+
+    return dataset, test_image, test_pose, scene_aabb, model, model_fine
+
+
+def rendering_occupancy_grid(config, model, model_fine, scene_aabb):
+    return build_occupancy_grid(config, model, model_fine, scene_aabb) if config.use_occupancy_grid else None
+
+
+def run_train(args):
+    config = config_from_args(args)
+    if config.processes_per_node * config.num_nodes > 1:
+        train_distributed(config)
+    else:
+        train(config, get_device())
+
+
+def run_render(args):
+    config = config_from_args(args)
+    device = get_device()
+    dataset, _, _, scene_aabb, model, model_fine = load_trained(config, device)
+    occupancy_grid = rendering_occupancy_grid(config, model, model_fine, scene_aabb)
+    if config.inference_precision != 'none':
+        # The camera path is rendered on the CPU
+        model, model_fine = build_inference_models(model.cpu(), model_fine.cpu() if model_fine is not None else None,
+                                                   config.inference_precision)
+
+    path_poses = load_camera_path(args.camera_path) if args.camera_path is not None else generate_orbit_path(dataset.poses, args.frames, args.spiral_height)
+    render_camera_path(path_poses, dataset.height, dataset.width, dataset.intrinsics, config.near, config.far, config.samples, model,
+                       config.num_x_frequencies, config.num_d_frequencies, output_path=args.output, num_workers=args.workers,
+                       fps=args.fps, model_fine=model_fine, fine_samples=config.fine_samples,
+                       memory_budget_mb=config.render_memory_budget_mb, aabb=scene_aabb if config.clip_to_aabb else None,
+                       min_samples=config.min_samples, occupancy_grid=occupancy_grid)
+
+
+def run_eval(args):
+    config = config_from_args(args)
+    device = get_device()
+
+    if args.sanity_check:
+        volumetric_sanity_check(show=config.show_plots)
+
+    dataset, test_image, test_pose, scene_aabb, model, model_fine = load_trained(config, device)
+    height, width, intrinsics = dataset.height, dataset.width, dataset.intrinsics
+    occupancy_grid = rendering_occupancy_grid(config, model, model_fine, scene_aabb)
+
+    if args.baked:
+        evaluate_baked(config, height, width, intrinsics, test_pose, test_image, device)
+        return
+
+    t = time.time()
+    with profiling(Profiler(synchronize=True) if config.profile else None) as profiler:
+        test_rec_image = render_test_view(config, height, width, intrinsics, test_pose, model, model_fine, occupancy_grid, scene_aabb=scene_aabb)
+    reference_time = time.time() - t
+    reference_psnr = compute_psnr(test_rec_image, test_image).item()
+    print("PSNR: %.2f, %.3f secs per frame" % (reference_psnr, reference_time))
+    if profiler is not None:
+        print(profiler.report())
+
+    if config.inference_precision != 'none':
+        # Compare the inference network with the training network on the held-out view
+        model, model_fine = build_inference_models(model, model_fine, config.inference_precision)
+        t = time.time()
+        test_rec_image = render_test_view(config, height, width, intrinsics, test_pose, model, model_fine, occupancy_grid, scene_aabb=scene_aabb)
+        inference_time = time.time() - t
+        inference_psnr = compute_psnr(test_rec_image, test_image).item()
+        print("Inference network (%s): PSNR: %.2f, %.3f secs per frame, %.2fx faster" %
+              (config.inference_precision, inference_psnr, inference_time, reference_time / inference_time))
+        if reference_psnr - inference_psnr > args.psnr_tolerance:
+            raise SystemExit("The PSNR of the inference network is %.2f dB lower than the training network (tolerance: %.2f dB)" %
+                             (reference_psnr - inference_psnr, args.psnr_tolerance))
+
+    save_image(config.output_image, test_rec_image)
+
+    if args.progressive:
+        # Coarse image first, then only the pixels of the regions that vary are rendered again
+        render_fn = make_render_fn(config, model, model_fine, device, scene_aabb, occupancy_grid)
+        t = time.time()
+        rendered_rays = 0
+        for level, (image, rays) in enumerate(render_progressive(height, width, intrinsics, test_pose, render_fn,
+                                                                 refine_threshold=config.refine_threshold)):
+            rendered_rays += rays
+            print("Progressive level %d: PSNR: %.2f, %.3f secs, %.0f%% of the rays of a full frame" %
+                  (level, compute_psnr(image, test_image).item(), time.time() - t, 100 * rendered_rays / (height * width)))
+        save_image(os.path.splitext(config.output_image)[0] + '_progressive.png', image)
+
+
+def run_bake(args):
+    config = config_from_args(args)
+    device = get_device()
+    dataset, test_image, test_pose, scene_aabb, model, model_fine = load_trained(config, device)
+    height, width, intrinsics = dataset.height, dataset.width, dataset.intrinsics
+
+    with torch.no_grad():
+        bake_model(config, model, model_fine, scene_aabb, height, width, intrinsics, test_pose, test_image, device)
+
+
+def run_serve(args):
+    config = config_from_args(args)
+    device = get_device()
+    dataset, _, _, scene_aabb, model, model_fine = load_trained(config, device)
+    occupancy_grid = rendering_occupancy_grid(config, model, model_fine, scene_aabb)
+
+    cache, fingerprint_fn = None, None
+    if args.cache_mb > 0:
+        # The cached views depend on the weights and on every setting that changes the rendered pixels
+        settings = repr((config.near, config.far, config.samples, config.fine_samples, config.min_samples, config.clip_to_aabb,
+                         config.transmittance_threshold, config.inference_precision, occupancy_grid is not None))
+        fingerprint_fn = WeightsFingerprint([model, model_fine], extra=settings)
+        cache = RenderCache(args.cache_mb, args.cache_dir, args.cache_disk_mb, translation_step=args.cache_pose_step,
+                            rotation_step=args.cache_pose_step, max_translation=args.reproject_distance,
+                            max_degrees=args.reproject_degrees, max_hole_fraction=args.reproject_max_holes)
+
+    if config.inference_precision != 'none':
+        model, model_fine = build_inference_models(model, model_fine, config.inference_precision)
+
+    render_fn = make_render_fn(config, model, model_fine, device, scene_aabb, occupancy_grid, return_depth=cache is not None)
+    server = RenderServer(render_fn, dataset.height, dataset.width, dataset.intrinsics, max_batch_rays=args.max_batch_rays,
+                          batch_window=args.batch_window_ms / 1000, cache=cache, fingerprint_fn=fingerprint_fn)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def run_distill(args):
+    config = config_from_args(args)
+    device = get_device()
+    dataset, test_image, test_pose, scene_aabb, teacher, teacher_fine = load_trained(config, device)
+    input_dim_x = 3 + 2 * 3 * config.num_x_frequencies
+    input_dim_d = 3 + 2 * 3 * config.num_d_frequencies
+    distill_kwargs = dict(dataset=dataset, near=config.near, far=config.far, samples=config.samples + config.fine_samples * config.hierarchical,
+                          num_x_frequencies=config.num_x_frequencies, num_d_frequencies=config.num_d_frequencies,
+                          steps=args.steps, batch_rays=args.batch_rays, learning_rate=args.distill_learning_rate)
+
+    if args.method == 'prune':
+        # Pruned copies of both networks, fine-tuned against the originals
+        model = distill(teacher, prune_model(teacher, args.keep_fraction), **distill_kwargs)
+        model_fine = distill(teacher_fine, prune_model(teacher_fine, args.keep_fraction), **distill_kwargs) if teacher_fine is not None else None
+    else:
+        # One student learns the (fine) network, and replaces both networks with hierarchical sampling
+        target = teacher_fine if teacher_fine is not None else teacher
+        if args.method == 'grid':
+            student = GridStudent(scene_aabb, args.grid_resolution, input_dim_x, input_dim_d, args.width, args.depth)
+        else:
+            student = StudentMLP(input_dim_x, input_dim_d, args.width, args.depth,
+                                 encoder=copy.deepcopy(target.encoder) if target.encoding == 'hash' else None)
+        model = distill(target, student.to(device), **distill_kwargs)
+        model_fine = model if teacher_fine is not None else None
+
+    def render_fn(model, model_fine):
+        return render_test_view(config, dataset.height, dataset.width, dataset.intrinsics, test_pose, model, model_fine)
+
+    results = compare_models(render_fn, [('teacher', teacher, teacher_fine), (args.method, model, model_fine)], test_image)
+    print(format_comparison(results))
+
+    save_compact_model(args.output, model, model_fine, report=results)
+    with open(os.path.splitext(args.output)[0] + '_report.json', 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Wrote %s, render it with --compact-model-path %s" % (args.output, args.output))
+
+
+def run_convert(args):
+    convert_npz_dataset(args.input, args.output, dtype=np.dtype(args.dtype))
+    print("Wrote the memory-mapped dataset %s" % args.output)
+
+
+def run_check(args):
+    if not run_checks():
+        raise SystemExit("Some checks failed")
+
+
+def run_bench(args):
+    device = torch.device(args.device) if args.device is not None else get_device()
+    results = run_benchmarks(args.resolutions, args.samples, args.chunk_sizes, args.repeats, device=device)
+    if args.encoding:
+        results += benchmark_positional_encoding(device=device)
+
+    with open(args.output, 'w') as f:
+        json.dump(benchmark_report(results, device), f, indent=2)
+    print("Wrote %d results to %s" % (len(results), args.output))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='nerf', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help="Train a NeRF and save its weights")
+    add_config_arguments(train_parser)
+    train_parser.set_defaults(run=run_train)
+
+    render_parser = subparsers.add_parser('render', help="Render a camera path with trained weights")
+    add_config_arguments(render_parser)
+    render_parser.add_argument('--camera-path', default=None, help="File of 4x4 camera poses (.npy, .npz or text), an orbit by default")
+    render_parser.add_argument('--frames', type=int, default=120, help="Frames of the orbit")
+    render_parser.add_argument('--spiral-height', type=float, default=0., help="Vertical amplitude of the orbit")
+    render_parser.add_argument('--output', default='novel_views.gif', help="GIF or video file of the frames")
+    render_parser.add_argument('--workers', type=int, default=None, help="Render worker processes, one per CPU core by default")
+    render_parser.add_argument('--fps', type=int, default=30, help="Frame rate of the output")
+    render_parser.set_defaults(run=run_render)
+
+    eval_parser = subparsers.add_parser('eval', help="Render the held-out view with trained weights and report its PSNR")
+    add_config_arguments(eval_parser)
+    eval_parser.add_argument('--baked', action='store_true', help="Evaluate the baked grid of --bake-path instead of the network")
+    eval_parser.add_argument('--psnr-tolerance', type=float, default=0.5,
+                             help="Fail if the inference network (--inference-precision) loses more PSNR than this (dB)")
+    eval_parser.add_argument('--progressive', action='store_true',
+                             help="Also render the held-out view progressively (1/4, 1/2 then full resolution of the regions that vary)")
+    eval_parser.add_argument('--sanity-check', action='store_true', help="Run volumetric_rendering on the sanity check file first")
+    eval_parser.set_defaults(run=run_eval)
+
+    bake_parser = subparsers.add_parser('bake', help="Bake trained weights into a sparse voxel grid")
+    add_config_arguments(bake_parser)
+    bake_parser.set_defaults(run=run_bake)
+
+    serve_parser = subparsers.add_parser('serve', help="Serve novel views of trained weights over HTTP")
+    add_config_arguments(serve_parser)
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--max-batch-rays', type=int, default=2**14, help="Rays of concurrent requests rendered together")
+    serve_parser.add_argument('--batch-window-ms', type=float, default=5., help="Wait for more requests before rendering a batch that is not full")
+    serve_parser.add_argument('--cache-mb', type=float, default=256., help="Memory of the cache of rendered views, 0 disables the cache")
+    serve_parser.add_argument('--cache-dir', default=None, help="Directory of the disk tier of the cache")
+    serve_parser.add_argument('--cache-disk-mb', type=float, default=1024., help="Size of the disk tier of the cache")
+    serve_parser.add_argument('--cache-pose-step', type=float, default=1e-3, help="Quantization of the camera poses of the cache keys")
+    serve_parser.add_argument('--reproject-distance', type=float, default=0.,
+                              help="Reproject the closest cached view if the camera moved less than this, 0 disables reprojection")
+    serve_parser.add_argument('--reproject-degrees', type=float, default=5., help="Largest camera rotation of a reprojection")
+    serve_parser.add_argument('--reproject-max-holes', type=float, default=0.05,
+                              help="Render the view in full if more than this fraction of the reprojected pixels are uncovered")
+    serve_parser.set_defaults(run=run_serve)
+
+    distill_parser = subparsers.add_parser('distill', help="Distill or prune trained weights into a smaller network for rendering")
+    add_config_arguments(distill_parser)
+    distill_parser.add_argument('--method', choices=['student', 'grid', 'prune'], default='student',
+                                help="Small MLP, grid of tiny MLPs, or structured pruning of the trained network(s)")
+    distill_parser.add_argument('--width', type=int, default=64, help="Width of the student MLP(s)")
+    distill_parser.add_argument('--depth', type=int, default=3, help="Hidden layers of the student MLP(s) before the density head")
+    distill_parser.add_argument('--grid-resolution', type=int, default=8, help="Cells per axis of the grid of tiny MLPs")
+    distill_parser.add_argument('--keep-fraction', type=float, default=0.5, help="Fraction of the hidden units kept by pruning")
+    distill_parser.add_argument('--steps', type=int, default=2000, help="Distillation (or fine-tuning) steps")
+    distill_parser.add_argument('--batch-rays', type=int, default=1024, help="Rays per distillation step")
+    distill_parser.add_argument('--distill-learning-rate', type=float, default=1e-3, help="Learning rate of Adam for the distillation")
+    distill_parser.add_argument('--output', default='model_nerf_compact.pt', help="File of the compact network(s), and its _report.json")
+    distill_parser.set_defaults(run=run_distill)
+
+    convert_parser = subparsers.add_parser('convert', help="Convert a .npz dataset to a memory-mapped dataset directory")
+    convert_parser.add_argument('input', help=".npz file with images, poses and intrinsics")
+    convert_parser.add_argument('output', help="Directory of the memory-mapped dataset (use it as --data-path)")
+    convert_parser.add_argument('--dtype', choices=['uint8', 'float32'], default='uint8', help="Storage type of the images")
+    convert_parser.set_defaults(run=run_convert)
+
+    check_parser = subparsers.add_parser('check', help="Check the gradients of the compositing and the inference network numerically")
+    check_parser.set_defaults(run=run_check)
+
+    bench_parser = subparsers.add_parser('bench', help="Benchmark the stages of the pipeline on synthetic data")
+    bench_parser.add_argument('--resolutions', type=int, nargs='+', default=[100])
+    bench_parser.add_argument('--samples', type=int, nargs='+', default=[64])
+    bench_parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[2**15])
+    bench_parser.add_argument('--repeats', type=int, default=3)
+    bench_parser.add_argument('--encoding', action='store_true', help="Also compare the loop and vectorized positional encodings")
+    bench_parser.add_argument('--device', default=None, help="Device of the benchmarks, cuda if available by default")
+    bench_parser.add_argument('--output', default='benchmark_results.json')
+    bench_parser.set_defaults(run=run_bench)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
@@ -0,0 +1,152 @@
+"""
+Configuration shared by the training, rendering and evaluation commands, and construction of the
+networks it describes.
+"""
+
+from dataclasses import dataclass, field
+
+import torch
+
+from .model import nerf_model
+
+
+def option(default, help):
+    return field(default=default, metadata={'help': help})
+
+
+@dataclass
+class NerfConfig:
+
+    """
+    Settings of a NeRF run. Every field is also a command line option of the CLI (--field-name).
+
+    The hash encoding reads the raw positions, so num_x_frequencies is set to 0 and learning_rate to
+    hash_learning_rate when encoding='hash'. With hierarchical sampling, samples is set to coarse_samples.
+    """
+
+    # Data
+    data_path: str = option('lego_data.npz', "Memory-mapped dataset directory or .npz file (the lego scene is downloaded if missing)")
+    num_train_images: int = option(100, "Number of training images, taken from the start of the dataset")
+    test_index: int = option(101, "Index of the held-out view")
+
+    # Model
+    num_x_frequencies: int = option(10, "Frequencies of the positional encoding of the positions")
+    num_d_frequencies: int = option(4, "Frequencies of the positional encoding of the directions")
+    encoding: str = option('sinusoidal', "Encoding of the positions: 'sinusoidal' (8-layer MLP) or 'hash' (hash grid + small MLP)")
+    hash_levels: int = option(16, "Levels of the hash encoding")
+    hash_log2_table_size: int = option(19, "Log2 of the number of entries per level of the hash encoding")
+    hierarchical: bool = option(False, "Coarse network + importance-sampled fine network")
+    coarse_samples: int = option(32, "Samples per ray of the coarse pass")
+    fine_samples: int = option(32, "Samples per ray drawn from the coarse weights for the fine pass")
+    coarse_filter_size: int = option(128, "Width of the coarse network")
+
+    # Rendering
+    samples: int = option(64, "Samples per ray")
+    near: float = option(0.667, "Near bound of the samples along the rays")
+    far: float = option(2., "Far bound of the samples along the rays")
+    transmittance_threshold: float = option(1e-3, "Rendering stops evaluating a ray once its transmittance drops below it (0 disables)")
+    render_memory_budget_mb: float = option(512, "Memory allowed for the sample tensors of one tile when rendering an image")
+    ray_cache_max_mb: float = option(256, "Memory cap of the cache of camera rays (0 for no cap)")
+    clip_to_aabb: bool = option(False, "Sample only the segment of every ray inside the scene box and skip the rays that miss it (rendering)")
+    min_samples: int = option(0, "With --clip-to-aabb, scale the samples of every ray with the length of its segment, down to min_samples (0 disables)")
+    refine_threshold: float = option(0.05, "Local color variation above which progressive rendering renders a pixel again at the next level")
+    compact_model_path: str = option('', "Render with the distilled or pruned network(s) of this file (python -m nerf distill) instead of the trained ones")
+    inference_precision: str = option('none', "Render with the fused, traced inference network in 'fp32', 'bf16' or 'int8' (CPU), 'none' for the training network")
+
+    # Training
+    learning_rate: float = option(5e-4, "Learning rate of Adam")
+    hash_learning_rate: float = option(1e-2, "Learning rate of Adam with the hash encoding")
+    iterations: int = option(3000, "Training iterations")
+    display: int = option(25, "Iterations between quick evaluations of the held-out view")
+    eval_scale: int = option(1, "Resolution divisor of the rendering of the held-out view in the quick evaluations")
+    eval_pixels: int = option(0, "Measure the PSNR of the quick evaluations on that many random pixels of the held-out view (0 for the whole image)")
+    full_eval_every: int = option(0, "Iterations between full resolution evaluations of the held-out view (0 for only the end of training)")
+    eval_in_background: bool = option(False, "Evaluate a snapshot of the weights in a background thread while training continues")
+    eval_dump_dir: str = option('', "Write the renderings of the held-out view and the PSNR curve to this directory (headless)")
+    training_mode: str = option('image', "'image' renders a full training view per iteration, 'rays' a random minibatch of rays")
+    ray_batch_size: int = option(4096, "Rays per iteration in the 'rays' training mode")
+    prefetch_batches: int = option(4, "Minibatches of rays read ahead by a background thread in the 'rays' training mode")
+    images_per_batch: int = option(0, "Draw each minibatch of rays from that many random images (0 for all the training images)")
+    ray_store: bool = option(False, "Precompute the rays of every training pixel and train on them in shuffled epochs ('rays' training mode)")
+    ray_store_path: str = option('', "Directory where the ray store is saved and memory-mapped from ('' keeps it in memory)")
+    perturb: bool = option(False, "Jitter the training samples inside their depth bins")
+    use_occupancy_grid: bool = option(False, "Skip the points of empty cells of an occupancy grid")
+    occupancy_resolution: int = option(64, "Cells per axis of the occupancy grid")
+    occupancy_threshold: float = option(0.5, "Density under which a cell is empty")
+    occupancy_warmup: int = option(256, "Iterations before the first update of the occupancy grid")
+    occupancy_update_every: int = option(16, "Iterations between updates of the occupancy grid")
+    occupancy_cells_per_update: int = option(2**15, "Random cells queried by each update of the occupancy grid")
+    show_plots: bool = option(False, "Show the held-out view and the PSNR curve with matplotlib at every evaluation (blocks training)")
+
+    # Distributed training
+    processes_per_node: int = option(1, "Training processes on this machine, each training on its share of the rays of every step (gloo, CPU)")
+    num_nodes: int = option(1, "Machines taking part in the distributed training")
+    node_rank: int = option(0, "Index of this machine among the num_nodes ones (0 evaluates and saves the results)")
+    master_addr: str = option('127.0.0.1', "Address of the node of rank 0 in a distributed training")
+    master_port: int = option(29500, "Port of the node of rank 0 in a distributed training")
+
+    # Profiling
+    profile: bool = option(False, "Time the stages of the training steps and renderings and print them at every display")
+    profile_trace_dir: str = option('', "Write a torch.profiler Chrome trace of a few training steps to this directory")
+    profile_trace_steps: int = option(5, "Training steps recorded in the Chrome trace, after 5 steps of warm up")
+
+    # Outputs
+    checkpoint_path: str = option('model_nerf.pt', "Weights of the (coarse) network")
+    checkpoint_fine_path: str = option('model_nerf_fine.pt', "Weights of the fine network")
+    output_image: str = option('test_lego.png', "Rendering of the held-out view")
+    checkpoint_dir: str = option('checkpoints', "Directory of the periodic training checkpoints")
+    checkpoint_every: int = option(500, "Iterations between training checkpoints (0 disables them)")
+    keep_checkpoints: int = option(3, "Number of most recent training checkpoints kept")
+    resume: bool = option(False, "Continue training from the latest checkpoint of checkpoint_dir")
+    bake_after_training: bool = option(False, "Bake the trained network into a sparse voxel grid")
+    bake_resolution: int = option(128, "Vertices per axis of the baked grid")
+    bake_sh_degree: int = option(2, "Degree of the spherical harmonics of the baked grid")
+    bake_path: str = option('model_nerf_baked.npz', "Baked voxel grid")
+
+    def __post_init__(self):
+        if self.encoding == 'hash':
+            self.num_x_frequencies = 0
+            self.learning_rate = self.hash_learning_rate
+        if self.hierarchical:
+            self.samples = self.coarse_samples
+
+
+def get_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def build_models(config, scene_aabb, device):
+
+    """
+    Create the network(s) described by the configuration.
+
+    Returns:
+    model: The network, the coarse one with hierarchical sampling.
+    model_fine: The fine network, None without hierarchical sampling.
+    """
+
+    model_kwargs = dict(num_x_frequencies=config.num_x_frequencies, num_d_frequencies=config.num_d_frequencies, encoding=config.encoding,
+                        aabb=scene_aabb, hash_levels=config.hash_levels, hash_log2_table_size=config.hash_log2_table_size)
+
+    if config.hierarchical:
+        model = nerf_model(filter_size=config.coarse_filter_size, **model_kwargs).to(device)
+        model_fine = nerf_model(**model_kwargs).to(device)
+    else:
+        model = nerf_model(**model_kwargs).to(device)
+        model_fine = None
+
+    return model, model_fine
+
+
+def load_models(config, scene_aabb, device):
+
+    """
+    Create the network(s) described by the configuration and load their trained weights.
+    """
+
+    model, model_fine = build_models(config, scene_aabb, device)
+    model.load_state_dict(torch.load(config.checkpoint_path, map_location=device))
+    if model_fine is not None:
+        model_fine.load_state_dict(torch.load(config.checkpoint_fine_path, map_location=device))
+
+    return model, model_fine
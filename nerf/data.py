@@ -0,0 +1,116 @@
+"""
+Loading of the dataset (images, camera poses and intrinsics) and image display/saving helpers.
+
+gdown, matplotlib and imageio are only imported by the functions that need them.
+"""
+
+import os
+
+import numpy as np
+import torch
+
+from .rendering import volumetric_rendering
+
+LEGO_DATA_URL = "https://drive.google.com/file/d/13eBK_LWxs4SkruFKH7glKK9jwQU1BkXK/view?usp=sharing"
+SANITY_VOLUMETRIC_URL = "https://drive.google.com/file/d/1ag6MqSh3h4KY10Mcx5fKxt9roGNLLILK/view?usp=sharing"
+
+
+def download(url, path):
+
+    """
+    Download a file from Google Drive, unless it already exists.
+    """
+
+    if not os.path.exists(path):
+        import gdown
+        gdown.download(url=url, output=path, quiet=False, fuzzy=True)
+
+    return path
+
+
+def load_data(path='lego_data.npz', device=None, num_train_images=100, test_index=101):
+
+    """
+    Load the images, the camera to world transformations (poses) and the intrinsics K of the camera.
+    The lego scene is downloaded to path if it does not exist.
+
+    Returns:
+    images (torch.Tensor): Training images. Shape: (num_train_images, height, width, 3).
+    poses (torch.Tensor): Camera to world transformations of all the images. Shape: (num_images, 4, 4).
+    intrinsics (torch.Tensor): Camera intrinsics matrix. Shape: (3, 3).
+    test_image (torch.Tensor): The held-out image. Shape: (height, width, 3).
+    test_pose (torch.Tensor): Camera to world transformation of the held-out image. Shape: (4, 4).
+    """
+
+    download(LEGO_DATA_URL, path)
+    data = np.load(path)
+
+    # Camera extrinsics (poses) and intrinsics
+    poses = torch.from_numpy(data["poses"]).to(device)
+    intrinsics = torch.from_numpy(data["intrinsics"]).to(device)
+
+    # Hold one image out (for test).
+    images = data["images"]
+    test_image, test_pose = torch.from_numpy(images[test_index]).to(device), poses[test_index]
+
+    # Map images to device
+    images = torch.from_numpy(images[:num_train_images, ..., :3]).to(device)
+
+    return images, poses, intrinsics, test_image, test_pose
+
+
+def save_image(path, image):
+
+    """
+    Save an image with values in [0, 1]. Shape: (height, width, 3).
+    """
+
+    import imageio.v2 as imageio
+
+    image = image.detach().cpu().numpy() if torch.is_tensor(image) else np.asarray(image)
+    imageio.imwrite(path, (255 * np.clip(image, 0, 1)).astype(np.uint8))
+
+
+def plot_all_poses(poses):
+
+    import matplotlib.pyplot as plt
+
+    print("Poses: ", poses.shape)
+    origins = poses[:, :3, 3]
+    directions = poses[:, :3, 2]  # Assuming z-axis points forward
+
+
+
+
+    ax = plt.figure(figsize=(12, 8)).add_subplot(projection='3d')
+    _ = ax.quiver(origins[..., 0].flatten(),
+                  origins[..., 1].flatten(),
+                  origins[..., 2].flatten(),
+                  directions[..., 0].flatten(),
+                  directions[..., 1].flatten(),
+                  directions[..., 2].flatten(), length=0.12, normalize=True)
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.set_zlabel('z')
+    plt.show()
+
+
+def volumetric_sanity_check(path='sanity_volumentric.pt', show=True):
+
+    """
+    Run volumetric_rendering on the sanity_volumentric.pt file, the expected output is a sphere on
+    blue background.
+    """
+
+    download(SANITY_VOLUMETRIC_URL, path)
+    rbd = torch.load(path)
+    rec_image = volumetric_rendering(rbd['rgb'], rbd['sigma'], rbd['depth_points'])
+
+    if show:
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=(10, 5))
+        plt.imshow(rec_image.detach().cpu().numpy())
+        plt.title(f'Volumentric rendering of a sphere with $\\sigma={0.2}$, on blue background')
+        plt.show()
+
+    return rec_image
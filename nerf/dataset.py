@@ -0,0 +1,244 @@
+"""
+Datasets of calibrated views that are read on demand instead of copied to the device up front.
+
+A memory-mapped dataset is a directory with three .npy files:
+
+    images.npy      (num_images, height, width, channels), uint8 (0-255) or float32 (0-1)
+    poses.npy       (num_images, 4, 4) camera to world transformations
+    intrinsics.npy  (3, 3) camera intrinsics matrix
+
+images.npy is opened with np.load(mmap_mode='r'): opening the dataset does not read any pixel, and
+training only reads the pixels of the rays it samples. write_memmap_dataset streams the images to disk
+one at a time, so datasets larger than the memory can be created (python -m nerf convert).
+"""
+
+import os
+import queue
+import threading
+
+import numpy as np
+import torch
+
+from .data import LEGO_DATA_URL, download
+from .rays import get_pixel_rays
+
+
+def write_memmap_dataset(root, images, poses, intrinsics, num_images=None, dtype=np.uint8):
+
+    """
+    Write a memory-mapped dataset, reading the images one at a time.
+
+    Args:
+    root (str): Directory of the dataset, created if needed.
+    images: Array or iterable of images with values in [0, 1]. Shape of each image: (height, width, channels).
+    poses: Camera to world transformations. Shape: (num_images, 4, 4).
+    intrinsics: Camera intrinsics matrix. Shape: (3, 3).
+    num_images (optional, int): Number of images, len(images) by default.
+    dtype (optional): np.uint8 stores the images in a quarter of the space of np.float32.
+    """
+
+    os.makedirs(root, exist_ok=True)
+    poses = np.asarray(poses, dtype=np.float32)
+    num_images = num_images if num_images is not None else len(images)
+
+    stored = None
+    for index, image in enumerate(images):
+        image = np.asarray(image)
+        if stored is None:
+            stored = np.lib.format.open_memmap(os.path.join(root, 'images.npy'), mode='w+', dtype=dtype,
+                                               shape=(num_images,) + image.shape)
+        if dtype == np.uint8:
+            image = np.round(255 * np.clip(image, 0, 1))
+        stored[index] = image
+    stored.flush()
+
+    np.save(os.path.join(root, 'poses.npy'), poses[:num_images])
+    np.save(os.path.join(root, 'intrinsics.npy'), np.asarray(intrinsics, dtype=np.float32))
+
+
+def convert_npz_dataset(npz_path, root, dtype=np.uint8):
+
+    """
+    Convert a dataset in the format of lego_data.npz to a memory-mapped dataset.
+    """
+
+    data = np.load(npz_path)
+    images = data["images"]
+    write_memmap_dataset(root, images, data["poses"], data["intrinsics"], dtype=dtype)
+
+
+class ViewDataset:
+
+    """
+    Calibrated views read on demand, from a memory-mapped dataset directory or from a .npz file (whose
+    arrays are loaded in memory, but not copied to the device).
+
+    The training views are the first num_train_images images, the poses and the intrinsics are small and
+    kept on the device.
+    """
+
+    def __init__(self, path, device=None, num_train_images=None):
+        self.path = path
+        if os.path.isdir(path):
+            self.images = np.load(os.path.join(path, 'images.npy'), mmap_mode='r')
+            poses = np.load(os.path.join(path, 'poses.npy'))
+            intrinsics = np.load(os.path.join(path, 'intrinsics.npy'))
+        else:
+            data = np.load(path)
+            self.images, poses, intrinsics = data["images"], data["poses"], data["intrinsics"]
+
+        self.device = device
+        self.cpu_poses = torch.from_numpy(np.asarray(poses)).float()
+        self.cpu_intrinsics = torch.from_numpy(np.asarray(intrinsics)).float()
+        self.poses = self.cpu_poses.to(device)
+        self.intrinsics = self.cpu_intrinsics.to(device)
+        self.height, self.width = self.images.shape[1:3]
+        self.num_train_images = min(num_train_images or self.images.shape[0], self.images.shape[0])
+
+    def __len__(self):
+        return self.num_train_images
+
+    def image_sources(self):
+        # The files the images are read from
+        return [os.path.join(self.path, 'images.npy')] if os.path.isdir(self.path) else [self.path]
+
+    def to_float(self, pixels):
+        pixels = torch.from_numpy(np.ascontiguousarray(pixels[..., :3]))
+        return pixels.float() / 255 if pixels.dtype == torch.uint8 else pixels.float()
+
+    def load_image(self, index, device=None):
+
+        """
+        Read one image. Shape: (height, width, 3).
+        """
+
+        return self.to_float(self.images[index]).to(device if device is not None else self.device)
+
+    def sample_rays(self, batch_size, images_per_batch=0, rng=None, device=None):
+
+        """
+        Draw a random minibatch of rays (with replacement) across the training images, reading only the
+        pixels of the sampled rays.
+
+        Args:
+        batch_size (int): Number of rays.
+        images_per_batch (optional, int): If > 0, the rays are drawn from that many random images, which
+          reads fewer pages of a memory-mapped dataset than rays spread over all the images.
+        rng (optional, np.random.Generator): Random generator, one per thread.
+        device (optional): Device of the returned tensors, the device of the dataset by default.
+
+        Returns:
+        A tuple (ray_origins, ray_directions, target_rgb), each of shape (batch_size, 3).
+        """
+
+        rng = rng if rng is not None else np.random.default_rng()
+        device = device if device is not None else self.device
+
+        if images_per_batch > 0:
+            image_choices = rng.choice(self.num_train_images, min(images_per_batch, self.num_train_images), replace=False)
+            image_indices = image_choices[rng.integers(len(image_choices), size=batch_size)]
+        else:
+            image_indices = rng.integers(self.num_train_images, size=batch_size)
+        rows = rng.integers(self.height, size=batch_size)
+        cols = rng.integers(self.width, size=batch_size)
+
+        # Read the pixels in the order of the file
+        order = np.argsort((image_indices * self.height + rows) * self.width + cols)
+        image_indices, rows, cols = image_indices[order], rows[order], cols[order]
+        target_rgb = self.to_float(self.images[image_indices, rows, cols])
+
+        # Compute the rays on the device they are returned on
+        if device is not None and torch.device(device).type == 'cpu':
+            poses, intrinsics = self.cpu_poses, self.cpu_intrinsics
+        else:
+            poses, intrinsics = self.poses, self.intrinsics
+        image_indices, rows, cols = (torch.from_numpy(a).to(poses.device) for a in (image_indices, rows, cols))
+        ray_origins, ray_directions = get_pixel_rays(intrinsics, poses[image_indices], rows, cols)
+
+        return ray_origins, ray_directions, target_rgb.to(poses.device)
+
+
+def open_dataset(path, device=None, num_train_images=None):
+
+    """
+    Open a memory-mapped dataset directory or a .npz dataset, the lego scene is downloaded to path if it
+    does not exist.
+    """
+
+    if not os.path.exists(path):
+        download(LEGO_DATA_URL, path)
+
+    return ViewDataset(path, device, num_train_images)
+
+
+class RayBatchPrefetcher:
+
+    """
+    Draw minibatches of rays from a dataset in a background thread, num_prefetch batches ahead of the
+    training loop, so that reading the pixels overlaps with the training steps.
+
+    The batches are built on the CPU (in pinned memory for a CUDA device) and copied to the device by next().
+    Batch k is drawn with a generator seeded by (seed, k), or (seed, k, shard) for the shard of a process
+    of a distributed training, so a run resumed with the same seed and start_batch gets the same batches
+    as the interrupted one.
+    """
+
+    def __init__(self, dataset, batch_size, device=None, num_prefetch=4, images_per_batch=0, seed=None, start_batch=0, shard=None):
+        self.dataset = dataset
+        self.seed = seed if seed is not None else int(np.random.randint(2**31))
+        self.shard = shard
+        self.batch_size = batch_size
+        self.device = device if device is not None else dataset.device
+        self.images_per_batch = images_per_batch
+        self.pin_memory = torch.device(self.device).type == 'cuda' if self.device is not None else False
+        self.batches = queue.Queue(maxsize=num_prefetch)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(start_batch,), daemon=True)
+        self.thread.start()
+
+    def make_batch(self, batch_index):
+        rng = np.random.default_rng((self.seed, batch_index) if self.shard is None else (self.seed, batch_index, self.shard))
+        return self.dataset.sample_rays(self.batch_size, self.images_per_batch, rng=rng, device='cpu')
+
+    def run(self, batch_index):
+        try:
+            while not self.stopped.is_set():
+                batch = self.make_batch(batch_index)
+                batch_index += 1
+                if self.pin_memory:
+                    batch = tuple(t.pin_memory() for t in batch)
+                self.put(batch)
+        except Exception as error:
+            # Raised in the training loop by next()
+            self.put(error)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def next(self):
+        batch = self.batches.get()
+        if isinstance(batch, Exception):
+            raise batch
+
+        return tuple(t.to(self.device, non_blocking=True) for t in batch)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.next()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
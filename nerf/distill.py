@@ -0,0 +1,332 @@
+"""
+Compact networks for deployment, trained from a trained NeRF (the teacher):
+
+- StudentMLP: a narrower and shallower MLP with the inputs and outputs of nerf_model.
+- GridStudent: a grid of tiny MLPs over the scene box, every point is evaluated by the MLP of its cell.
+- prune_model: structured pruning of the hidden units of the layers of a nerf_model (its ModuleDict),
+  by the norms of their incoming and outgoing weights.
+
+The students, and the pruned networks for fine-tuning, are trained on the sigma and the color predicted
+by the teacher at points sampled along the rays of the training images (distill). compare_models
+renders the held-out view with each network to report the speed/PSNR trade-off.
+"""
+
+import copy
+import math
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .rendering import run_network, volumetric_rendering
+from .sampling import stratified_sampling
+
+
+class StudentMLP(nn.Module):
+
+    """
+    Small NeRF MLP: depth layers of width width on the encoded positions, a density head, and one hidden
+    layer of width width // 2 on the features and the encoded directions for the color.
+
+    With encoder (e.g. a copy of the HashGridEncoding of a hash teacher, trained with the student), the
+    positions are encoded by it from their raw coordinates, which come first in x.
+    """
+
+    def __init__(self, input_dim_x, input_dim_d, width=64, depth=3, encoder=None):
+        super().__init__()
+        self.encoding = 'student'
+        self.encoder = encoder
+        input_dim = encoder.output_dim if encoder is not None else input_dim_x
+
+        self.layers = nn.ModuleList([nn.Linear(input_dim if i == 0 else width, width) for i in range(depth)])
+        self.head = nn.Linear(width, 1 + width)  # Density (sigma) and features
+        self.color = nn.Linear(width + input_dim_d, width // 2)
+        self.output = nn.Linear(width // 2, 3)  # RGB (sigmoid)
+
+    def forward(self, x, d):
+        h = self.encoder(x[..., :3]) if self.encoder is not None else x
+        for layer in self.layers:
+            h = F.relu(layer(h))
+
+        h = self.head(h)
+        sigma = F.relu(h[..., :1])
+        h = F.relu(self.color(torch.cat([h[..., 1:], d], dim=-1)))
+        rgb = torch.sigmoid(self.output(h))
+
+        return rgb, sigma
+
+
+class GridStudent(nn.Module):
+
+    """
+    resolution^3 tiny MLPs over the scene box aabb, with the architecture of StudentMLP. The weights of all
+    the cells are stored in stacked tensors, and the points of every cell are evaluated together, so that a
+    point only costs the multiply-adds of one tiny MLP.
+    """
+
+    def __init__(self, aabb, resolution, input_dim_x, input_dim_d, width=32, depth=2):
+        super().__init__()
+        self.encoding = 'grid_student'
+        self.resolution = resolution
+        self.register_buffer('aabb', aabb.detach().clone().float())
+
+        num_cells = resolution ** 3
+        shapes = [(input_dim_x if i == 0 else width, width) for i in range(depth)]
+        shapes += [(width, 1 + width), (width + input_dim_d, width // 2), (width // 2, 3)]
+        self.weights = nn.ParameterList()
+        self.biases = nn.ParameterList()
+        for fan_in, fan_out in shapes:
+            bound = math.sqrt(6 / (fan_in + fan_out))  # Xavier uniform, as weights_init
+            self.weights.append(nn.Parameter(torch.empty(num_cells, fan_in, fan_out).uniform_(-bound, bound)))
+            self.biases.append(nn.Parameter(torch.zeros(num_cells, fan_out)))
+
+    def cell_index(self, points):
+        coords = ((points - self.aabb[0]) / (self.aabb[1] - self.aabb[0]) * self.resolution).long().clamp(0, self.resolution - 1)
+        return (coords[..., 0] * self.resolution + coords[..., 1]) * self.resolution + coords[..., 2]
+
+    def forward_cell(self, cell, x, d):
+        W, b = self.weights, self.biases
+        depth = len(W) - 3
+        h = x
+        for i in range(depth):
+            h = F.relu(h @ W[i][cell] + b[i][cell])
+
+        h = h @ W[depth][cell] + b[depth][cell]
+        sigma = F.relu(h[..., :1])
+        h = F.relu(torch.cat([h[..., 1:], d], dim=-1) @ W[depth + 1][cell] + b[depth + 1][cell])
+        rgb = torch.sigmoid(h @ W[depth + 2][cell] + b[depth + 2][cell])
+
+        return rgb, sigma
+
+    def forward(self, x, d):
+        cells = self.cell_index(x[..., :3])
+
+        # Group the points by cell, evaluate every non-empty cell and put the outputs back in the order of the points
+        cells, order = torch.sort(cells)
+        x, d = x[order], d[order]
+        unique_cells, counts = torch.unique_consecutive(cells, return_counts=True)
+        rgb_parts, sigma_parts = [], []
+        start = 0
+        for cell, cell_count in zip(unique_cells.tolist(), counts.tolist()):
+            rgb_cell, sigma_cell = self.forward_cell(cell, x[start:start + cell_count], d[start:start + cell_count])
+            rgb_parts.append(rgb_cell)
+            sigma_parts.append(sigma_cell)
+            start += cell_count
+
+        inverse = torch.empty_like(order).scatter_(0, order, torch.arange(order.shape[0], device=order.device))
+        return torch.cat(rgb_parts)[inverse], torch.cat(sigma_parts)[inverse]
+
+    def macs_per_point(self):
+        return sum(weight.shape[1] * weight.shape[2] for weight in self.weights)
+
+
+def macs_per_point(model):
+
+    """
+    Multiply-adds of the network per sample point (of one cell for a GridStudent, without the hash encoding).
+    """
+
+    if hasattr(model, 'macs_per_point'):
+        return model.macs_per_point()
+    return sum(m.in_features * m.out_features for m in model.modules() if isinstance(m, nn.Linear))
+
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+# Consumers of the outputs of every prunable layer of nerf_model. The outputs of a layer are the first
+# columns of the inputs of its consumers (the skip connection and the directions come after them).
+PRUNABLE_LAYERS = {
+    'sinusoidal': {
+        'layer_1': ['layer_2'], 'layer_2': ['layer_3'], 'layer_3': ['layer_4'], 'layer_4': ['layer_5'],
+        'layer_5': ['layer_6'], 'layer_6': ['layer_7'], 'layer_7': ['layer_8'], 'layer_8': ['layer_s', 'layer_9'],
+        'layer_9': ['layer_10'], 'layer_10': ['layer_11'],
+    },
+    'hash': {'layer_1': ['layer_2'], 'layer_3': ['layer_4'], 'layer_4': ['layer_5']},
+}
+
+
+def prune_model(model, keep_fraction=0.5):
+
+    """
+    Structured pruning of a nerf_model: remove the hidden units of lowest importance, the product of the norm
+    of their incoming weights and the norm of their outgoing weights, from every hidden layer.
+
+    The same fraction of the units is kept in every layer, so that the layers of the trunk keep equal widths
+    and the pruned network still builds an InferenceModel.
+
+    Args:
+    model: The trained nerf_model, left unchanged.
+    keep_fraction (optional, float): Fraction of the hidden units of every layer that are kept.
+
+    Returns:
+    The pruned copy of the network.
+    """
+
+    layers = model.layers
+    consumers = PRUNABLE_LAYERS[model.encoding]
+    producers = {consumer: name for name, names in consumers.items() for consumer in names}
+
+    # Units kept in the outputs of every prunable layer, ranked on the unpruned weights
+    kept = {}
+    with torch.no_grad():
+        for name, names in consumers.items():
+            weight = layers[name].weight
+            outgoing = sum(layers[consumer].weight[:, :weight.shape[0]].pow(2).sum(0) for consumer in names).sqrt()
+            importance = weight.norm(dim=1) * outgoing
+            num_kept = max(1, round(keep_fraction * weight.shape[0]))
+            kept[name] = torch.sort(torch.topk(importance, num_kept).indices).values
+
+    pruned = copy.deepcopy(model)
+    with torch.no_grad():
+        for name, layer in layers.items():
+            rows = kept.get(name, torch.arange(layer.out_features, device=layer.weight.device))
+            if name in producers:
+                produced = layers[producers[name]].out_features
+                columns = torch.cat([kept[producers[name]], torch.arange(produced, layer.in_features, device=layer.weight.device)])
+            else:
+                columns = torch.arange(layer.in_features, device=layer.weight.device)
+
+            new_layer = nn.Linear(columns.numel(), rows.numel(), device=layer.weight.device, dtype=layer.weight.dtype)
+            new_layer.weight.copy_(layer.weight[rows][:, columns])
+            new_layer.bias.copy_(layer.bias[rows])
+            pruned.layers[name] = new_layer
+
+    return pruned
+
+
+def distill(teacher, student, dataset, near, far, samples, num_x_frequencies, num_d_frequencies,
+            steps=2000, batch_rays=1024, learning_rate=1e-3, seed=0, log_every=200):
+
+    """
+    Train student to reproduce the outputs of teacher at points sampled along random training rays.
+
+    The color is matched where it is seen, weighted by the rendering weights of the teacher, and the density
+    everywhere, in log space (densities span orders of magnitude).
+
+    Args:
+    teacher: The trained network (left unchanged).
+    student: The network to train, e.g. a StudentMLP, a GridStudent or a pruned copy of the teacher.
+    dataset (ViewDataset): The training views, the rays are drawn from them.
+    near, far, samples: Stratified sampling of the points along the rays.
+    num_x_frequencies: Number of frequencies used to encode the sample positions.
+    num_d_frequencies: Number of frequencies used to encode the ray directions.
+    steps (optional, int): Optimization steps.
+    batch_rays (optional, int): Rays per step.
+    learning_rate (optional, float): Learning rate of Adam.
+    seed (optional, int): Seed of the rays.
+    log_every (optional, int): Steps between prints of the loss (0 for none).
+
+    Returns:
+    The trained student.
+    """
+
+    teacher.eval()
+    student.train()
+    parameters = [p for p in student.parameters() if p.requires_grad]
+    optimizer = torch.optim.Adam(parameters, lr=learning_rate)
+    rng = np.random.default_rng(seed)
+
+    t = time.time()
+    for step in range(1, steps + 1):
+        ray_origins, ray_directions, _ = dataset.sample_rays(batch_rays, rng=rng)
+        ray_points, depth_points = stratified_sampling(ray_origins, ray_directions, near, far, samples, perturb=True)
+
+        with torch.no_grad():
+            rgb_teacher, sigma_teacher = run_network(ray_points, ray_directions, teacher, num_x_frequencies, num_d_frequencies)
+            _, weights = volumetric_rendering(rgb_teacher, sigma_teacher, depth_points, return_weights=True)
+
+        rgb, sigma = run_network(ray_points, ray_directions, student, num_x_frequencies, num_d_frequencies)
+        color_loss = (weights[..., None] * (rgb - rgb_teacher) ** 2).sum(-2).mean()
+        density_loss = F.mse_loss(torch.log1p(sigma), torch.log1p(sigma_teacher))
+        loss = color_loss + density_loss
+
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+        if log_every and step % log_every == 0:
+            print("Distillation step %d  color loss: %.5f  density loss: %.5f  (%.2f secs per step)" %
+                  (step, color_loss.item(), density_loss.item(), (time.time() - t) / log_every))
+            t = time.time()
+
+    return student.eval()
+
+
+def compare_models(render_fn, candidates, test_image, repeats=1):
+
+    """
+    Render the held-out view with every candidate and report its cost and quality.
+
+    Args:
+    render_fn: Function (model, model_fine) -> image rendering the held-out view.
+    candidates (list): Tuples (name, model, model_fine), the teacher first.
+    test_image: The ground truth held-out view. Shape: (height, width, 3).
+    repeats (optional, int): Timed renders per candidate (after one warm up render).
+
+    Returns:
+    A list of dicts with the name, the parameters, the multiply-adds per point, the seconds per frame, the
+    PSNR against the ground truth and against the rendering of the teacher, and the speedup over the teacher.
+    """
+
+    results = []
+    teacher_image = None
+    for name, model, model_fine in candidates:
+        with torch.no_grad():
+            image = render_fn(model, model_fine)
+            if test_image.is_cuda:
+                torch.cuda.synchronize()
+            t = time.time()
+            for _ in range(repeats):
+                image = render_fn(model, model_fine)
+            if test_image.is_cuda:
+                torch.cuda.synchronize()
+            secs = (time.time() - t) / repeats
+
+        teacher_image = image if teacher_image is None else teacher_image
+        results.append({
+            'name': name,
+            'parameters': count_parameters(model) + (count_parameters(model_fine) if model_fine is not None and model_fine is not model else 0),
+            'macs_per_point': macs_per_point(model_fine if model_fine is not None else model),
+            'secs_per_frame': secs,
+            'psnr': (10 * torch.log10(1. / F.mse_loss(image, test_image))).item(),
+            'psnr_vs_teacher': (10 * torch.log10(1. / F.mse_loss(image, teacher_image).clamp(min=1e-10))).item(),
+            'speedup': results[0]['secs_per_frame'] / secs if results else 1.,
+        })
+
+    return results
+
+
+def format_comparison(results):
+    lines = ["%-16s %12s %12s %10s %8s %8s %12s" % ('Network', 'parameters', 'MACs/point', 'secs/frame', 'speedup', 'PSNR', 'vs teacher')]
+    for result in results:
+        lines.append("%-16s %12d %12d %10.3f %7.2fx %8.2f %12.2f" %
+                     (result['name'], result['parameters'], result['macs_per_point'], result['secs_per_frame'],
+                      result['speedup'], result['psnr'], result['psnr_vs_teacher']))
+    return '\n'.join(lines)
+
+
+def save_compact_model(path, model, model_fine=None, report=None):
+
+    """
+    Save a distilled or pruned network. The modules are saved whole, as their layer shapes no longer follow
+    the constructor of nerf_model.
+    """
+
+    torch.save({'model': model, 'model_fine': model_fine, 'report': report}, path)
+
+
+def load_compact_model(path, device=None):
+
+    """
+    Load a network saved by save_compact_model.
+
+    Returns:
+    A tuple (model, model_fine), model_fine is None for a single network.
+    """
+
+    compact = torch.load(path, map_location=device, weights_only=False)
+    return compact['model'].eval(), compact['model_fine'].eval() if compact['model_fine'] is not None else None
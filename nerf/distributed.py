@@ -0,0 +1,88 @@
+"""
+Data-parallel training over several processes with torch.distributed (gloo backend, on the CPU).
+
+Every process holds a replica of the network(s) and trains on its own shard of each step: a
+1/world_size slice of the minibatch in the 'rays' mode, its own random image in the 'image' mode.
+The gradients are averaged with a single all-reduce per step, so the replicas (and their optimizers)
+stay identical. The occupancy grid updates are split between the processes and merged with a max.
+"""
+
+import torch
+import torch.distributed as dist
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def init_process_group(rank, world_size, master_addr='127.0.0.1', master_port=29500):
+    dist.init_process_group('gloo', init_method='tcp://%s:%d' % (master_addr, master_port), rank=rank, world_size=world_size)
+
+
+def barrier():
+    dist.barrier()
+
+
+def broadcast_object(obj):
+
+    """
+    The obj of rank 0, on every rank.
+    """
+
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+
+def broadcast_parameters(modules):
+
+    """
+    Copy the parameters and buffers of rank 0 to the other ranks, None modules are skipped.
+    """
+
+    for module in modules:
+        if module is None:
+            continue
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            dist.broadcast(tensor.data, src=0)
+
+
+def all_reduce_gradients(parameters, world_size):
+
+    """
+    Average the gradients of parameters over the ranks, in one all-reduce of a flat buffer (a parameter
+    without gradient on a rank counts as a zero gradient).
+    """
+
+    parameters = list(parameters)
+    flat = torch.cat([(p.grad if p.grad is not None else torch.zeros_like(p)).reshape(-1) for p in parameters])
+    dist.all_reduce(flat)
+    flat /= world_size
+
+    offset = 0
+    for p in parameters:
+        grad = flat[offset:offset + p.numel()].view_as(p)
+        if p.grad is None:
+            p.grad = grad.clone()
+        else:
+            p.grad.copy_(grad)
+        offset += p.numel()
+
+
+def sync_occupancy_grid(occupancy_grid):
+
+    """
+    Merge the occupancy grids of the ranks after each of them updated its own random cells. The decay is
+    the same on every rank, so the max keeps the newest density of every queried cell.
+    """
+
+    dist.all_reduce(occupancy_grid.density, op=dist.ReduceOp.MAX)
+    occupancy_grid.occupied = occupancy_grid.density > occupancy_grid.density_threshold
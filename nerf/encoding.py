@@ -0,0 +1,195 @@
+"""
+Encodings of the network inputs: the sinusoidal positional encoding of the NeRF paper and the
+learnable multiresolution hash-grid encoding.
+"""
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def positional_encoding_loop(x, num_frequencies, incl_input=True):
+
+    """
+    Reference implementation of positional_encoding, looping over the frequencies.
+    Kept for benchmark_positional_encoding.
+
+    Args:
+    x (torch.Tensor): Input tensor to be positionally encoded.
+      The dimension of x is [N, D], where N is the number of input coordinates,
+      and D is the dimension of the input coordinate.
+    num_frequencies (optional, int): The number of frequencies used in
+     the positional encoding (default: 6).
+    incl_input (optional, bool): If True, concatenate the input with the
+        computed positional encoding (default: True).
+
+    Returns:
+    (torch.Tensor): Positional encoding of the input tensor.
+    """
+
+    results = []
+    if incl_input:
+        results.append(x)
+    # encode input tensor and append the encoded tensor to the list of results.
+    # num_frequencies corresponds to L in the formula
+    for i in range(num_frequencies):
+        # Calculate frequency 2^i * pi
+        frequency = 2**i * np.pi
+
+        # Apply sin and cos functions element-wise
+        sin_encoding = torch.sin(frequency * x)
+        cos_encoding = torch.cos(frequency * x)
+
+        # Append to results
+        results.extend([sin_encoding, cos_encoding])
+    return torch.cat(results, dim=-1)
+
+
+def positional_encoding(x, num_frequencies, incl_input=True, out=None):
+
+    """
+    Apply positional encoding to the input.
+
+    All the frequency bands are computed at once, directly into the output tensor. The output
+    layout is the one of positional_encoding_loop: [x, sin(2^0 pi x), cos(2^0 pi x), sin(2^1 pi x), ...].
+
+    Args:
+    x (torch.Tensor): Input tensor to be positionally encoded.
+      The dimension of x is [N, D], where N is the number of input coordinates,
+      and D is the dimension of the input coordinate.
+    num_frequencies (optional, int): The number of frequencies used in
+     the positional encoding (default: 6).
+    incl_input (optional, bool): If True, concatenate the input with the
+        computed positional encoding (default: True).
+    out (optional, torch.Tensor): Preallocated output of shape [N, D * (incl_input + 2 * num_frequencies)],
+        e.g. to reuse one buffer across chunks. Not supported when x requires gradients.
+
+    Returns:
+    (torch.Tensor): Positional encoding of the input tensor.
+    """
+
+    dim = x.shape[-1]
+    frequencies = (2. ** torch.arange(num_frequencies, device=x.device, dtype=x.dtype)) * np.pi
+
+    if x.requires_grad:
+        # out= writes are not differentiable, build the encoding out of place instead
+        if out is not None:
+            raise ValueError("positional_encoding cannot write to 'out' when the input requires gradients")
+        scaled = x[..., None, :] * frequencies[:, None]
+        bands = torch.stack([torch.sin(scaled), torch.cos(scaled)], -2).flatten(-3)
+        return torch.cat([x, bands], -1) if incl_input else bands
+
+    if out is None:
+        out = x.new_empty(*x.shape[:-1], dim * (int(incl_input) + 2 * num_frequencies))
+
+    offset = 0
+    if incl_input:
+        out[..., :dim] = x
+        offset = dim
+
+    if num_frequencies > 0:
+        # View of the output as [N, num_frequencies, (sin, cos), D]
+        bands = out[..., offset:].view(*x.shape[:-1], num_frequencies, 2, dim)
+
+        # Write the scaled input in the sin slots, take its cos, then its sin in place
+        torch.mul(x[..., None, :], frequencies[:, None], out=bands[..., 0, :])
+        torch.cos(bands[..., 0, :], out=bands[..., 1, :])
+        bands[..., 0, :].sin_()
+
+    return out
+
+
+def normalize_coord(height, width, num_frequencies, device=None):
+
+    """
+    Creates the 2D normalized coordinates, and applies positional encoding to them
+
+    Args:
+    height (int): Height of the image
+    width (int): Width of the image
+    num_frequencies (optional, int): The number of frequencies used in
+      the positional encoding (default: 6).
+    device (optional, torch.device): Device of the coordinates.
+
+    Returns:
+    (torch.Tensor): Returns the 2D normalized coordinates after applying positional encoding to them.
+    """
+
+
+    # Create the 2D normalized coordinates, and apply positional encoding to them
+
+    # Create a range of values for x and y coordinates
+    x_range = torch.linspace(0, 1, width, device=device)  # width values between 0 and 1
+    y_range = torch.linspace(0, 1, height, device=device) # height values between 0 and 1
+
+    # Create a grid of coordinates using meshgrid
+    x_coords, y_coords = torch.meshgrid(x_range, y_range, indexing='xy')
+
+    # Stack the coordinates to get a (height, width, 2) tensor
+    coords = torch.stack((x_coords, y_coords), dim=-1)
+
+    # Apply positional encoding to the coordinates
+    embedded_coordinates = positional_encoding(coords, num_frequencies=num_frequencies)
+
+
+
+    return embedded_coordinates
+
+
+class HashGridEncoding(nn.Module):
+
+    """
+    Learnable multiresolution hash encoding (Instant-NGP). Each level is a grid whose resolution grows
+    geometrically from base_resolution to finest_resolution, the feature vectors of its vertices are
+    stored in a table of 2**log2_table_size entries (indexed directly for the coarse levels that fit in
+    the table, through a spatial hash otherwise) and trilinearly interpolated at the query points.
+    The features of all the levels are concatenated.
+    """
+
+    def __init__(self, aabb, num_levels=16, features_per_level=2, log2_table_size=19, base_resolution=16, finest_resolution=512):
+        super().__init__()
+        self.num_levels = num_levels
+        self.features_per_level = features_per_level
+        self.table_size = 2 ** log2_table_size
+        self.output_dim = num_levels * features_per_level
+
+        growth = np.exp((np.log(finest_resolution) - np.log(base_resolution)) / max(num_levels - 1, 1))
+        self.resolutions = [int(np.floor(base_resolution * growth ** level)) for level in range(num_levels)]
+
+        self.register_buffer('aabb', aabb.clone().float())
+        self.register_buffer('corner_offsets', torch.tensor([[dx, dy, dz] for dx in (0, 1) for dy in (0, 1) for dz in (0, 1)]))
+        self.register_buffer('primes', torch.tensor([1, 2654435761, 805459861]))
+        self.embeddings = nn.Parameter(torch.empty(num_levels, self.table_size, features_per_level).uniform_(-1e-4, 1e-4))
+
+    def forward(self, x):
+
+        """
+        Args:
+        x: 3D points. Shape: (N, 3).
+
+        Returns:
+        (torch.Tensor): Encoded points. Shape: (N, num_levels * features_per_level).
+        """
+
+        # Points in the unit cube, points outside the scene bounding box are clamped to its faces
+        x = ((x - self.aabb[0]) / (self.aabb[1] - self.aabb[0])).clamp(0, 1)
+
+        features = []
+        for level, resolution in enumerate(self.resolutions):
+            scaled = x * resolution
+            corner = torch.floor(scaled).long().clamp(max=resolution - 1)
+            frac = scaled - corner
+
+            # The 8 vertices of the cell around each point and their trilinear weights
+            vertices = corner[:, None, :] + self.corner_offsets
+            weights = torch.prod(torch.where(self.corner_offsets.bool(), frac[:, None, :], 1 - frac[:, None, :]), -1)
+
+            if (resolution + 1) ** 3 <= self.table_size:
+                indices = (vertices[..., 0] * (resolution + 1) + vertices[..., 1]) * (resolution + 1) + vertices[..., 2]
+            else:
+                hashed = vertices * self.primes
+                indices = (hashed[..., 0] ^ hashed[..., 1] ^ hashed[..., 2]) % self.table_size
+
+            features.append(torch.sum(weights[..., None] * self.embeddings[level][indices], 1))
+
+        return torch.cat(features, -1)
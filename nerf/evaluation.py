@@ -0,0 +1,306 @@
+"""
+Evaluation of the held-out view during training.
+
+A quick evaluation every config.display iterations measures the PSNR on a downscaled rendering
+(config.eval_scale) or on a fixed random subset of the pixels (config.eval_pixels), and a full
+resolution one runs every config.full_eval_every iterations and at the end of training. With
+config.eval_in_background they render a snapshot of the weights in a background thread while training
+continues, and config.eval_dump_dir receives the renderings and the PSNR curves as image files.
+
+The PSNRs of the quick evaluations (downscaled view or pixel subset) are not comparable with those of the
+full resolution view, they are kept as separate histories (see new_psnr_history).
+"""
+
+import copy
+import os
+import queue
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+
+from .data import save_image
+from .occupancy import OccupancyGrid
+from .rays import get_pixel_rays, scale_intrinsics
+from .rendering import render_rays, render_rays_adaptive, render_image_streaming
+
+
+def compute_psnr(image, target):
+    return 10 * torch.log10(1. / F.mse_loss(image, target))
+
+
+def render_test_view(config, height, width, intrinsics, test_pose, model, model_fine=None, occupancy_grid=None, ray_cache=None,
+                     scene_aabb=None):
+
+    """
+    Render the held-out view with the streaming renderer, clipping the rays to scene_aabb if config.clip_to_aabb.
+    """
+
+    with torch.no_grad():
+        return render_image_streaming(height, width, intrinsics, test_pose, config.near, config.far, config.samples, model,
+                                      config.num_x_frequencies, config.num_d_frequencies,
+                                      memory_budget_mb=config.render_memory_budget_mb, model_fine=model_fine,
+                                      fine_samples=config.fine_samples, occupancy_grid=occupancy_grid,
+                                      transmittance_threshold=config.transmittance_threshold,
+                                      ray_cache=ray_cache, pose_index='test' if ray_cache is not None else None,
+                                      aabb=scene_aabb if config.clip_to_aabb else None, min_samples=config.min_samples)
+
+
+def make_render_fn(config, model, model_fine=None, device=None, scene_aabb=None, occupancy_grid=None, return_depth=False):
+
+    """
+    Function (ray_origins, ray_directions) -> rgb rendering flat batches of rays on device with the settings
+    of the configuration, without gradients (used by the render server and the progressive renderer).
+    With return_depth, it returns the color and the expected depth of every ray as one (num_rays, 4) tensor.
+    """
+
+    def render_fn(ray_origins, ray_directions):
+        ray_origins, ray_directions = ray_origins.to(device), ray_directions.to(device)
+        with torch.no_grad():
+            if config.clip_to_aabb:
+                outputs = render_rays_adaptive(ray_origins, ray_directions, config.near, config.far, config.samples, model,
+                                               config.num_x_frequencies, config.num_d_frequencies, scene_aabb,
+                                               occupancy_grid=occupancy_grid, min_samples=config.min_samples, model_fine=model_fine,
+                                               fine_samples=config.fine_samples, transmittance_threshold=config.transmittance_threshold,
+                                               return_depth=return_depth)
+            else:
+                outputs = render_rays(ray_origins, ray_directions, config.near, config.far, config.samples, model,
+                                      config.num_x_frequencies, config.num_d_frequencies, model_fine=model_fine,
+                                      fine_samples=config.fine_samples, occupancy_grid=occupancy_grid,
+                                      transmittance_threshold=config.transmittance_threshold, return_depth=return_depth)
+
+        if return_depth:
+            rgb, depth = outputs
+            return torch.cat([rgb, depth[..., None]], -1)
+        return outputs
+
+    return render_fn
+
+
+def build_occupancy_grid(config, model, model_fine, scene_aabb):
+
+    """
+    Occupancy grid of trained network(s) for rendering, with the density of every cell queried once.
+    """
+
+    occupancy_grid = OccupancyGrid(scene_aabb, config.occupancy_resolution, config.occupancy_threshold)
+    occupancy_grid.update(model_fine if model_fine is not None else model, config.num_x_frequencies, config.num_d_frequencies)
+
+    return occupancy_grid
+
+
+def plot_progress(i, test_rec_image, test_image, iternums, psnrs):
+
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(16, 4))
+    plt.subplot(141)
+    plt.imshow(test_rec_image.detach().cpu().numpy())
+    plt.title(f"Iteration {i}")
+    plt.subplot(142)
+    plt.imshow(test_image.detach().cpu().numpy())
+    plt.title("Target image")
+    plt.subplot(143)
+    plt.plot(iternums, psnrs)
+    plt.title("PSNR")
+    plt.show()
+
+
+def dump_progress(dump_dir, i, test_rec_image, history):
+
+    """
+    Headless version of plot_progress: write the rendering of iteration i (if any) and the PSNR curves of
+    history (see new_psnr_history) to dump_dir, without a display and without blocking on a window.
+    """
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    os.makedirs(dump_dir, exist_ok=True)
+    if test_rec_image is not None:
+        save_image(os.path.join(dump_dir, 'test_%06d.png' % i), test_rec_image)
+
+    figure = Figure(figsize=(6, 4))
+    axes = figure.add_subplot()
+    for kind, label in (('full', "Full resolution"), ('quick', "Quick")):
+        if history[kind]['iternums']:
+            axes.plot(history[kind]['iternums'], history[kind]['psnrs'], label=label)
+    axes.legend()
+    axes.set_xlabel("Iteration")
+    axes.set_title("PSNR")
+    FigureCanvasAgg(figure).print_figure(os.path.join(dump_dir, 'psnr.png'))
+
+
+class HeldOutView:
+
+    """
+    The held-out view and its targets for the quick evaluations: the image downscaled by config.eval_scale,
+    or config.eval_pixels random pixels of it (drawn once, the same pixels at every evaluation).
+    """
+
+    def __init__(self, config, height, width, intrinsics, pose, image, seed=0):
+        self.height, self.width, self.intrinsics, self.pose, self.image = height, width, intrinsics, pose, image
+
+        scale = max(1, config.eval_scale)
+        self.quick_height, self.quick_width = max(1, height // scale), max(1, width // scale)
+        self.quick_intrinsics = scale_intrinsics(intrinsics, height, width, self.quick_height, self.quick_width)
+        self.quick_image = image if scale == 1 else \
+            F.interpolate(image.permute(2, 0, 1)[None], size=(self.quick_height, self.quick_width), mode='area')[0].permute(1, 2, 0)
+
+        self.rows = self.cols = None
+        if config.eval_pixels > 0:
+            generator = torch.Generator().manual_seed(seed)
+            pixels = torch.randperm(height * width, generator=generator)[:config.eval_pixels].to(image.device)
+            self.rows, self.cols = pixels // width, pixels % width
+
+    def is_quick_full(self):
+        # A quick evaluation that renders the whole image at full resolution anyway
+        return self.rows is None and (self.quick_height, self.quick_width) == (self.height, self.width)
+
+
+def evaluate_held_out(config, view, model, model_fine=None, occupancy_grid=None, scene_aabb=None, full=False, ray_cache=None,
+                      rays_per_batch=2**14):
+
+    """
+    Render the held-out view and measure its PSNR.
+
+    Args:
+    config: The NerfConfig of the run.
+    view: The HeldOutView.
+    model, model_fine, occupancy_grid, scene_aabb: As for render_test_view.
+    full (optional, bool): Full resolution evaluation instead of the quick one.
+    ray_cache (optional, RayCache): Cache of the rays of the full resolution view.
+    rays_per_batch (optional, int): Rays rendered at once for a subset of pixels.
+
+    Returns:
+    image: The rendering, at full resolution for a full evaluation, downscaled for a quick one, None for
+      a quick evaluation on a subset of the pixels.
+    psnr (float): PSNR against the matching target.
+    """
+
+    if full or view.is_quick_full():
+        image = render_test_view(config, view.height, view.width, view.intrinsics, view.pose, model, model_fine, occupancy_grid,
+                                 ray_cache, scene_aabb)
+        return image, compute_psnr(image, view.image).item()
+
+    if view.rows is None:
+        image = render_test_view(config, view.quick_height, view.quick_width, view.quick_intrinsics, view.pose, model, model_fine,
+                                 occupancy_grid, scene_aabb=scene_aabb)
+        return image, compute_psnr(image, view.quick_image).item()
+
+    render_fn = make_render_fn(config, model, model_fine, view.image.device, scene_aabb, occupancy_grid)
+    rgb = []
+    for start in range(0, view.rows.shape[0], rays_per_batch):
+        rows, cols = view.rows[start:start + rays_per_batch], view.cols[start:start + rays_per_batch]
+        rgb.append(render_fn(*get_pixel_rays(view.intrinsics, view.pose.expand(rows.shape[0], 4, 4), rows, cols)))
+
+    return None, compute_psnr(torch.cat(rgb), view.image[view.rows, view.cols]).item()
+
+
+def snapshot(*objects):
+
+    """
+    Copies of the networks (and occupancy grid) to evaluate while training updates the originals, None stays None.
+    """
+
+    with torch.no_grad():
+        return tuple(copy.deepcopy(obj) if obj is not None else None for obj in objects)
+
+
+class BackgroundEvaluator:
+
+    """
+    Run evaluate_fn(iteration, full, models) in a background thread and collect its results.
+
+    submit() returns once the models are handed over. A quick evaluation is skipped while the previous one
+    is still running, a full one waits for it. poll() returns the (iteration, full, result, secs) of the
+    evaluations finished since the last call.
+    """
+
+    def __init__(self, evaluate_fn):
+        self.evaluate_fn = evaluate_fn
+        self.error = None
+        self.pending = queue.Queue(maxsize=1)
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            iteration, full, models = item
+            try:
+                t = time.time()
+                self.results.put((iteration, full, self.evaluate_fn(iteration, full, models), time.time() - t))
+            except Exception as error:
+                # Raised in the training loop by the next submit(), poll() or close()
+                self.error = error
+            finally:
+                self.pending.task_done()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def busy(self):
+        return self.pending.unfinished_tasks > 0
+
+    def submit(self, iteration, full, models):
+        self.check()
+        if not full and self.busy():
+            return False
+        self.pending.put((iteration, full, models))
+        return True
+
+    def poll(self):
+        self.check()
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+        return self.poll()
+
+
+def new_psnr_history():
+
+    """
+    PSNRs of the held-out view during training: history[kind] = {'iternums': [...], 'psnrs': [...]} with kind
+    'full' for the full resolution view and 'quick' for the downscaled view or the pixel subset.
+    """
+
+    return {kind: {'iternums': [], 'psnrs': []} for kind in ('full', 'quick')}
+
+
+def record_evaluation(config, view, iteration, full, result, secs, history):
+
+    """
+    Print the result (image, psnr) of an evaluation, append its PSNR to the full or quick history, and
+    show or dump it if configured.
+
+    Returns:
+    The rendering if it is the full resolution held-out view, None otherwise.
+    """
+
+    image, psnr = result
+    print("%s evaluation of iteration %d: PSNR: %.2f (%.2f secs)" % ('Full' if full else 'Quick', iteration, psnr, secs))
+    full_resolution = full or view.is_quick_full()
+    kind = history['full' if full_resolution else 'quick']
+    kind['psnrs'].append(psnr)
+    kind['iternums'].append(iteration)
+
+    if config.eval_dump_dir:
+        dump_progress(config.eval_dump_dir, iteration, image, history)
+    if config.show_plots and image is not None:
+        plot_progress(iteration, image, view.image if full_resolution else view.quick_image, kind['iternums'], kind['psnrs'])
+
+    return image if full_resolution else None
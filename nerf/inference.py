@@ -0,0 +1,174 @@
+"""
+Inference version of nerf_model for rendering.
+
+FusedNerfMLP computes the same function as a trained nerf_model with fewer, larger matrix products
+and no concatenation:
+
+- the skip connection (layer_6) and the direction input (layer_10) are split by input channels,
+  x @ [W_h | W_x].T = h @ W_h.T + x @ W_x.T, so their inputs are never concatenated;
+- layer_1 and the position part of layer_6 read the same input and run as one product;
+- layer_8 and layer_9 have no activation, so they are folded into the density head and layer_10,
+  which then run as one product.
+
+InferenceModel casts it to bfloat16 or quantizes its weights to int8 (dynamic quantization, CPU only),
+and traces it once with torch.jit.
+"""
+
+import copy
+import io
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def linear_from(weight, bias=None):
+    layer = nn.Linear(weight.shape[1], weight.shape[0], bias=bias is not None, device=weight.device, dtype=weight.dtype)
+    with torch.no_grad():
+        layer.weight.copy_(weight)
+        if bias is not None:
+            layer.bias.copy_(bias)
+    return layer
+
+
+class FusedNerfMLP(nn.Module):
+
+    """
+    The layers of a trained nerf_model, rearranged for inference. It takes the encoded positions (the
+    output of the hash encoder with encoding='hash') and the encoded directions.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        layers = model.layers
+        self.hash = model.encoding == 'hash'
+
+        with torch.no_grad():
+            if self.hash:
+                # layer_2 has no activation: its geometry features are folded into the feature part of layer_3
+                W2, b2 = layers['layer_2'].weight, layers['layer_2'].bias
+                W3, b3 = layers['layer_3'].weight, layers['layer_3'].bias
+                W3_f, W3_d = W3[:, :15], W3[:, 15:]
+
+                self.input = copy.deepcopy(layers['layer_1'])
+                self.hidden = nn.ModuleList()
+                self.head = linear_from(torch.cat([W2[:1], W3_f @ W2[1:]]), torch.cat([b2[:1], W3_f @ b2[1:] + b3]))
+                self.direction = linear_from(W3_d)
+                self.color = nn.ModuleList([copy.deepcopy(layers['layer_4'])])
+                self.output = copy.deepcopy(layers['layer_5'])
+                return
+
+            filter_size = layers['layer_2'].in_features
+            W1, b1 = layers['layer_1'].weight, layers['layer_1'].bias
+            W6, b6 = layers['layer_6'].weight, layers['layer_6'].bias
+            W8, b8 = layers['layer_8'].weight, layers['layer_8'].bias
+            Ws, bs = layers['layer_s'].weight, layers['layer_s'].bias
+            W9, b9 = layers['layer_9'].weight, layers['layer_9'].bias
+            W10, b10 = layers['layer_10'].weight, layers['layer_10'].bias
+            W10_f, W10_d = W10[:, :filter_size], W10[:, filter_size:]
+
+            # x -> [layer_1, position part of layer_6 (with its bias)]
+            self.input = linear_from(torch.cat([W1, W6[:, filter_size:]]), torch.cat([b1, b6]))
+            self.hidden = nn.ModuleList([copy.deepcopy(layers['layer_%d' % i]) for i in range(2, 6)])
+            self.skip = linear_from(W6[:, :filter_size])
+            self.trunk = copy.deepcopy(layers['layer_7'])
+
+            # h7 -> [sigma, feature part of layer_10], through the folded layer_8 and layer_9
+            self.head = linear_from(torch.cat([Ws @ W8, W10_f @ W9 @ W8]),
+                                    torch.cat([Ws @ b8 + bs, W10_f @ (W9 @ b8 + b9) + b10]))
+            self.direction = linear_from(W10_d)
+            self.color = nn.ModuleList()
+            self.output = copy.deepcopy(layers['layer_11'])
+
+    def forward(self, x, d):
+        if self.hash:
+            h = F.relu(self.input(x))
+        else:
+            h, skip = self.input(x).chunk(2, dim=-1)
+            h = F.relu(h)
+            for layer in self.hidden:
+                h = F.relu(layer(h))
+            h = F.relu(self.skip(h) + skip)
+            h = F.relu(self.trunk(h))
+
+        # Density (sigma) and color features
+        h = self.head(h)
+        sigma = F.relu(h[..., :1])
+
+        h = F.relu(h[..., 1:] + self.direction(d))
+        for layer in self.color:
+            h = F.relu(layer(h))
+        rgb = torch.sigmoid(self.output(h))
+
+        return rgb, sigma
+
+
+class InferenceModel(nn.Module):
+
+    """
+    Drop-in replacement of a trained nerf_model for rendering (no gradients).
+
+    Args:
+    model: The trained nerf_model.
+    precision (optional, str): 'fp32', 'bf16' (bfloat16 weights and activations, fast on CPUs with
+      bfloat16 instructions) or 'int8' (int8 weights with dynamic quantization of the activations, CPU only).
+    """
+
+    def __init__(self, model, precision='fp32'):
+        super().__init__()
+        if model.encoding not in ('sinusoidal', 'hash'):
+            raise ValueError("The inference network is built from a nerf_model (or a pruned one), not a %s" % type(model).__name__)
+        self.encoding = model.encoding
+        self.encoder = model.encoder if model.encoding == 'hash' else None
+        self.precision = precision
+        self.dtype = torch.bfloat16 if precision == 'bf16' else torch.float32
+
+        mlp = FusedNerfMLP(model).eval()
+        example_x = torch.zeros(256, mlp.input.in_features, device=mlp.input.weight.device, dtype=self.dtype)
+        example_d = torch.zeros(256, mlp.direction.in_features, device=mlp.input.weight.device, dtype=self.dtype)
+
+        if precision == 'bf16':
+            mlp = mlp.to(torch.bfloat16)
+        elif precision == 'int8':
+            if mlp.input.weight.device.type != 'cpu':
+                raise ValueError("int8 inference runs on the CPU")
+            mlp = torch.ao.quantization.quantize_dynamic(mlp, {nn.Linear}, dtype=torch.qint8)
+        elif precision != 'fp32':
+            raise ValueError("Unknown precision %r, expected 'fp32', 'bf16' or 'int8'" % precision)
+
+        # Trace once, the traced graph is reused for every batch size
+        with torch.no_grad():
+            self.mlp = torch.jit.freeze(torch.jit.trace(mlp, (example_x, example_d)))
+
+    def forward(self, x, d):
+        if self.encoder is not None:
+            x = self.encoder(x[..., :3])
+        rgb, sigma = self.mlp(x.to(self.dtype), d.to(self.dtype))
+
+        return rgb.float(), sigma.float()
+
+    def __getstate__(self):
+        # Traced modules cannot be pickled (e.g. to the spawned workers of render_camera_path), they are serialized
+        state = self.__dict__.copy()
+        state['_modules'] = {name: module for name, module in self._modules.items() if name != 'mlp'}
+        buffer = io.BytesIO()
+        torch.jit.save(self.mlp, buffer)
+        state['mlp_bytes'] = buffer.getvalue()
+        return state
+
+    def __setstate__(self, state):
+        mlp_bytes = state.pop('mlp_bytes')
+        super().__setstate__(state)
+        self.mlp = torch.jit.load(io.BytesIO(mlp_bytes))
+
+
+def build_inference_models(model, model_fine=None, precision='fp32'):
+
+    """
+    Inference versions of the network(s), None stays None.
+    """
+
+    model = InferenceModel(model.eval(), precision)
+    model_fine = InferenceModel(model_fine.eval(), precision) if model_fine is not None else None
+
+    return model, model_fine
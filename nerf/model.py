@@ -0,0 +1,137 @@
+"""
+The NeRF network.
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .encoding import HashGridEncoding
+
+
+class nerf_model(nn.Module):
+
+    """
+    Define a NeRF model comprising eight fully connected layers and following the
+    architecture described in the NeRF paper.
+
+    With encoding='hash', the positions are instead encoded by a learnable HashGridEncoding over
+    the scene bounding box aabb, followed by a small MLP of width hash_hidden_size (filter_size and
+    num_x_frequencies are then unused). The network still takes the positionally encoded inputs of
+    get_batches and only reads the raw coordinates, which come first in them.
+    """
+
+    def __init__(self, filter_size=256, num_x_frequencies=10, num_d_frequencies=4, encoding='sinusoidal',
+                 aabb=None, hash_levels=16, hash_log2_table_size=19, hash_features_per_level=2, hash_hidden_size=64):
+        super().__init__()
+        self.num_x_frequencies = num_x_frequencies
+        self.num_d_frequencies = num_d_frequencies
+        self.encoding = encoding
+
+        if encoding == 'hash':
+            if aabb is None:
+                raise ValueError("The hash encoding needs the bounding box of the scene (aabb)")
+
+            input_dim_d = 3 + 2 * 3 * num_d_frequencies
+            self.encoder = HashGridEncoding(aabb, num_levels=hash_levels, features_per_level=hash_features_per_level,
+                                            log2_table_size=hash_log2_table_size)
+            self.layers = nn.ModuleDict({
+                'layer_1': nn.Linear(self.encoder.output_dim, hash_hidden_size),
+                'layer_2': nn.Linear(hash_hidden_size, 16),           # Density (sigma) and 15 geometry features
+                'layer_3': nn.Linear(15 + input_dim_d, hash_hidden_size),
+                'layer_4': nn.Linear(hash_hidden_size, hash_hidden_size),
+                'layer_5': nn.Linear(hash_hidden_size, 3),            # RGB (sigmoid)
+            })
+            return
+        elif encoding != 'sinusoidal':
+            raise ValueError("Unknown encoding %r, expected 'sinusoidal' or 'hash'" % encoding)
+
+
+        # Input dimension for positional encoding of positions (x, y, z)
+        input_dim_x = 3 + 2 * 3 * num_x_frequencies
+
+        # Input dimension for positional encoding of directions (θ, φ)
+        input_dim_d = 3 + 2 * 3 * num_d_frequencies
+
+        self.layers = nn.ModuleDict({
+            'layer_1': nn.Linear(input_dim_x, filter_size),
+            'layer_2': nn.Linear(filter_size, filter_size),
+            'layer_3': nn.Linear(filter_size, filter_size),
+            'layer_4': nn.Linear(filter_size, filter_size),
+            'layer_5': nn.Linear(filter_size, filter_size),
+            'layer_6': nn.Linear(filter_size + input_dim_x, filter_size), # Skip connection
+            'layer_7': nn.Linear(filter_size, filter_size),
+            'layer_8': nn.Linear(filter_size, filter_size), # No activation
+            'layer_s': nn.Linear(filter_size, 1),          # Density (sigma)
+            'layer_9': nn.Linear(filter_size, filter_size), # Feature vector
+            'layer_10': nn.Linear(filter_size + input_dim_d, 128),
+            'layer_11': nn.Linear(128, 3),                 # RGB (sigmoid)
+        })
+
+
+
+
+    def forward(self, x, d):
+
+        if self.encoding == 'hash':
+            return self.forward_hash(x, d)
+
+        # The positions (x) are already positionally encoded
+        x_encoded = x
+
+        # Forward pass through layers 1-4
+        h = F.relu(self.layers['layer_1'](x_encoded))
+        h = F.relu(self.layers['layer_2'](h))
+        h = F.relu(self.layers['layer_3'](h))
+        h = F.relu(self.layers['layer_4'](h))
+        h = F.relu(self.layers['layer_5'](h))
+
+        # Skip connection
+        h = torch.cat([h, x_encoded], dim=-1)
+
+        # Forward pass through layers 5-8
+
+        h = F.relu(self.layers['layer_6'](h))
+        h = F.relu(self.layers['layer_7'](h))
+        h = self.layers['layer_8'](h)  # No activation
+
+        # Density (sigma)
+        sigma = F.relu(self.layers['layer_s'](h))
+
+        # Feature vector and positional encoding for directions (d)
+        feat = self.layers['layer_9'](h)
+        #d_encoded = positional_encoding(d, self.num_d_frequencies)
+        d_encoded = d
+
+        # Concatenate feature vector and encoded directions
+        h = torch.cat([feat, d_encoded], dim=-1)
+
+        # Forward pass through layers 10-11 to get RGB
+        h = F.relu(self.layers['layer_10'](h))
+        rgb = torch.sigmoid(self.layers['layer_11'](h))
+
+
+
+        return rgb, sigma
+
+    def forward_hash(self, x, d):
+
+        # Hash encoding of the raw positions
+        h = self.encoder(x[..., :3])
+
+        # Density (sigma) and geometry features
+        h = self.layers['layer_2'](F.relu(self.layers['layer_1'](h)))
+        sigma = F.relu(h[..., :1])
+
+        # Color from the geometry features and the encoded directions
+        h = torch.cat([h[..., 1:], d], dim=-1)
+        h = F.relu(self.layers['layer_3'](h))
+        h = F.relu(self.layers['layer_4'](h))
+        rgb = torch.sigmoid(self.layers['layer_5'](h))
+
+        return rgb, sigma
+
+
+def weights_init(m):
+    if isinstance(m, torch.nn.Linear):
+        torch.nn.init.xavier_uniform_(m.weight)
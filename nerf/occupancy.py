@@ -0,0 +1,179 @@
+"""
+Occupancy grid used to skip the empty space of the scene.
+"""
+
+import torch
+
+from .encoding import positional_encoding
+
+
+def get_scene_aabb(poses, far):
+
+    """
+    Estimate an axis aligned bounding box of the scene from the camera positions: every point that
+    the cameras can see lies within a distance 'far' of each of them.
+
+    Args:
+    poses: Camera to world transformations. Shape: (num_images, 4, 4).
+    far: The 'far' extent of the bounding volume.
+
+    Returns:
+    aabb (torch.Tensor): Minimum and maximum corner of the box. Shape: (2, 3).
+    """
+
+    origins = poses[:, :3, 3].float()
+    aabb_min = origins.max(dim=0).values - far
+    aabb_max = origins.min(dim=0).values + far
+
+    # Fall back to the box around all the cameras if they are spread further apart than 'far'
+    empty = aabb_min >= aabb_max
+    aabb_min = torch.where(empty, origins.min(dim=0).values - far, aabb_min)
+    aabb_max = torch.where(empty, origins.max(dim=0).values + far, aabb_max)
+
+    return torch.stack([aabb_min, aabb_max])
+
+
+def intersect_aabb(ray_origins, ray_directions, aabb, near, far):
+
+    """
+    Clip rays against an axis aligned bounding box (slab method) and the [near, far] range.
+
+    Args:
+    ray_origins: Origin of each ray. Shape: (..., 3).
+    ray_directions: Direction of each ray. Shape: (..., 3).
+    aabb: Minimum and maximum corner of the box. Shape: (2, 3).
+    near, far: Depth range of the rays.
+
+    Returns:
+    t_near, t_far (torch.Tensor): Depths where each ray enters and leaves the box. Shape: (...).
+    hit (torch.Tensor): Whether each ray crosses the box within [near, far]. Shape: (...).
+    """
+
+    # Avoid 0 * inf = nan for directions parallel to a slab
+    directions = torch.where(ray_directions.abs() < 1e-9, torch.full_like(ray_directions, 1e-9), ray_directions)
+    t0 = (aabb[0] - ray_origins) / directions
+    t1 = (aabb[1] - ray_origins) / directions
+
+    t_near = torch.minimum(t0, t1).max(dim=-1).values.clamp(min=near)
+    t_far = torch.maximum(t0, t1).min(dim=-1).values.clamp(max=far)
+
+    return t_near, t_far, t_far > t_near
+
+
+def estimate_ray_bounds(ray_origins, ray_directions, near, far, aabb, occupancy_grid=None, probe_samples=None):
+
+    """
+    Depth range of the content along every ray: the segment inside the scene box, tightened to the
+    occupied cells of the occupancy grid if one is given (with a margin of one probe step).
+
+    Args:
+    probe_samples (optional, int): Points probed in the occupancy grid along each segment, twice the
+      resolution of the grid by default.
+
+    Returns:
+    t_near, t_far (torch.Tensor): Depth range of the content of every ray. Shape: (...).
+    hit (torch.Tensor): Whether each ray has any content. Shape: (...).
+    """
+
+    t_near, t_far, hit = intersect_aabb(ray_origins, ray_directions, aabb, near, far)
+    if occupancy_grid is None:
+        return t_near, t_far, hit
+
+    probe_samples = probe_samples or 2 * occupancy_grid.resolution
+    step = (t_far - t_near).clamp(min=0) / probe_samples
+    t_probe = t_near[..., None] + (torch.arange(probe_samples, device=t_near.device) + .5) * step[..., None]
+    occupied = occupancy_grid.query(ray_origins[..., None, :] + ray_directions[..., None, :] * t_probe[..., None])
+
+    # First and last occupied probe of every ray
+    first = torch.argmax(occupied.int(), -1)
+    last = probe_samples - 1 - torch.argmax(occupied.flip(-1).int(), -1)
+
+    t_far = torch.minimum(t_near + (last + 2) * step, t_far)
+    t_near = torch.maximum(t_near + (first - 1) * step, t_near)
+
+    return t_near, t_far, hit & occupied.any(-1)
+
+
+class OccupancyGrid:
+
+    """
+    A 3D bitfield over the scene bounding box that marks the cells where the network predicts
+    non-negligible density. It keeps a decaying running maximum of the density of every cell,
+    refreshed from sigma queries during training, and sampling skips the points of empty cells.
+    """
+
+    def __init__(self, aabb, resolution=64, density_threshold=0.5, decay=0.95):
+        self.aabb = aabb
+        self.resolution = resolution
+        self.density_threshold = density_threshold
+        self.decay = decay
+
+        # Every cell is occupied until the grid is updated for the first time
+        self.density = torch.full((resolution,) * 3, float('inf'), device=aabb.device)
+        self.occupied = torch.ones((resolution,) * 3, dtype=torch.bool, device=aabb.device)
+
+    def update(self, model, num_x_frequencies, num_d_frequencies, num_cells=None, chunksize=2**15):
+
+        """
+        Query the density at a random point of (a random subset of) the cells and refresh the bitfield. Until
+        every cell has been queried once (the first update), all the cells are queried whatever num_cells.
+
+        Args:
+        model: The NeRF network.
+        num_x_frequencies: Number of frequencies used to encode the sample positions.
+        num_d_frequencies: Number of frequencies used to encode the ray directions.
+        num_cells (optional, int): Number of random cells to query, all of them if None.
+        chunksize (optional, int): Number of points evaluated at once.
+        """
+
+        device = self.aabb.device
+        res = self.resolution
+        # Warm-up: a cell that was never queried must not be marked empty
+        warm_up = bool(torch.isinf(self.density).any())
+        if warm_up or num_cells is None or num_cells >= res ** 3:
+            cells = torch.arange(res ** 3, device=device)
+        else:
+            cells = torch.randint(res ** 3, (num_cells,), device=device)
+
+        # Random point inside every selected cell
+        cell_coords = torch.stack([cells // (res * res), (cells // res) % res, cells % res], -1).float()
+        points = self.aabb[0] + (cell_coords + torch.rand_like(cell_coords)) / res * (self.aabb[1] - self.aabb[0])
+
+        # The density does not depend on the viewing direction, any unit direction will do
+        directions = torch.zeros_like(points)
+        directions[:, 2] = 1.
+
+        sigma_batches = []
+        with torch.no_grad():
+            for j in range(0, points.shape[0], chunksize):
+                _, sigma_batch = model(positional_encoding(points[j:j + chunksize], num_x_frequencies),
+                                       positional_encoding(directions[j:j + chunksize], num_d_frequencies))
+                sigma_batches.append(sigma_batch.reshape(-1))
+        sigma = torch.cat(sigma_batches)
+
+        density = self.density.reshape(-1)
+        density = torch.where(torch.isinf(density), torch.zeros_like(density), density) * self.decay
+        density[cells] = torch.maximum(density[cells], sigma.float())
+        self.density = density.reshape((res,) * 3)
+        self.occupied = self.density > self.density_threshold
+
+    def query(self, points):
+
+        """
+        Look up whether points fall in occupied cells, points outside the bounding box are empty.
+
+        Args:
+        points: 3D points. Shape: (..., 3).
+
+        Returns:
+        (torch.Tensor): Boolean occupancy of every point. Shape: (...).
+        """
+
+        cell_coords = torch.floor((points - self.aabb[0]) / (self.aabb[1] - self.aabb[0]) * self.resolution).long()
+        inside = torch.all((cell_coords >= 0) & (cell_coords < self.resolution), dim=-1)
+        cell_coords = cell_coords.clamp(0, self.resolution - 1)
+
+        return self.occupied[cell_coords[..., 0], cell_coords[..., 1], cell_coords[..., 2]] & inside
+
+    def occupancy_fraction(self):
+        return self.occupied.float().mean().item()
@@ -0,0 +1,172 @@
+"""
+Per-stage timers and counters of the rendering and training hot paths.
+
+The rendering functions mark their stages (ray generation, sampling, encoding, network, compositing) with
+stage() and their work (rays, evaluated and skipped points, terminated rays) with count(). Both do
+nothing unless a Profiler is active in the current context:
+
+    profiler = Profiler()
+    with profiling(profiler):
+        one_forward_pass(...)
+    print(profiler.report())
+
+The stages also show up as labelled ranges in torch.profiler traces (see trace_profiler).
+"""
+
+import os
+import resource
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import torch
+
+active_profiler = ContextVar('nerf_profiler', default=None)
+
+
+class Profiler:
+
+    """
+    Accumulate the wall time and number of calls of every stage, and counters.
+
+    Args:
+    synchronize (optional, bool): Wait for the CUDA kernels at the boundaries of every stage, so that the
+      times of a GPU are those of the stage and not of its kernel launches (slower).
+    callbacks (optional, list): Functions callback(name, secs) called at the end of every stage.
+    """
+
+    def __init__(self, synchronize=False, callbacks=()):
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.callbacks = list(callbacks)
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.start_time = time.time()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def record(self, name, secs):
+        self.times[name] += secs
+        self.calls[name] += 1
+        for callback in self.callbacks:
+            callback(name, secs)
+
+    def count(self, name, value):
+        self.counters[name] += int(value)
+
+    def peak_memory(self):
+
+        """
+        A tuple (name, MB): ('peak_memory_mb', peak memory allocated by torch on the GPU since the last reset),
+        or on the CPU ('process_peak_rss_mb', high-water mark of the resident memory of the process since it
+        started, including the dataset and the networks: it never decreases and is not that of the stages).
+        """
+
+        if torch.cuda.is_available():
+            return 'peak_memory_mb', torch.cuda.max_memory_allocated() / 2**20
+        return 'process_peak_rss_mb', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10  # KiB on Linux
+
+    def summary(self):
+        memory_name, memory_mb = self.peak_memory()
+        return {
+            'secs': time.time() - self.start_time,
+            'stages': {name: {'secs': self.times[name], 'calls': self.calls[name]} for name in self.times},
+            'counters': dict(self.counters),
+            memory_name: memory_mb,
+        }
+
+    def report(self):
+
+        """
+        Table of the stages by decreasing time, the counters and the peak memory.
+        """
+
+        total = max(time.time() - self.start_time, 1e-9)
+        lines = ["%-14s %10s %7s %8s" % ('Stage', 'secs', '%', 'calls')]
+        for name, secs in sorted(self.times.items(), key=lambda item: -item[1]):
+            lines.append("%-14s %10.3f %6.1f%% %8d" % (name, secs, 100 * secs / total, self.calls[name]))
+        for name, value in sorted(self.counters.items()):
+            lines.append("%-22s %12d" % (name, value))
+        lines.append("%-22s %12.0f" % self.peak_memory())
+
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profiling(profiler):
+
+    """
+    Make profiler the active profiler of the current context (thread or task) inside the block, None
+    disables profiling.
+    """
+
+    token = active_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        active_profiler.reset(token)
+
+
+@contextmanager
+def stage(name):
+
+    """
+    Time the block as the stage name of the active profiler, if any.
+    """
+
+    profiler = active_profiler.get()
+    if profiler is None:
+        yield
+        return
+
+    with torch.profiler.record_function(name):
+        if profiler.synchronize:
+            torch.cuda.synchronize()
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            if profiler.synchronize:
+                torch.cuda.synchronize()
+            profiler.record(name, time.perf_counter() - t)
+
+
+def count(name, value):
+
+    """
+    Add value (a number or a one-element tensor) to the counter name of the active profiler, if any.
+    """
+
+    profiler = active_profiler.get()
+    if profiler is not None:
+        profiler.count(name, value)
+
+
+def trace_profiler(trace_dir, active_steps=5, wait_steps=5):
+
+    """
+    torch.profiler profiler writing a Chrome trace (chrome://tracing or https://ui.perfetto.dev) of
+    active_steps steps, after wait_steps steps and one warmup step. Call start(), step() after every
+    step and stop().
+    """
+
+    os.makedirs(trace_dir, exist_ok=True)
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    def export_trace(trace):
+        path = os.path.join(trace_dir, 'trace_%d.json' % trace.step_num)
+        trace.export_chrome_trace(path)
+        print("Wrote the profiler trace %s" % path)
+
+    return torch.profiler.profile(activities=activities,
+                                  schedule=torch.profiler.schedule(wait=wait_steps, warmup=1, active=active_steps, repeat=1),
+                                  on_trace_ready=export_trace, profile_memory=True, with_stack=False)
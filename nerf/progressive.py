@@ -0,0 +1,74 @@
+"""
+Progressive rendering for interactive previews: a low resolution image first, then every finer level
+only renders the pixels where the upsampled previous level varies, the flat regions keep their
+interpolated color.
+"""
+
+import torch
+import torch.nn.functional as F
+
+from .rays import get_pixel_rays, scale_intrinsics
+
+
+def local_contrast(image):
+
+    """
+    Difference between the largest and the smallest value of the 3x3 neighbourhood of every pixel, over
+    the color channels. Shape: (height, width).
+    """
+
+    channels_first = image.permute(2, 0, 1)[None]
+    local_max = F.max_pool2d(channels_first, 3, stride=1, padding=1)
+    local_min = -F.max_pool2d(-channels_first, 3, stride=1, padding=1)
+
+    return (local_max - local_min)[0].max(dim=0).values
+
+
+def resize_image(image, height, width):
+    return F.interpolate(image.permute(2, 0, 1)[None], size=(height, width), mode='bilinear', align_corners=False)[0].permute(1, 2, 0)
+
+
+def render_progressive(height, width, intrinsics, pose, render_fn, scales=(4, 2, 1), refine_threshold=0.05, rays_per_batch=2**14):
+
+    """
+    Render an image coarse to fine. The first level renders every pixel at 1/scales[0] of the resolution,
+    the next ones upsample the previous level and only render the pixels whose 3x3 neighbourhood varies
+    by more than refine_threshold.
+
+    Args:
+    height: the height of the rendered image.
+    width: the width of the rendered image.
+    intrinsics: camera intrinsics matrix for the rendered resolution. Shape: (3, 3).
+    pose: Camera to world transformation. Shape: (4, 4).
+    render_fn: Function (ray_origins, ray_directions) -> rgb, each of shape (num_rays, 3).
+    scales (optional, tuple): Resolution divisor of every level, from the coarsest to 1.
+    refine_threshold (optional, float): Local color variation above which a pixel is rendered again.
+    rays_per_batch (optional, int): Rays passed to render_fn at once.
+
+    Yields:
+    A tuple (image, rendered_rays) after every level: the current image at full resolution, shape
+    (height, width, 3), and the number of rays rendered for this level.
+    """
+
+    level_image = None
+    for scale in scales:
+        level_height, level_width = max(1, height // scale), max(1, width // scale)
+        level_intrinsics = scale_intrinsics(intrinsics, height, width, level_height, level_width)
+
+        if level_image is None:
+            level_image = torch.zeros(level_height, level_width, 3, device=intrinsics.device)
+            refine = torch.ones(level_height, level_width, dtype=torch.bool, device=intrinsics.device)
+        else:
+            level_image = resize_image(level_image, level_height, level_width)
+            refine = local_contrast(level_image) > refine_threshold
+
+        rows, cols = torch.nonzero(refine, as_tuple=True)
+        with torch.no_grad():
+            for start in range(0, rows.shape[0], rays_per_batch):
+                batch_rows, batch_cols = rows[start:start + rays_per_batch], cols[start:start + rays_per_batch]
+                ray_origins, ray_directions = get_pixel_rays(level_intrinsics, pose.expand(batch_rows.shape[0], 4, 4),
+                                                             batch_rows, batch_cols)
+                level_image[batch_rows, batch_cols] = render_fn(ray_origins, ray_directions)
+
+        image = level_image if (level_height, level_width) == (height, width) else resize_image(level_image, height, width)
+        yield image, rows.shape[0]
@@ -0,0 +1,179 @@
+"""
+Precomputed rays of the training set, for the 'rays' training mode with config.ray_store.
+
+The origin, direction and target color of every training pixel are computed once and kept in three
+flat, contiguous arrays (a structure of arrays), in a random order. An epoch visits every ray once: the
+arrays are cut into small chunks of contiguous rays (a fraction of a batch), the chunks are shuffled
+again for every epoch, and every batch gathers a few of them, so that the batches mix different rays at
+every epoch while the training input is still read as contiguous slices. A store can be saved to a directory and memory-mapped when
+it is opened again:
+
+    origins.npy     (num_rays, 3) float32
+    directions.npy  (num_rays, 3) float32
+    rgb.npy         (num_rays, 3) uint8 (0-255) or float32 (0-1), the type of the dataset images
+    meta.json       shape and fingerprint of the training set the store was built from
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+
+from .dataset import RayBatchPrefetcher
+from .rays import get_rays
+
+
+class RayStore:
+
+    """
+    The rays of the training pixels in shuffled order. Shape of each array: (num_rays, 3).
+    """
+
+    def __init__(self, origins, directions, rgb):
+        self.origins, self.directions, self.rgb = origins, directions, rgb
+
+    def __len__(self):
+        return self.origins.shape[0]
+
+    def nbytes(self):
+        return self.origins.nbytes + self.directions.nbytes + self.rgb.nbytes
+
+    def slice(self, start, end):
+
+        """
+        The rays start to end as CPU tensors (ray_origins, ray_directions, target_rgb).
+        """
+
+        rgb = torch.from_numpy(np.ascontiguousarray(self.rgb[start:end]))
+        return (torch.from_numpy(np.ascontiguousarray(self.origins[start:end])),
+                torch.from_numpy(np.ascontiguousarray(self.directions[start:end])),
+                rgb.float() / 255 if rgb.dtype == torch.uint8 else rgb.float())
+
+
+def dataset_fingerprint(dataset):
+
+    """
+    Hash of the poses of the training views, the intrinsics and the path, size and modification time of the
+    files the images are read from (the pixels themselves are not read).
+    """
+
+    digest = hashlib.sha1()
+    digest.update(dataset.cpu_poses[:len(dataset)].contiguous().numpy().tobytes())
+    digest.update(dataset.cpu_intrinsics.contiguous().numpy().tobytes())
+    for source in dataset.image_sources():
+        stat = os.stat(source)
+        digest.update(repr((os.path.abspath(source), stat.st_size, stat.st_mtime_ns)).encode())
+
+    return digest.hexdigest()
+
+
+def store_meta(dataset, seed):
+    return {'num_images': len(dataset), 'height': int(dataset.height), 'width': int(dataset.width),
+            'fingerprint': dataset_fingerprint(dataset), 'seed': int(seed)}
+
+
+def build_ray_store(dataset, path=None, seed=0):
+
+    """
+    Compute the rays of every pixel of the training images of dataset, one image at a time, in the random
+    order drawn from seed.
+
+    Args:
+    dataset (ViewDataset): The training set.
+    path (optional, str): Directory the store is written to (and memory-mapped from), in memory if None.
+    seed (optional, int): Seed of the order of the rays.
+
+    Returns:
+    The RayStore.
+    """
+
+    pixels_per_image = dataset.height * dataset.width
+    num_rays = len(dataset) * pixels_per_image
+    rgb_dtype = np.uint8 if dataset.images.dtype == np.uint8 else np.float32
+
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+        arrays = [np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+', dtype=dtype, shape=(num_rays, 3))
+                  for name, dtype in (('origins', np.float32), ('directions', np.float32), ('rgb', rgb_dtype))]
+    else:
+        arrays = [np.empty((num_rays, 3), dtype=dtype) for dtype in (np.float32, np.float32, rgb_dtype)]
+    origins, directions, rgb = arrays
+
+    # Position of every ray in the store
+    positions = np.random.default_rng(seed).permutation(num_rays)
+    for index in range(len(dataset)):
+        pose = dataset.cpu_poses[index]
+        ray_origins, ray_directions = get_rays(dataset.height, dataset.width, dataset.cpu_intrinsics, pose[:3, :3], pose[:3, 3])
+        image_positions = positions[index * pixels_per_image:(index + 1) * pixels_per_image]
+        origins[image_positions] = ray_origins.reshape(-1, 3).numpy()
+        directions[image_positions] = ray_directions.reshape(-1, 3).numpy()
+        rgb[image_positions] = np.asarray(dataset.images[index])[..., :3].reshape(-1, 3)
+
+    if path is not None:
+        for array in arrays:
+            array.flush()
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(store_meta(dataset, seed), f)
+
+    return RayStore(origins, directions, rgb)
+
+
+def open_ray_store(dataset, path=None, seed=0):
+
+    """
+    Open the store saved in path if it was built from the same training set (same shape and fingerprint,
+    see dataset_fingerprint), build (and save) it otherwise. With path None, the store is built in memory.
+    """
+
+    meta_path = os.path.join(path, 'meta.json') if path else None
+    if meta_path is not None and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if {key: meta.get(key) for key in ('num_images', 'height', 'width', 'fingerprint')} == \
+                {key: value for key, value in store_meta(dataset, seed).items() if key != 'seed'}:
+            return RayStore(*(np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in ('origins', 'directions', 'rgb')))
+        print("The ray store %s does not match the training set, rebuilding it" % path)
+
+    return build_ray_store(dataset, path or None, seed)
+
+
+class RayStorePrefetcher(RayBatchPrefetcher):
+
+    """
+    Iterate over the rays of a RayStore in shuffled epochs, num_prefetch batches ahead of the training loop.
+
+    The store is cut into chunks of batch_size / chunks_per_batch contiguous rays. Epoch e starts at a
+    random offset below one chunk and visits the chunks in a random order, both drawn from (seed, e), and
+    every batch is made of the next chunks_per_batch of them: every ray is trained on at most once per
+    epoch, and a batch holds different rays at every epoch. Batch k is a function of the seed and k, so a
+    resumed run gets the same batches. With num_shards processes, shard takes its chunks of every batch.
+    """
+
+    def __init__(self, store, batch_size, device=None, num_prefetch=4, seed=None, start_batch=0, shard=None, num_shards=1,
+                 chunks_per_batch=16):
+        self.store = store
+        self.num_shards = num_shards
+        self.chunk_size = max(1, batch_size // chunks_per_batch)
+        self.chunks_per_batch = -(-batch_size // self.chunk_size)
+        self.num_chunks = max(1, (len(store) - self.chunk_size + 1) // self.chunk_size)
+        self.batches_per_epoch = max(1, self.num_chunks // (self.chunks_per_batch * num_shards))
+        self.epoch, self.epoch_offset, self.epoch_order = None, 0, None
+        # The store is not a dataset, the batches are built on the CPU and sent to device (the CPU by default)
+        super().__init__(store, batch_size, device if device is not None else torch.device('cpu'), num_prefetch, seed=seed,
+                         start_batch=start_batch, shard=shard)
+
+    def make_batch(self, batch_index):
+        epoch, position = divmod(batch_index, self.batches_per_epoch)
+        if epoch != self.epoch:
+            rng = np.random.default_rng((self.seed, epoch))
+            self.epoch = epoch
+            self.epoch_offset = int(rng.integers(max(1, len(self.store) - self.num_chunks * self.chunk_size + 1)))
+            self.epoch_order = rng.permutation(self.num_chunks)
+
+        first = (position * self.num_shards + (self.shard or 0)) * self.chunks_per_batch
+        chunks = self.epoch_order[np.arange(first, first + self.chunks_per_batch) % self.num_chunks]
+        slices = [self.store.slice(self.epoch_offset + chunk * self.chunk_size, self.epoch_offset + (chunk + 1) * self.chunk_size)
+                  for chunk in chunks]
+        return tuple(torch.cat(arrays)[:self.batch_size] for arrays in zip(*slices))
@@ -0,0 +1,145 @@
+"""
+Camera rays: the rays through the pixels of a camera, and the cache of the ray bundles of fixed cameras.
+"""
+
+from collections import OrderedDict
+
+import torch
+
+from .encoding import positional_encoding
+
+
+def get_rays(height, width, intrinsics, w_R_c, w_T_c):
+
+    """
+    Compute the origin and direction of rays passing through all pixels of an image (one ray per pixel).
+
+    Args:
+    height: the height of an image.
+    width: the width of an image.
+    intrinsics: camera intrinsics matrix of shape (3, 3).
+    w_R_c: Rotation matrix of shape (3,3) from camera to world coordinates.
+    w_T_c: Translation vector of shape (3,1) that transforms
+
+    Returns:
+    ray_origins (torch.Tensor): A tensor of shape (height, width, 3) denoting the centers of
+      each ray. Note that desipte that all ray share the same origin, here we ask you to return
+      the ray origin for each ray as (height, width, 3).
+    ray_directions (torch.Tensor): A tensor of shape (height, width, 3) denoting the
+      direction of each ray.
+    """
+
+    device = intrinsics.device
+    ray_directions = torch.zeros((height, width, 3), device=device)  # placeholder
+    ray_origins = torch.zeros((height, width, 3), device=device)  # placeholder
+
+
+
+    # Create a grid of image coordinates
+    i, j = torch.meshgrid(
+        torch.arange(width, dtype=torch.float32, device=device),
+        torch.arange(height, dtype=torch.float32, device=device),
+        indexing='xy'
+    )
+
+    # Normalize image coordinates to be in the range [-1, 1]
+    dirs = torch.stack([(i - intrinsics[0, 2]) / intrinsics[0, 0],
+                        (j - intrinsics[1, 2]) / intrinsics[1, 1],
+                        torch.ones_like(i)], -1)
+
+    # Rotate ray directions to world coordinates
+    ray_directions = torch.sum(dirs[..., None, :] * w_R_c, -1)
+
+    # Set ray origins to the camera's position in world coordinates
+    ray_origins = w_T_c.expand(ray_directions.shape)
+
+
+
+    return ray_origins, ray_directions
+
+
+def get_pixel_rays(intrinsics, poses, rows, cols):
+
+    """
+    Compute the origin and direction of the rays through individual pixels, with the conventions of get_rays.
+
+    Args:
+    intrinsics: camera intrinsics matrix of shape (3, 3).
+    poses: Camera to world transformation of the image of each pixel. Shape: (num_rays, 4, 4).
+    rows, cols: Pixel coordinates. Shape: (num_rays,).
+
+    Returns:
+    ray_origins, ray_directions (torch.Tensor): Shape: (num_rays, 3).
+    """
+
+    dirs = torch.stack([(cols.float() - intrinsics[0, 2]) / intrinsics[0, 0],
+                        (rows.float() - intrinsics[1, 2]) / intrinsics[1, 1],
+                        torch.ones_like(cols, dtype=torch.float32)], -1)
+
+    ray_directions = torch.sum(dirs[..., None, :] * poses[:, :3, :3], -1)
+    ray_origins = poses[:, :3, 3]
+
+    return ray_origins, ray_directions
+
+
+def scale_intrinsics(intrinsics, height, width, new_height, new_width):
+
+    """
+    Adapt the camera intrinsics of height x width images to render new_height x new_width images
+    of the same field of view.
+    """
+
+    scaled = intrinsics.clone().float()
+    scaled[0] *= new_width / width
+    scaled[1] *= new_height / height
+
+    return scaled
+
+
+class RayCache:
+
+    """
+    LRU cache of the ray bundles of fixed cameras, keyed by (pose index, resolution, intrinsics, number of
+    direction frequencies). Each entry holds the ray origins, the ray directions and the positional encoding
+    of the unit ray directions (whose first 3 channels are the unit directions themselves), so that
+    get_rays and the direction encoding only run once per camera. If max_bytes is given, the least
+    recently used entries are evicted to keep the cache under it.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pose_index, pose, height, width, intrinsics, num_d_frequencies):
+
+        """
+        Returns:
+        ray_origins, ray_directions (torch.Tensor): The rays of the camera. Shape: (height, width, 3).
+        ray_directions_encoded (torch.Tensor): Encoding of the unit ray directions. Shape: (height, width, 3 + 6 * num_d_frequencies).
+        """
+
+        key = (pose_index, height, width, tuple(intrinsics.flatten().tolist()), num_d_frequencies)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        ray_origins, ray_directions = get_rays(height, width, intrinsics, pose[:3, :3], pose[:3, 3])
+        unit_directions = ray_directions / torch.norm(ray_directions, dim=-1, keepdim=True)
+        ray_directions_encoded = positional_encoding(unit_directions.reshape(-1, 3), num_d_frequencies).reshape(height, width, -1)
+
+        # The origins are an expanded view of the camera position and take no memory
+        entry = (ray_origins, ray_directions, ray_directions_encoded)
+        entry_bytes = sum(t.numel() * t.element_size() for t in (ray_directions, ray_directions_encoded))
+        self.entries[key] = entry
+        self.num_bytes += entry_bytes
+
+        while self.max_bytes is not None and self.num_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted_directions, evicted_encoded) = self.entries.popitem(last=False)
+            self.num_bytes -= sum(t.numel() * t.element_size() for t in (evicted_directions, evicted_encoded))
+
+        return entry
@@ -0,0 +1,327 @@
+"""
+Cache of rendered views, for viewers that request the same (or nearly the same) viewpoints repeatedly.
+
+A view is keyed by its camera pose quantized to a grid (translation_step, rotation_step), its intrinsics,
+its resolution and a fingerprint of the network weights and render settings, so changing the weights
+invalidates the cached views. The views are kept with their expected depth in an LRU memory tier and,
+optionally, in a directory with a size limit (least recently used files are removed first).
+
+A view missing from the cache can be reprojected from the closest cached view of the same camera if the
+pose moved by less than max_translation and max_degrees: the cached pixels are moved to the new view with
+their depth, and only the pixels left uncovered (disocclusions, borders) are rendered. If too many pixels
+are uncovered (max_hole_fraction), the view is rendered in full.
+"""
+
+import collections
+import hashlib
+import math
+import os
+import threading
+
+import numpy as np
+import torch
+
+from .rays import get_pixel_rays, get_rays
+
+
+class WeightsFingerprint:
+
+    """
+    Hash of the weights of networks and of a description of the render settings (extra). Calling it only
+    hashes the weights again when a tensor was modified or replaced since the previous call.
+    """
+
+    def __init__(self, models, extra=''):
+        self.tensors = [tensor for model in models if model is not None for tensor in model.state_dict(keep_vars=True).values()]
+        self.extra = extra
+        self.versions = None
+        self.value = None
+
+    def __call__(self):
+        versions = [(tensor.data_ptr(), tensor._version) for tensor in self.tensors]
+        if versions != self.versions:
+            digest = hashlib.sha1(self.extra.encode())
+            for tensor in self.tensors:
+                digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+            self.versions, self.value = versions, digest.hexdigest()
+        return self.value
+
+
+def rotation_degrees(rotation_a, rotation_b):
+
+    """
+    Angle of the rotation between two rotation matrices, in degrees.
+    """
+
+    cos = ((rotation_a.T @ rotation_b).trace() - 1) / 2
+    return math.degrees(math.acos(max(-1., min(1., float(cos)))))
+
+
+def reproject(image, depth, source_pose, target_pose, intrinsics):
+
+    """
+    Move the pixels of a view rendered from source_pose to the view from target_pose (same intrinsics),
+    using their depth. Pixels that land on the same target pixel keep the closest one.
+
+    Args:
+    image: The rendered view. Shape: (height, width, 3).
+    depth: Its expected depth, the camera z of every pixel (render_rays with return_depth). Shape: (height, width).
+    source_pose, target_pose: Camera to world transformations. Shape: (4, 4).
+    intrinsics: Camera intrinsics matrix. Shape: (3, 3).
+
+    Returns:
+    warped: The reprojected view, black where no pixel landed. Shape: (height, width, 3).
+    holes: True for the pixels where no pixel landed. Shape: (height, width).
+    """
+
+    height, width = depth.shape
+    ray_origins, ray_directions = get_rays(height, width, intrinsics, source_pose[:3, :3], source_pose[:3, 3])
+    points = (ray_origins + ray_directions * depth[..., None]).reshape(-1, 3)
+
+    # Into the target camera (the camera z of the directions of get_rays is 1)
+    camera_points = (points - target_pose[:3, 3]) @ target_pose[:3, :3]
+    z = camera_points[:, 2]
+    cols = torch.round(intrinsics[0, 0] * camera_points[:, 0] / z + intrinsics[0, 2]).long()
+    rows = torch.round(intrinsics[1, 1] * camera_points[:, 1] / z + intrinsics[1, 2]).long()
+    valid = (z > 1e-6) & (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+
+    targets = (rows * width + cols)[valid]
+    z, colors = z[valid], image.reshape(-1, 3)[valid]
+
+    # z-buffer: every target pixel takes the closest of the points that land on it
+    z_buffer = torch.full((height * width,), float('inf'), device=depth.device).scatter_reduce(0, targets, z, reduce='amin')
+    closest = z <= z_buffer[targets]
+    warped = torch.zeros(height * width, 3, device=image.device, dtype=image.dtype)
+    warped[targets[closest]] = colors[closest]
+
+    return warped.reshape(height, width, 3), torch.isinf(z_buffer).reshape(height, width)
+
+
+class RenderCache:
+
+    """
+    Rendered views with their depth, in an LRU memory tier and an optional directory.
+
+    Args:
+    max_memory_mb (optional, float): Memory of the cached views (float16 color and depth).
+    cache_dir (optional, str): Directory of the disk tier, None for memory only.
+    max_disk_mb (optional, float): Size of the disk tier.
+    translation_step (optional, float): Quantization of the camera position in the keys (scene units).
+    rotation_step (optional, float): Quantization of the entries of the camera rotation in the keys.
+    max_translation (optional, float): Largest camera move for a reprojection, 0 disables reprojection.
+    max_degrees (optional, float): Largest camera rotation for a reprojection.
+    max_hole_fraction (optional, float): Largest fraction of uncovered pixels of a reprojected view.
+    """
+
+    def __init__(self, max_memory_mb=256, cache_dir=None, max_disk_mb=1024, translation_step=1e-3, rotation_step=1e-3,
+                 max_translation=0., max_degrees=5., max_hole_fraction=0.05):
+        self.max_memory_bytes = max_memory_mb * 2**20
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_mb * 2**20
+        self.translation_step = translation_step
+        self.rotation_step = rotation_step
+        self.max_translation = max_translation
+        self.max_degrees = max_degrees
+        self.max_hole_fraction = max_hole_fraction
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.entries = collections.OrderedDict()
+        self.memory_bytes = 0
+        self.fingerprint = None
+        self.lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'reprojections': 0, 'misses': 0, 'evictions': 0}
+
+    def key(self, pose, intrinsics, height, width, fingerprint):
+        quantized_pose = (torch.round(pose[:3, 3].cpu() / self.translation_step).long().tolist(),
+                          torch.round(pose[:3, :3].cpu() / self.rotation_step).long().tolist())
+        quantized_intrinsics = torch.round(intrinsics.cpu() * 1000).long().tolist()
+        return hashlib.sha1(repr((quantized_pose, quantized_intrinsics, height, width, fingerprint)).encode()).hexdigest()
+
+    def set_fingerprint(self, fingerprint):
+
+        """
+        Drop the views of other weights from memory (those on disk are never matched again and age out).
+        """
+
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self.entries.clear()
+                self.memory_bytes = 0
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def insert(self, key, entry):
+        # With the lock held
+        if key in self.entries:
+            self.memory_bytes -= self.entries.pop(key)['bytes']
+        self.entries[key] = entry
+        self.memory_bytes += entry['bytes']
+        while self.memory_bytes > self.max_memory_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.memory_bytes -= evicted['bytes']
+            self.stats['evictions'] += 1
+
+    def get(self, key):
+
+        """
+        The cached entry of key (memory first, then disk), None if missing.
+        """
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return self.entries[key]
+
+            if self.cache_dir is None or not os.path.exists(self.disk_path(key)):
+                return None
+            try:
+                with np.load(self.disk_path(key)) as data:
+                    entry = make_entry(*(torch.from_numpy(data[name]) for name in ('image', 'depth', 'pose', 'intrinsics')))
+                os.utime(self.disk_path(key))  # Recently used
+            except (OSError, ValueError, KeyError):
+                return None  # Removed by another process, or partially written by a crash
+            self.insert(key, entry)
+            self.stats['disk_hits'] += 1
+            return entry
+
+    def put(self, key, image, depth, pose, intrinsics):
+        entry = make_entry(image, depth, pose, intrinsics)
+        with self.lock:
+            self.insert(key, entry)
+        if self.cache_dir is not None:
+            self.write(key, entry)
+
+    def write(self, key, entry):
+        tmp_path = self.disk_path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **{name: entry[name].numpy() for name in ('image', 'depth', 'pose', 'intrinsics')})
+        os.replace(tmp_path, self.disk_path(key))
+
+        # Remove the least recently used files beyond the size of the disk tier
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+    def nearest(self, pose, intrinsics, height, width):
+
+        """
+        The cached entry in memory closest to pose with the same intrinsics and resolution, within
+        max_translation and max_degrees, None if there is none.
+        """
+
+        if self.max_translation <= 0:
+            return None
+
+        pose, intrinsics = pose.cpu().float(), intrinsics.cpu().float()
+        best, best_distance = None, None
+        with self.lock:
+            for entry in self.entries.values():
+                if entry['depth'].shape != (height, width) or not torch.allclose(entry['intrinsics'], intrinsics, atol=1e-3):
+                    continue
+                distance = torch.linalg.norm(entry['pose'][:3, 3] - pose[:3, 3]).item()
+                degrees = rotation_degrees(entry['pose'][:3, :3], pose[:3, :3])
+                if distance <= self.max_translation and degrees <= self.max_degrees and \
+                        (best is None or distance + degrees / self.max_degrees * self.max_translation < best_distance):
+                    best, best_distance = entry, distance + degrees / self.max_degrees * self.max_translation
+
+        return best
+
+    def lookup(self, pose, intrinsics, height, width, fingerprint):
+
+        """
+        Find a view in the cache.
+
+        Returns:
+        A tuple (key, image, holes). On a hit, image is the cached view and holes None. On a reprojection,
+        image is the reprojected view and holes the mask of the pixels left to render, shape (height, width).
+        On a miss, image and holes are None and the view should be rendered and put() with key.
+        """
+
+        self.set_fingerprint(fingerprint)
+        key = self.key(pose, intrinsics, height, width, fingerprint)
+        entry = self.get(key)
+        if entry is not None:
+            return key, entry['image'].float(), None
+
+        source = self.nearest(pose, intrinsics, height, width)
+        if source is not None:
+            warped, holes = reproject(source['image'].float(), source['depth'].float(), source['pose'], pose.cpu().float(),
+                                      intrinsics.cpu().float())
+            if holes.float().mean().item() <= self.max_hole_fraction:
+                with self.lock:
+                    self.stats['reprojections'] += 1
+                return key, warped, holes
+
+        with self.lock:
+            self.stats['misses'] += 1
+        return key, None, None
+
+    def summary(self):
+        with self.lock:
+            return dict(self.stats, memory_entries=len(self.entries), memory_mb=self.memory_bytes / 2**20)
+
+
+def make_entry(image, depth, pose, intrinsics):
+    image, depth = image.detach().cpu().half(), depth.detach().cpu().half()
+    return {'image': image, 'depth': depth, 'pose': pose.detach().cpu().float(), 'intrinsics': intrinsics.detach().cpu().float(),
+            'bytes': image.numel() * 2 + depth.numel() * 2}
+
+
+def render_cached(cache, render_fn, pose, height, width, intrinsics, fingerprint, rays_per_batch=2**14):
+
+    """
+    Render a view through the cache.
+
+    Args:
+    cache (RenderCache): The cache.
+    render_fn: Function (ray_origins, ray_directions) -> (num_rays, 4) color and depth, e.g. make_render_fn
+      with return_depth=True.
+    pose: Camera to world transformation. Shape: (4, 4).
+    height, width, intrinsics: Camera of the view.
+    fingerprint (str): Fingerprint of the weights and render settings, e.g. from a WeightsFingerprint.
+    rays_per_batch (optional, int): Rays passed to render_fn at once.
+
+    Returns:
+    A tuple (image, source): the view, shape (height, width, 3), and 'hit', 'reprojected' or 'rendered'.
+    """
+
+    key, image, holes = cache.lookup(pose, intrinsics, height, width, fingerprint)
+    if image is not None and holes is None:
+        return image, 'hit'
+
+    if image is not None:
+        # Render the uncovered pixels of the reprojected view only. Reprojected views are not cached, so
+        # that the errors of successive reprojections do not accumulate.
+        rows, cols = torch.nonzero(holes, as_tuple=True)
+        for start in range(0, rows.shape[0], rays_per_batch):
+            batch_rows, batch_cols = rows[start:start + rays_per_batch], cols[start:start + rays_per_batch]
+            ray_origins, ray_directions = get_pixel_rays(intrinsics.cpu().float(), pose.cpu().float().expand(batch_rows.shape[0], 4, 4),
+                                                         batch_rows, batch_cols)
+            image[batch_rows, batch_cols] = render_fn(ray_origins, ray_directions)[:, :3].cpu().float()
+        return image, 'reprojected'
+
+    ray_origins, ray_directions = get_rays(height, width, intrinsics, pose[:3, :3], pose[:3, 3])
+    ray_origins, ray_directions = ray_origins.reshape(-1, 3), ray_directions.reshape(-1, 3)
+    outputs = torch.cat([render_fn(ray_origins[start:start + rays_per_batch], ray_directions[start:start + rays_per_batch]).cpu()
+                         for start in range(0, ray_origins.shape[0], rays_per_batch)]).reshape(height, width, 4)
+    cache.put(key, outputs[..., :3], outputs[..., 3], pose, intrinsics)
+
+    return outputs[..., :3].float(), 'rendered'
@@ -0,0 +1,603 @@
+"""
+Rendering of rays with the network: batching of the network inputs, volumetric rendering, the
+hierarchical and early-terminated variants and the streaming renderer for large images.
+"""
+
+import math
+
+import torch
+import torch.nn.functional as F
+
+from .encoding import positional_encoding
+from .occupancy import estimate_ray_bounds
+from .profiling import stage, count
+from .rays import get_rays
+from .sampling import sample_pdf, stratified_sampling
+
+
+def get_batches(ray_points, ray_directions, num_x_frequencies, num_d_frequencies, ray_directions_encoded=None, chunksize=2**15):
+
+    def get_chunks(inputs, chunksize = chunksize):
+        """
+        This fuction gets an array/list as input and returns a list of chunks of the initial array/list
+        """
+        return [inputs[i:i + chunksize] for i in range(0, inputs.shape[0], chunksize)]
+
+    """
+    This function returns chunks of the ray points and directions to avoid memory errors with the
+    neural network. It also applies positional encoding to the input points and directions before
+    dividing them into chunks, as well as normalizing and populating the directions.
+    The directions are encoded once per ray, or not at all if ray_directions_encoded is given
+    (e.g. by a RayCache), before being repeated for each point along the ray.
+    """
+
+    if ray_directions_encoded is None:
+        # Normalize ray directions and apply positional encoding to them
+        ray_directions = ray_directions / torch.norm(ray_directions, dim=-1, keepdim=True)
+        ray_directions_encoded = positional_encoding(ray_directions.reshape(-1, 3), num_d_frequencies)
+        ray_directions_encoded = ray_directions_encoded.reshape(*ray_directions.shape[:-1], -1)
+
+    # Repeat the encoded ray directions for each point along the ray
+    ray_directions_encoded = ray_directions_encoded[..., None, :].expand(*ray_points.shape[:-1], ray_directions_encoded.shape[-1])
+
+    # Flatten and apply positional encoding to ray points
+    ray_points_flat = ray_points.reshape(-1, 3)
+    ray_points_encoded = positional_encoding(ray_points_flat, num_x_frequencies)
+    ray_directions_encoded = ray_directions_encoded.reshape(ray_points_encoded.shape[0], -1)
+
+    # Divide into chunks
+    ray_points_batches = get_chunks(ray_points_encoded)
+    ray_directions_batches = get_chunks(ray_directions_encoded)
+
+
+
+
+    return ray_points_batches, ray_directions_batches
+
+
+def volumetric_rendering_cumprod(rgb, s, depth_points):
+
+    """
+    Reference implementation of volumetric_rendering with a cumulative product of the transmittances,
+    kept to check and benchmark the fused version.
+    """
+
+    # For the last sample, use a large value (1e9) to simulate no further points along the ray
+    dists = torch.cat([depth_points[..., 1:] - depth_points[..., :-1], torch.tensor([1e9], device=depth_points.device, dtype=depth_points.dtype).expand(depth_points[..., :1].shape)], -1)
+
+    # Calculate alpha values (opacity) for each point using the density (sigma) and distance (delta)
+    # Apply ReLU to sigma to avoid negative or infinite values
+    alpha = 1. - torch.exp(-F.relu(s) * dists)
+
+    # Calculate accumulated transmittance (T_i) for each point along the ray
+    # Accumulated transmittance represents the probability of light reaching a point without being blocked by previous points
+    T = torch.cumprod(1. - alpha + 1e-10, dim=-1)
+
+    # Shift the transmittance values so that T_i is multiplied by the alpha of the previous point (T_(i-1))
+    T = torch.roll(T, 1, dims=-1)
+    T[..., 0] = 1.  # Set transmittance at the first point to 1 (no previous points to block light)
+
+    # Calculate the weighted color for each point along the ray using the color (c_i), alpha (1 - exp(-sigma_i * delta_i)), and transmittance (T_i)
+    weights = alpha * T
+
+    # Calculate the final color for each ray (pixel) by summing the weighted colors of all points along the ray
+    rec_image = torch.sum(weights[..., None] * rgb, -2)
+
+    return rec_image
+
+
+def composite_weights(s, depth_points):
+
+    """
+    Compositing weights in log space: with tau_i = relu(sigma_i) * delta_i the optical thickness of sample i,
+    the transmittance in front of it is T_i = exp(-sum_{j<i} tau_j) (an exclusive cumulative sum) and its
+    weight is T_i * (1 - exp(-tau_i)).
+
+    Returns:
+    dists, tau, T, weights. Shape: (..., samples)
+    """
+
+    # The last sample extends to infinity (1e9)
+    dists = F.pad(depth_points[..., 1:] - depth_points[..., :-1], (0, 1), value=1e9)
+    tau = F.relu(s) * dists
+    T = torch.exp(F.pad(torch.cumsum(tau[..., :-1], -1), (1, 0)).neg_())
+    weights = torch.expm1(-tau).neg_().mul_(T)
+
+    return dists, tau, T, weights
+
+
+class CompositeRays(torch.autograd.Function):
+
+    """
+    Volumetric rendering as a single autograd node. Only its inputs are saved for the backward pass, which
+    recomputes the weights instead of keeping the alphas, transmittances and products of every sample.
+    With v_i the gradient of the loss with respect to the weight of sample i (through the color, depth,
+    opacity and weights outputs), the gradient with respect to tau_k is T_{k+1} v_k - sum_{i>k} w_i v_i.
+    The depths get no gradient.
+    """
+
+    @staticmethod
+    def forward(ctx, rgb, s, depth_points):
+        _, _, _, weights = composite_weights(s, depth_points)
+        rec_image = torch.matmul(weights.unsqueeze(-2), rgb).squeeze(-2)
+        depth = torch.sum(weights * depth_points, -1)
+        opacity = torch.sum(weights, -1)
+
+        ctx.save_for_backward(rgb, s, depth_points)
+        return rec_image, depth, opacity, weights
+
+    @staticmethod
+    def backward(ctx, grad_image, grad_depth, grad_opacity, grad_weights):
+        rgb, s, depth_points = ctx.saved_tensors
+        dists, tau, T, weights = composite_weights(s, depth_points)
+
+        grad_rgb = weights[..., None] * grad_image[..., None, :]
+
+        v = torch.matmul(rgb, grad_image[..., None]).squeeze(-1)
+        v.add_(grad_depth[..., None] * depth_points).add_(grad_opacity[..., None]).add_(grad_weights)
+
+        weighted_v = weights * v
+        behind = weighted_v.sum(-1, keepdim=True) - torch.cumsum(weighted_v, -1)
+        # T_{k+1} = T_k * exp(-tau_k)
+        grad_tau = T.mul_(tau.neg_().exp_()).mul_(v).sub_(behind)
+
+        # d tau / d sigma = delta where sigma > 0 (ReLU)
+        grad_s = grad_tau.mul_(dists).mul_(s > 0)
+
+        return grad_rgb, grad_s, None
+
+
+def volumetric_rendering(rgb, s, depth_points, return_weights=False, return_depth=False, return_opacity=False):
+
+    """
+    Differentiably renders a radiance field, given the origin of each ray in the
+    "bundle", and the sampled depth values along them.
+
+    The samples are composited in log space (exclusive cumulative sum of the optical thicknesses)
+    by the CompositeRays autograd function.
+
+    Args:
+    rgb: RGB color at each query location (X, Y, Z). Shape: (height, width, samples, 3).
+    sigma: Volume density at each query location (X, Y, Z). Shape: (height, width, samples).
+    depth_points: Sampled depth values along each ray. Shape: (height, width, samples).
+    return_weights (optional, bool): If True, also return the weight of every sample (default: False).
+    return_depth (optional, bool): If True, also return the expected depth of every ray (default: False).
+    return_opacity (optional, bool): If True, also return the accumulated opacity of every ray (default: False).
+
+    Returns:
+    rec_image: The reconstructed image after applying the volumetric rendering to every pixel.
+    Shape: (height, width, 3)
+    weights (only if return_weights): Contribution of every sample to the color of its ray,
+    used to importance sample the fine pass. Shape: (height, width, samples)
+    depth (only if return_depth): Expected depth of every ray. Shape: (height, width)
+    opacity (only if return_opacity): Accumulated opacity of every ray, in [0, 1]. Shape: (height, width)
+    """
+
+    rec_image, depth, opacity, weights = CompositeRays.apply(rgb, s, depth_points)
+
+    outputs = (rec_image,)
+    if return_weights:
+        outputs += (weights,)
+    if return_depth:
+        outputs += (depth,)
+    if return_opacity:
+        outputs += (opacity,)
+
+    return outputs[0] if len(outputs) == 1 else outputs
+
+
+def run_network(ray_points, ray_directions, model, num_x_frequencies, num_d_frequencies, mask=None, ray_directions_encoded=None):
+
+    """
+    Evaluate the network on every sampled point, in chunks to avoid memory errors.
+
+    Args:
+    ray_points: Query 3D points along each ray. Shape: (..., samples, 3).
+    ray_directions: Direction of each ray. Shape: (..., 3).
+    model: The NeRF network.
+    num_x_frequencies: Number of frequencies used to encode the sample positions.
+    num_d_frequencies: Number of frequencies used to encode the ray directions.
+    mask (optional, torch.Tensor): If given, only the points where mask is True are evaluated,
+      the others get zero color and density. Shape: (..., samples).
+    ray_directions_encoded (optional, torch.Tensor): Precomputed encoding of the unit ray directions. Shape: (..., dim).
+
+    Returns:
+    rgb: RGB color at each query location. Shape: (..., samples, 3).
+    sigma: Volume density at each query location. Shape: (..., samples).
+    """
+
+    if mask is not None:
+        rgb = torch.zeros(ray_points.shape, device=ray_points.device)
+        sigma = torch.zeros(ray_points.shape[:-1], device=ray_points.device)
+        count('points_skipped', mask.numel() - mask.sum())
+        if not mask.any():
+            return rgb, sigma
+
+        # Evaluate the selected points as a flat bundle of single-sample rays
+        points_selected = ray_points[mask][:, None, :]
+        directions_selected = ray_directions[..., None, :].expand(ray_points.shape)[mask]
+        directions_encoded_selected = None
+        if ray_directions_encoded is not None:
+            directions_encoded_selected = ray_directions_encoded[..., None, :].expand(*ray_points.shape[:-1], ray_directions_encoded.shape[-1])[mask]
+        rgb_selected, sigma_selected = run_network(points_selected, directions_selected, model, num_x_frequencies, num_d_frequencies,
+                                                   ray_directions_encoded=directions_encoded_selected)
+
+        rgb = rgb.index_put((mask,), rgb_selected[:, 0].to(rgb.dtype))
+        sigma = sigma.index_put((mask,), sigma_selected[:, 0].to(sigma.dtype))
+        return rgb, sigma
+
+    #divide data into batches to avoid memory errors
+    with stage('encoding'):
+        ray_points_batches, ray_directions_batches = get_batches(ray_points, ray_directions, num_x_frequencies, num_d_frequencies,
+                                                                 ray_directions_encoded=ray_directions_encoded)
+    count('points_evaluated', ray_points.numel() // 3)
+
+    #forward pass the batches and concatenate the outputs at the end
+    rgb_batches = []
+    sigma_batches = []
+    with stage('mlp'):
+        for ray_points_batch, ray_directions_batch in zip(ray_points_batches, ray_directions_batches):
+            rgb_batch, sigma_batch = model(ray_points_batch, ray_directions_batch)
+            rgb_batches.append(rgb_batch)
+            sigma_batches.append(sigma_batch)
+
+    rgb = torch.cat(rgb_batches, dim=0)
+    sigma = torch.cat(sigma_batches, dim=0)
+
+    # Reshape rgb and sigma to match the original dimensions
+    rgb = rgb.reshape(ray_points.shape)
+    sigma = sigma.reshape(ray_points.shape[:-1])
+
+    return rgb, sigma
+
+
+def march_rays(ray_points, depth_points, ray_directions, model, num_x_frequencies, num_d_frequencies,
+               occupancy_grid=None, transmittance_threshold=1e-3, step_samples=16, ray_directions_encoded=None):
+
+    """
+    Composite the samples of every ray front to back, step_samples at a time, and stop evaluating
+    the network for rays whose accumulated transmittance dropped below transmittance_threshold.
+    Points in empty cells of the occupancy grid are not evaluated either. Meant for rendering.
+
+    Args:
+    ray_points: Query 3D points along each ray. Shape: (..., samples, 3).
+    depth_points: Sampled depth values along each ray. Shape: (..., samples).
+    ray_directions: Direction of each ray. Shape: (..., 3).
+    model: The NeRF network.
+    num_x_frequencies: Number of frequencies used to encode the sample positions.
+    num_d_frequencies: Number of frequencies used to encode the ray directions.
+    occupancy_grid (optional, OccupancyGrid): Grid used to skip the points of empty cells.
+    transmittance_threshold (optional, float): Transmittance under which a ray is terminated.
+    step_samples (optional, int): Number of samples composited per step.
+    ray_directions_encoded (optional, torch.Tensor): Precomputed encoding of the unit ray directions. Shape: (..., dim).
+
+    Returns:
+    rec_rgb: The reconstructed color of every ray. Shape: (..., 3)
+    weights: Contribution of every sample to the color of its ray. Shape: (..., samples)
+    """
+
+    samples = depth_points.shape[-1]
+    dists = F.pad(depth_points[..., 1:] - depth_points[..., :-1], (0, 1), value=1e9)
+
+    rec_rgb = torch.zeros(*depth_points.shape[:-1], 3, device=depth_points.device)
+    weights = torch.zeros_like(depth_points)
+    log_T = torch.zeros(depth_points.shape[:-1], device=depth_points.device)
+
+    for start in range(0, samples, step_samples):
+        end = min(start + step_samples, samples)
+
+        # Only evaluate the rays that are still (mostly) transparent
+        active = log_T > math.log(transmittance_threshold)
+        if not active.any():
+            break
+        mask = active[..., None].expand(*active.shape, end - start)
+        if occupancy_grid is not None:
+            mask = mask & occupancy_grid.query(ray_points[..., start:end, :])
+
+        rgb, sigma = run_network(ray_points[..., start:end, :], ray_directions, model, num_x_frequencies, num_d_frequencies,
+                                 mask=mask, ray_directions_encoded=ray_directions_encoded)
+
+        # Same compositing as volumetric_rendering, continued from the transmittance of the previous steps
+        with stage('compositing'):
+            tau = F.relu(sigma) * dists[..., start:end]
+            log_T_step = log_T[..., None] - F.pad(torch.cumsum(tau[..., :-1], -1), (1, 0))
+            weights[..., start:end] = torch.exp(log_T_step) * -torch.expm1(-tau)
+            rec_rgb = rec_rgb + torch.matmul(weights[..., None, start:end], rgb).squeeze(-2)
+            log_T = log_T_step[..., -1] - tau[..., -1]
+
+    count('rays_terminated', (log_T <= math.log(transmittance_threshold)).sum())
+
+    return rec_rgb, weights
+
+
+def shade_samples(ray_points, depth_points, ray_directions, model, num_x_frequencies, num_d_frequencies,
+                  occupancy_grid=None, transmittance_threshold=0., ray_directions_encoded=None):
+
+    """
+    Evaluate the network along the rays and composite the samples, skipping empty cells of the
+    occupancy grid and, if transmittance_threshold > 0, terminating rays early.
+
+    Returns:
+    rec_rgb: The reconstructed color of every ray. Shape: (..., 3)
+    weights: Contribution of every sample to the color of its ray. Shape: (..., samples)
+    """
+
+    if transmittance_threshold > 0:
+        return march_rays(ray_points, depth_points, ray_directions, model, num_x_frequencies, num_d_frequencies,
+                          occupancy_grid=occupancy_grid, transmittance_threshold=transmittance_threshold,
+                          ray_directions_encoded=ray_directions_encoded)
+
+    mask = occupancy_grid.query(ray_points) if occupancy_grid is not None else None
+    rgb, sigma = run_network(ray_points, ray_directions, model, num_x_frequencies, num_d_frequencies,
+                             mask=mask, ray_directions_encoded=ray_directions_encoded)
+
+    with stage('compositing'):
+        return volumetric_rendering(rgb, sigma, depth_points, return_weights=True)
+
+
+def render_rays(ray_origins, ray_directions, near, far, samples, model, num_x_frequencies, num_d_frequencies,
+                perturb=False, model_fine=None, fine_samples=0, return_coarse=False,
+                occupancy_grid=None, transmittance_threshold=0., ray_directions_encoded=None, return_depth=False):
+
+    """
+    Render the color of an arbitrary bundle of rays: sample points along them, run the network on
+    the points in chunks and composite the outputs with volumetric rendering.
+
+    Args:
+    ray_origins: Origin of each ray. Shape: (..., 3), e.g. (height, width, 3) or (num_rays, 3).
+    ray_directions: Direction of each ray. Same shape as ray_origins.
+    near: The 'near' extent of the bounding volume.
+    far:  The 'far' extent of the bounding volume.
+    samples: Number of samples to be drawn along each ray.
+    model: The NeRF network.
+    num_x_frequencies: Number of frequencies used to encode the sample positions.
+    num_d_frequencies: Number of frequencies used to encode the ray directions.
+    perturb (optional, bool): Jitter the stratified samples and draw the fine samples at random (default: False).
+    model_fine (optional, nn.Module): If given, the samples of the coarse pass (evaluated by model) are used
+      to importance sample fine_samples more depths along each ray, and model_fine evaluates all of them.
+    fine_samples (optional, int): Number of depths drawn along each ray for the fine pass.
+    return_coarse (optional, bool): If True, also return the color of the coarse pass
+      (None without model_fine), which is needed to train the coarse network.
+    occupancy_grid (optional, OccupancyGrid): If given, points in empty cells are not evaluated.
+    transmittance_threshold (optional, float): If > 0, stop evaluating rays whose transmittance drops
+      below this value. This is only meant for rendering, as the skipped samples get no gradients.
+    ray_directions_encoded (optional, torch.Tensor): Precomputed encoding of the unit ray directions,
+      e.g. from a RayCache. Shape: (..., dim).
+    return_depth (optional, bool): If True, also return the expected depth of every ray.
+
+    Returns:
+    rec_rgb: The reconstructed color of every ray. Shape: (..., 3)
+    rec_rgb_coarse (only if return_coarse): The color of every ray after the coarse pass. Shape: (..., 3)
+    rec_depth (only if return_depth): The expected depth of every ray (along ray_directions, i.e. the
+      camera z of rays from get_rays), the transmittance left at the end of a ray counting as a hit at far. Shape: (...)
+    """
+
+    count('rays', ray_origins.numel() // 3)
+
+    #sample the points from the rays
+    with stage('sampling'):
+        ray_points, depth_points = stratified_sampling(ray_origins, ray_directions, near, far, samples, perturb=perturb)
+
+    #run the (coarse) network on the points and apply volumetric rendering to obtain the color of every ray
+    rec_rgb, weights = shade_samples(ray_points, depth_points, ray_directions, model, num_x_frequencies, num_d_frequencies,
+                                     occupancy_grid=occupancy_grid, transmittance_threshold=transmittance_threshold,
+                                     ray_directions_encoded=ray_directions_encoded)
+
+    rec_rgb_coarse = None
+    if model_fine is not None:
+        rec_rgb_coarse = rec_rgb
+
+        with stage('sampling'):
+            # Draw the fine depths where the coarse weights are high, using the midpoints between samples as bin edges
+            depth_mids = .5 * (depth_points[..., 1:] + depth_points[..., :-1])
+            fine_depths = sample_pdf(depth_mids, weights[..., 1:-1].detach(), fine_samples, deterministic=not perturb)
+
+            # The fine network evaluates the coarse and the fine depths together, sorted along each ray
+            depth_points, _ = torch.sort(torch.cat([depth_points, fine_depths], -1), -1)
+            ray_points = ray_origins[..., None, :] + ray_directions[..., None, :] * depth_points[..., None]
+
+        rec_rgb, weights = shade_samples(ray_points, depth_points, ray_directions, model_fine, num_x_frequencies, num_d_frequencies,
+                                         occupancy_grid=occupancy_grid, transmittance_threshold=transmittance_threshold,
+                                         ray_directions_encoded=ray_directions_encoded)
+
+    outputs = [rec_rgb]
+    if return_coarse:
+        outputs.append(rec_rgb_coarse)
+    if return_depth:
+        outputs.append((weights * depth_points).sum(-1) + (1 - weights.sum(-1)) * far)
+
+    return tuple(outputs) if len(outputs) > 1 else rec_rgb
+
+
+def sample_buckets(samples, min_samples):
+
+    """
+    Sample counts a ray can be given: the powers of two from min_samples, and samples.
+    """
+
+    buckets = []
+    bucket_samples = max(4, min_samples)
+    while bucket_samples < samples:
+        buckets.append(bucket_samples)
+        bucket_samples *= 2
+
+    return buckets + [samples]
+
+
+def render_rays_adaptive(ray_origins, ray_directions, near, far, samples, model, num_x_frequencies, num_d_frequencies,
+                         aabb, occupancy_grid=None, min_samples=0, model_fine=None, fine_samples=0,
+                         transmittance_threshold=0., ray_directions_encoded=None, return_depth=False):
+
+    """
+    Render rays with a sample budget per ray, without gradients. Every ray is clipped to the scene box
+    aabb (and to the occupied cells of occupancy_grid, if given); the rays that miss it are not rendered
+    and stay black. If min_samples > 0, each ray gets a number of samples proportional to the length of
+    its segment (samples for the whole [near, far] range, at least min_samples), rounded up to a power
+    of two so that the rays are rendered in a few groups of equal sample counts.
+
+    Args:
+    aabb: Minimum and maximum corner of the scene box. Shape: (2, 3).
+    occupancy_grid (optional, OccupancyGrid): Grid used to tighten the segment of every ray.
+    min_samples (optional, int): Smallest number of samples of a ray, 0 to give samples to every ray.
+    The other arguments are the ones of render_rays, fine_samples is scaled like the samples of each ray.
+
+    Returns:
+    rec_rgb: The reconstructed color of every ray. Shape: (..., 3)
+    rec_depth (only if return_depth): The expected depth of every ray, far for the rays that miss the box. Shape: (...)
+    """
+
+    shape = ray_origins.shape[:-1]
+    ray_origins = ray_origins.reshape(-1, 3)
+    ray_directions = ray_directions.reshape(-1, 3)
+    if ray_directions_encoded is not None:
+        ray_directions_encoded = ray_directions_encoded.reshape(ray_origins.shape[0], -1)
+
+    with torch.no_grad():
+        with stage('ray_bounds'):
+            t_near, t_far, hit = estimate_ray_bounds(ray_origins, ray_directions, near, far, aabb, occupancy_grid)
+        count('rays_missed', hit.numel() - hit.sum())
+
+        if min_samples > 0:
+            buckets = sample_buckets(samples, min_samples)
+            wanted = torch.ceil(samples * (t_far - t_near) / (far - near))
+            ray_buckets = torch.bucketize(wanted, torch.tensor(buckets, dtype=wanted.dtype, device=wanted.device))
+        else:
+            buckets = [samples]
+            ray_buckets = torch.zeros_like(hit, dtype=torch.long)
+
+        rec_rgb = torch.zeros(ray_origins.shape[0], 3, device=ray_origins.device)
+        rec_depth = torch.full((ray_origins.shape[0],), float(far), device=ray_origins.device)
+        for bucket, bucket_samples in enumerate(buckets):
+            indices = torch.nonzero(hit & (ray_buckets.clamp(max=len(buckets) - 1) == bucket)).squeeze(-1)
+            if indices.numel() == 0:
+                continue
+
+            outputs = render_rays(ray_origins[indices], ray_directions[indices], t_near[indices], t_far[indices], bucket_samples,
+                                  model, num_x_frequencies, num_d_frequencies, model_fine=model_fine,
+                                  fine_samples=-(-fine_samples * bucket_samples // samples), occupancy_grid=occupancy_grid,
+                                  transmittance_threshold=transmittance_threshold,
+                                  ray_directions_encoded=ray_directions_encoded[indices] if ray_directions_encoded is not None else None,
+                                  return_depth=return_depth)
+            if return_depth:
+                rec_rgb[indices], rec_depth[indices] = outputs
+            else:
+                rec_rgb[indices] = outputs
+
+    if return_depth:
+        return rec_rgb.reshape(*shape, 3), rec_depth.reshape(shape)
+
+    return rec_rgb.reshape(*shape, 3)
+
+
+def one_forward_pass(height, width, intrinsics, pose, near, far, samples, model, num_x_frequencies, num_d_frequencies,
+                     perturb=False, model_fine=None, fine_samples=0, return_coarse=False,
+                     occupancy_grid=None, transmittance_threshold=0., ray_cache=None, pose_index=None):
+
+
+
+    #compute all the rays from the image, or reuse them from the ray cache
+    with stage('rays'):
+        if ray_cache is not None:
+            ray_origins, ray_directions, ray_directions_encoded = ray_cache.get(pose_index, pose, height, width, intrinsics, num_d_frequencies)
+        else:
+            ray_origins, ray_directions = get_rays(height, width, intrinsics, pose[:3, :3], pose[:3, 3])
+            ray_directions_encoded = None
+
+    # Render every ray of the image, the result keeps the (height, width, 3) layout of the rays
+    rec_image = render_rays(ray_origins, ray_directions, near, far, samples, model, num_x_frequencies, num_d_frequencies,
+                            perturb=perturb, model_fine=model_fine, fine_samples=fine_samples, return_coarse=return_coarse,
+                            occupancy_grid=occupancy_grid, transmittance_threshold=transmittance_threshold,
+                            ray_directions_encoded=ray_directions_encoded)
+
+
+
+
+    return rec_image
+
+
+def estimate_bytes_per_ray(model, samples, num_x_frequencies, num_d_frequencies, fine_samples=0):
+
+    """
+    Estimate the memory needed to render one ray with render_rays: its sample points and directions,
+    their encodings and the network outputs of every sample. The activations of the network for one
+    chunk of get_batches come on top of it.
+    """
+
+    if getattr(model, 'encoding', 'sinusoidal') == 'hash':
+        # The hash encoding gathers the features of the 8 vertices around each point
+        floats_x = 3 + 8 * model.encoder.output_dim
+    else:
+        floats_x = 3 + 2 * 3 * num_x_frequencies
+    floats_d = 3 + 2 * 3 * num_d_frequencies
+
+    # points, expanded directions, encodings, rgb, sigma, depth and weights of every sample
+    floats_per_sample = 3 + 3 + floats_x + floats_d + 3 + 1 + 2
+
+    return 4 * floats_per_sample * (samples + fine_samples)
+
+
+def render_image_streaming(height, width, intrinsics, pose, near, far, samples, model, num_x_frequencies, num_d_frequencies,
+                           memory_budget_mb=512, model_fine=None, fine_samples=0, occupancy_grid=None, transmittance_threshold=0.,
+                           ray_cache=None, pose_index=None, aabb=None, min_samples=0):
+
+    """
+    Render an image tile by tile, without gradients: the rays of each tile are generated, sampled,
+    encoded, evaluated and composited before moving to the next one, so the sample tensors never
+    exceed memory_budget_mb whatever the resolution. Only the output image is kept in full.
+
+    Args:
+    height: the height of the rendered image.
+    width: the width of the rendered image.
+    intrinsics: camera intrinsics matrix for the rendered resolution (see scale_intrinsics). Shape: (3, 3).
+    pose: Camera to world transformation. Shape: (4, 4).
+    memory_budget_mb (optional, float): Memory allowed for the sample tensors of one tile.
+    ray_cache (optional, RayCache): If given, the tiles are sliced from the cached rays of pose_index.
+    aabb (optional, torch.Tensor): If given, the tiles are rendered by render_rays_adaptive with this
+      scene box and min_samples.
+    The other arguments are the ones of render_rays.
+
+    Returns:
+    rec_image: The rendered image. Shape: (height, width, 3)
+    """
+
+    bytes_per_ray = estimate_bytes_per_ray(model_fine if model_fine is not None else model, samples,
+                                           num_x_frequencies, num_d_frequencies, fine_samples)
+    rays_per_tile = max(1, int(memory_budget_mb * 2**20) // bytes_per_ray)
+    tile_width = min(width, rays_per_tile)
+    tile_height = max(1, rays_per_tile // tile_width)
+
+    if ray_cache is not None:
+        cached_rays = ray_cache.get(pose_index, pose, height, width, intrinsics, num_d_frequencies)
+
+    rec_image = torch.empty(height, width, 3, device=intrinsics.device)
+    with torch.no_grad():
+        for row in range(0, height, tile_height):
+            for col in range(0, width, tile_width):
+                rows = min(tile_height, height - row)
+                cols = min(tile_width, width - col)
+
+                if ray_cache is not None:
+                    ray_origins, ray_directions, ray_directions_encoded = (t[row:row + rows, col:col + cols] for t in cached_rays)
+                else:
+                    # Rays of the tile only, by shifting the principal point to the tile's corner
+                    tile_intrinsics = intrinsics.clone()
+                    tile_intrinsics[0, 2] -= col
+                    tile_intrinsics[1, 2] -= row
+                    ray_origins, ray_directions = get_rays(rows, cols, tile_intrinsics, pose[:3, :3], pose[:3, 3])
+                    ray_directions_encoded = None
+
+                if aabb is not None:
+                    rec_image[row:row + rows, col:col + cols] = render_rays_adaptive(
+                        ray_origins, ray_directions, near, far, samples, model, num_x_frequencies, num_d_frequencies,
+                        aabb, occupancy_grid=occupancy_grid, min_samples=min_samples, model_fine=model_fine,
+                        fine_samples=fine_samples, transmittance_threshold=transmittance_threshold,
+                        ray_directions_encoded=ray_directions_encoded)
+                    continue
+
+                rec_image[row:row + rows, col:col + cols] = render_rays(
+                    ray_origins, ray_directions, near, far, samples, model, num_x_frequencies, num_d_frequencies,
+                    model_fine=model_fine, fine_samples=fine_samples,
+                    occupancy_grid=occupancy_grid, transmittance_threshold=transmittance_threshold,
+                    ray_directions_encoded=ray_directions_encoded)
+
+    return rec_image
@@ -0,0 +1,110 @@
+"""
+Sampling of depth values along rays: stratified sampling and the inverse transform sampling of the
+hierarchical (coarse-to-fine) pipeline.
+"""
+
+import torch
+
+
+def stratified_sampling(ray_origins, ray_directions, near, far, samples, perturb=False):
+
+    """
+    Sample 3D points on the given rays. The near and far variables indicate the bounds of sampling range.
+
+    Args:
+    ray_origins: Origin of each ray in the "bundle" as returned by the
+      get_rays() function. Shape: (height, width, 3), or (num_rays, 3) for a flat batch of rays.
+    ray_directions: Direction of each ray in the "bundle" as returned by the
+      get_rays() function. Same shape as ray_origins.
+    near: The 'near' extent of the bounding volume, a number or a tensor with one value per ray (e.g. the
+      entry depth of every ray in the scene box). Shape: (height, width).
+    far:  The 'far' extent of the bounding volume, a number or a tensor with one value per ray.
+    samples: Number of samples to be drawn along each ray.
+    perturb (optional, bool): If True, jitter every sample uniformly inside its bin
+      instead of using evenly spaced depths (default: False).
+
+    Returns:
+    ray_points: Query 3D points along each ray. Shape: (height, width, samples, 3).
+    depth_points: Sampled depth values along each ray. Shape: (height, width, samples).
+    """
+
+
+    if torch.is_tensor(near) or torch.is_tensor(far):
+        # Bounds per ray: the same evenly spaced fractions of every [near, far] segment
+        fractions = torch.linspace(0., 1., samples, device=ray_origins.device).reshape(samples, 1)
+        near = torch.as_tensor(near, device=ray_origins.device)[..., None, None]
+        far = torch.as_tensor(far, device=ray_origins.device)[..., None, None]
+        t_values = (near + (far - near) * fractions).expand(*ray_origins.shape[:-1], samples, 1)
+    else:
+        # Create a range of depth values (t) between near and far
+        t_values = torch.linspace(near, far, samples, device=ray_origins.device)  # on the same device
+
+        # Reshape to allow broadcasting with ray origins and directions (any number of leading ray dimensions)
+        t_values = t_values.reshape(samples, 1).expand(*ray_origins.shape[:-1], samples, 1)
+
+    if perturb:
+        # Draw one random depth inside each bin [lower, upper] around the evenly spaced depths
+        mids = .5 * (t_values[..., 1:, :] + t_values[..., :-1, :])
+        upper = torch.cat([mids, t_values[..., -1:, :]], dim=-2)
+        lower = torch.cat([t_values[..., :1, :], mids], dim=-2)
+        t_values = lower + (upper - lower) * torch.rand_like(lower)
+
+    # Calculate 3D points using the formula: point = origin + t * direction
+    ray_points = ray_origins[..., None, :] + ray_directions[..., None, :] * t_values
+
+    # depth_points are just the t_values
+    depth_points = t_values.squeeze(-1)
+
+
+
+
+
+    return ray_points, depth_points
+
+
+def sample_pdf(bins, weights, num_samples, deterministic=False):
+
+    """
+    Draw depth values along each ray from the piecewise-constant distribution defined by the
+    weights of the coarse pass, using inverse transform sampling of its CDF.
+
+    Args:
+    bins: Edges of the depth bins along each ray. Shape: (..., num_bins + 1).
+    weights: Weight of every bin. Shape: (..., num_bins).
+    num_samples: Number of depth values to draw along each ray.
+    deterministic (optional, bool): If True, invert the CDF at evenly spaced values instead of
+      uniform random ones (default: False).
+
+    Returns:
+    depth_samples: Depth values drawn along each ray. Shape: (..., num_samples).
+    """
+
+    # Build the CDF of every ray, avoiding NaNs for rays whose weights are all zero
+    weights = weights + 1e-5
+    pdf = weights / torch.sum(weights, -1, keepdim=True)
+    cdf = torch.cumsum(pdf, -1)
+    cdf = torch.cat([torch.zeros_like(cdf[..., :1]), cdf], -1)
+
+    # Values at which the CDF is inverted
+    if deterministic:
+        u = torch.linspace(0., 1., num_samples, device=cdf.device).expand(*cdf.shape[:-1], num_samples)
+    else:
+        u = torch.rand(*cdf.shape[:-1], num_samples, device=cdf.device)
+    u = u.contiguous()
+
+    # Find the bin each value falls in
+    above = torch.searchsorted(cdf.contiguous(), u, right=True)
+    below = torch.clamp(above - 1, min=0)
+    above = torch.clamp(above, max=cdf.shape[-1] - 1)
+
+    cdf_below = torch.gather(cdf, -1, below)
+    cdf_above = torch.gather(cdf, -1, above)
+    bins_below = torch.gather(bins, -1, below)
+    bins_above = torch.gather(bins, -1, above)
+
+    # Linearly interpolate the depth inside the bin
+    denom = cdf_above - cdf_below
+    denom = torch.where(denom < 1e-5, torch.ones_like(denom), denom)
+    depth_samples = bins_below + (u - cdf_below) / denom * (bins_above - bins_below)
+
+    return depth_samples
@@ -0,0 +1,413 @@
+"""
+HTTP render server: loads the trained network(s) once and renders novel views for concurrent clients.
+
+The rays of all the pending requests are coalesced by a RayBatcher into shared batches of up to
+max_batch_rays rays, rendered by a single render thread, so that concurrent small requests fill the
+network batches together and a large request does not block the others (every pending request gets a
+share of each batch). The HTTP side is a minimal asyncio server (python -m nerf serve):
+
+    POST /render   {"pose": 4x4 list, "height": 100, "width": 100, "progressive": false, "format": "png"}
+                   returns the image as PNG (or .npy with "format": "npy"). With "progressive": true the
+                   view is rendered at 1/4, 1/2 and full resolution and every level is sent as soon as it
+                   is ready, as a multipart/x-mixed-replace response.
+    GET /metrics   latency, throughput, batching and cache statistics (JSON)
+    GET /health
+
+With a RenderCache, repeated (or nearly repeated) views are served from the cache, see render_cache.
+"""
+
+import asyncio
+import collections
+import io
+import json
+import threading
+import time
+
+import numpy as np
+import torch
+
+from .rays import get_pixel_rays, get_rays, scale_intrinsics
+
+
+class RenderJob:
+
+    """
+    The rays of one image, rendered over one or more batches.
+    """
+
+    def __init__(self, ray_origins, ray_directions, loop, future, channels=3):
+        self.ray_origins = ray_origins
+        self.ray_directions = ray_directions
+        self.num_rays = ray_origins.shape[0]
+        self.output = torch.empty(self.num_rays, channels)
+        self.scheduled = 0
+        self.completed = 0
+        self.loop = loop
+        self.future = future
+
+
+def resolve(future, result=None, error=None):
+    # The client may have disconnected (cancelled future)
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class RayBatcher:
+
+    """
+    Coalesce the rays of concurrent render jobs into shared batches, rendered by a background thread.
+
+    Args:
+    render_fn: Function (ray_origins, ray_directions) -> rgb, each of shape (num_rays, 3).
+    max_batch_rays (optional, int): Maximum number of rays per batch.
+    batch_window (optional, float): Seconds to wait for more requests before rendering a batch that is not full.
+    channels (optional, int): Outputs of render_fn per ray (4 for the color and depth of make_render_fn with return_depth).
+    """
+
+    def __init__(self, render_fn, max_batch_rays=2**14, batch_window=0.005, channels=3):
+        self.render_fn = render_fn
+        self.channels = channels
+        self.max_batch_rays = max_batch_rays
+        self.batch_window = batch_window
+        self.jobs = []
+        self.condition = threading.Condition()
+        self.stopped = False
+
+        self.batches = 0
+        self.rays = 0
+        self.jobs_per_batch = 0
+        self.busy_time = 0.
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, ray_origins, ray_directions, loop, future):
+        with self.condition:
+            self.jobs.append(RenderJob(ray_origins, ray_directions, loop, future, self.channels))
+            self.condition.notify()
+
+    def pending_rays(self):
+        return sum(job.num_rays - job.scheduled for job in self.jobs)
+
+    def schedule(self):
+
+        """
+        Take the rays of the next batch: an equal share of the batch for every pending job, then the
+        rest of the batch in the order of the jobs. The jobs of disconnected clients are dropped.
+
+        Returns:
+        A list of (job, start, end) ray ranges.
+        """
+
+        self.jobs = [job for job in self.jobs if not job.future.done()]
+        if not self.jobs:
+            return []
+
+        slices = []
+        capacity = self.max_batch_rays
+        quota = max(capacity // len(self.jobs), 1)
+        for share in (quota, capacity):
+            for job in self.jobs:
+                count = min(job.num_rays - job.scheduled, share, capacity)
+                if count > 0:
+                    slices.append((job, job.scheduled, job.scheduled + count))
+                    job.scheduled += count
+                    capacity -= count
+        self.jobs = [job for job in self.jobs if job.scheduled < job.num_rays]
+
+        return slices
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.jobs and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                partial = self.pending_rays() < self.max_batch_rays
+
+            # Give concurrent requests a chance to join a batch that is not full
+            if partial and self.batch_window > 0:
+                time.sleep(self.batch_window)
+
+            slices = []
+            try:
+                with self.condition:
+                    slices = self.schedule()
+                if not slices:
+                    continue
+                self.render_batch(slices)
+            except Exception as error:
+                # Fail the requests of the batch, the thread keeps serving the others
+                for job, _, _ in slices:
+                    job.loop.call_soon_threadsafe(resolve, job.future, None, error)
+                with self.condition:
+                    failed = set(job for job, _, _ in slices)
+                    self.jobs = [job for job in self.jobs if job not in failed]
+
+    def render_batch(self, slices):
+        t = time.perf_counter()
+        ray_origins = torch.cat([job.ray_origins[start:end] for job, start, end in slices])
+        ray_directions = torch.cat([job.ray_directions[start:end] for job, start, end in slices])
+        rgb = self.render_fn(ray_origins, ray_directions).cpu()
+
+        offset = 0
+        for job, start, end in slices:
+            job.output[start:end] = rgb[offset:offset + end - start]
+            offset += end - start
+            job.completed += end - start
+            if job.completed == job.num_rays:
+                job.loop.call_soon_threadsafe(resolve, job.future, job.output)
+
+        self.batches += 1
+        self.rays += ray_origins.shape[0]
+        self.jobs_per_batch += len(set(job for job, _, _ in slices))
+        self.busy_time += time.perf_counter() - t
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) > 0 else None
+
+
+class ServerMetrics:
+
+    """
+    Latency and throughput statistics of the render server, over the last window requests for the latencies.
+    """
+
+    def __init__(self, window=1000):
+        self.start_time = time.time()
+        self.latencies = collections.deque(maxlen=window)
+        self.first_image_latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.pixels = 0
+
+    def summary(self, batcher, cache=None):
+        uptime = time.time() - self.start_time
+        latencies_ms = [1000 * latency for latency in self.latencies]
+        first_image_ms = [1000 * latency for latency in self.first_image_latencies]
+
+        summary = {
+            'uptime_secs': uptime,
+            'requests': self.requests,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'latency_ms': {'p50': percentile(latencies_ms, 50), 'p95': percentile(latencies_ms, 95), 'p99': percentile(latencies_ms, 99)},
+            'first_image_latency_ms': {'p50': percentile(first_image_ms, 50), 'p95': percentile(first_image_ms, 95)},
+            'requests_per_sec': self.requests / uptime,
+            'pixels_per_sec': self.pixels / uptime,
+            'rays_per_sec': batcher.rays / uptime,
+            'rays_per_render_sec': batcher.rays / max(batcher.busy_time, 1e-9),
+            'batches': batcher.batches,
+            'mean_batch_rays': batcher.rays / max(batcher.batches, 1),
+            'mean_requests_per_batch': batcher.jobs_per_batch / max(batcher.batches, 1),
+            'render_busy_fraction': batcher.busy_time / uptime,
+        }
+        if cache is not None:
+            summary['cache'] = cache.summary()
+
+        return summary
+
+
+def encode_image(image, image_format='png'):
+
+    """
+    Returns:
+    A tuple (data, content_type) of an image with values in [0, 1]. Shape: (height, width, 3).
+    """
+
+    image = image.clamp(0, 1).numpy()
+    buffer = io.BytesIO()
+    if image_format == 'npy':
+        np.save(buffer, image.astype(np.float32))
+        return buffer.getvalue(), 'application/octet-stream'
+    if image_format == 'png':
+        import imageio.v2 as imageio
+        imageio.imwrite(buffer, (255 * image).astype(np.uint8), format='png')
+        return buffer.getvalue(), 'image/png'
+
+    raise ValueError("Unknown format %r, expected 'png' or 'npy'" % image_format)
+
+
+class RenderServer:
+
+    """
+    Render novel views of a trained scene over HTTP.
+
+    Args:
+    render_fn: Function (ray_origins, ray_directions) -> rgb, each of shape (num_rays, 3). With a cache, it
+      also returns the depth: (num_rays, 4), see make_render_fn with return_depth.
+    height, width, intrinsics: Camera of the dataset, scaled to the resolution of every request.
+    max_batch_rays, batch_window: See RayBatcher.
+    max_pixels (optional, int): Largest resolution accepted.
+    progressive_scales (optional, tuple): Resolution divisors of the levels of progressive responses.
+    cache (optional, RenderCache): Cache of the rendered views, None to render every request.
+    fingerprint_fn (optional): Function () -> fingerprint of the weights and render settings of the cache
+      keys (see WeightsFingerprint).
+    """
+
+    def __init__(self, render_fn, height, width, intrinsics, max_batch_rays=2**14, batch_window=0.005,
+                 max_pixels=2048 * 2048, progressive_scales=(4, 2, 1), cache=None, fingerprint_fn=None):
+        self.height = height
+        self.width = width
+        self.intrinsics = intrinsics.cpu()
+        self.max_pixels = max_pixels
+        self.progressive_scales = progressive_scales
+        self.cache = cache
+        self.fingerprint_fn = fingerprint_fn if fingerprint_fn is not None else (lambda: '')
+        self.batcher = RayBatcher(render_fn, max_batch_rays, batch_window, channels=3 if cache is None else 4)
+        self.metrics = ServerMetrics()
+
+    async def render_rays(self, ray_origins, ray_directions):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.batcher.submit(ray_origins, ray_directions, loop, future)
+        return await future
+
+    async def render(self, pose, height, width):
+        intrinsics = scale_intrinsics(self.intrinsics, self.height, self.width, height, width)
+        if self.cache is None:
+            ray_origins, ray_directions = get_rays(height, width, intrinsics, pose[:3, :3], pose[:3, 3])
+            rgb = await self.render_rays(ray_origins.reshape(-1, 3), ray_directions.reshape(-1, 3))
+            return rgb.reshape(height, width, 3)
+
+        # The lookup may read the disk tier and reproject a view: off the event loop
+        loop = asyncio.get_running_loop()
+        key, image, holes = await loop.run_in_executor(None, self.cache.lookup, pose, intrinsics, height, width, self.fingerprint_fn())
+        if image is not None and holes is None:
+            return image
+
+        if image is not None:
+            # Reprojected from a nearby cached view: render its holes only (and do not cache it)
+            rows, cols = torch.nonzero(holes, as_tuple=True)
+            if rows.shape[0] > 0:
+                ray_origins, ray_directions = get_pixel_rays(intrinsics, pose.expand(rows.shape[0], 4, 4), rows, cols)
+                image[rows, cols] = (await self.render_rays(ray_origins, ray_directions))[:, :3]
+            return image
+
+        ray_origins, ray_directions = get_rays(height, width, intrinsics, pose[:3, :3], pose[:3, 3])
+        outputs = (await self.render_rays(ray_origins.reshape(-1, 3), ray_directions.reshape(-1, 3))).reshape(height, width, 4)
+        await loop.run_in_executor(None, self.cache.put, key, outputs[..., :3], outputs[..., 3], pose, intrinsics)
+
+        return outputs[..., :3]
+
+    async def handle_render(self, writer, request):
+        self.metrics.requests += 1
+        pose = torch.tensor(request['pose'], dtype=torch.float32).reshape(4, 4)
+        height = int(request.get('height', self.height))
+        width = int(request.get('width', self.width))
+        image_format = request.get('format', 'png')
+        if not (0 < height * width <= self.max_pixels):
+            raise ValueError("The resolution must be between 1 and %d pixels" % self.max_pixels)
+        if image_format not in ('png', 'npy'):
+            raise ValueError("Unknown format %r, expected 'png' or 'npy'" % image_format)
+
+        progressive = bool(request.get('progressive', False))
+        scales = self.progressive_scales if progressive else (1,)
+
+        t = time.perf_counter()
+        self.metrics.in_flight += 1
+        try:
+            if progressive:
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\nConnection: close\r\n\r\n')
+                try:
+                    await self.send_levels(writer, pose, height, width, scales, image_format, progressive, t)
+                except ConnectionError:
+                    raise
+                except Exception as error:
+                    # The status line is already sent: end the stream early, the client keeps the levels it got
+                    self.metrics.errors += 1
+                    print("Progressive render failed: %r" % error)
+                    writer.write(b'--frame--\r\n')
+                    await writer.drain()
+                    return
+                writer.write(b'--frame--\r\n')
+                await writer.drain()
+            else:
+                await self.send_levels(writer, pose, height, width, scales, image_format, progressive, t)
+        finally:
+            self.metrics.in_flight -= 1
+
+        self.metrics.latencies.append(time.perf_counter() - t)
+        self.metrics.pixels += height * width
+
+    async def send_levels(self, writer, pose, height, width, scales, image_format, progressive, t):
+        for level, scale in enumerate(scales):
+            image = await self.render(pose, max(1, height // scale), max(1, width // scale))
+            data, content_type = encode_image(image, image_format)
+            if level == 0:
+                self.metrics.first_image_latencies.append(time.perf_counter() - t)
+
+            if progressive:
+                writer.write(b'--frame\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n' % (content_type.encode(), len(data)))
+                writer.write(data + b'\r\n')
+                await writer.drain()
+            else:
+                await self.send(writer, 200, data, content_type)
+
+    async def send(self, writer, status, data, content_type='application/json'):
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+        writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n' %
+                     (status, reason.encode(), content_type.encode(), len(data)))
+        writer.write(data)
+        await writer.drain()
+
+    async def send_json(self, writer, status, obj):
+        await self.send(writer, status, json.dumps(obj).encode())
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, value = line.decode('latin-1').split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            path = target.split('?', 1)[0]
+
+            if method == 'POST' and path == '/render':
+                await self.handle_render(writer, json.loads(body))
+            elif method == 'GET' and path == '/metrics':
+                await self.send_json(writer, 200, self.metrics.summary(self.batcher, self.cache))
+            elif method == 'GET' and path == '/health':
+                await self.send_json(writer, 200, {'status': 'ok'})
+            else:
+                await self.send_json(writer, 404, {'error': 'Unknown endpoint %s %s' % (method, path)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.metrics.errors += 1
+        except Exception as error:
+            self.metrics.errors += 1
+            status = 400 if isinstance(error, (ValueError, KeyError, TypeError)) else 500
+            try:
+                await self.send_json(writer, status, {'error': str(error) or type(error).__name__})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving on http://%s:%d (POST /render, GET /metrics, GET /health)" % (host, port))
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.batcher.close()
@@ -0,0 +1,351 @@
+"""
+Training of the network(s) on the training views (single process or data-parallel) and baking.
+"""
+
+import os
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+
+from .baking import bake_sparse_grid, save_baked_grid, load_baked_grid, render_baked
+from .checkpoint import CheckpointWriter, latest_checkpoint, load_checkpoint, make_checkpoint, restore_checkpoint
+from .config import get_device, build_models
+from .data import LEGO_DATA_URL, download, save_image
+from .dataset import open_dataset, RayBatchPrefetcher
+from .distributed import (get_rank, get_world_size, init_process_group, barrier, broadcast_object, broadcast_parameters,
+                          all_reduce_gradients, sync_occupancy_grid)
+from .model import weights_init
+from .occupancy import get_scene_aabb, OccupancyGrid
+from .profiling import Profiler, profiling, stage, trace_profiler
+from .ray_store import open_ray_store, RayStorePrefetcher
+from .rays import RayCache
+from .evaluation import (compute_psnr, HeldOutView, evaluate_held_out, snapshot, BackgroundEvaluator,
+                         new_psnr_history, record_evaluation)
+from .rendering import render_rays, one_forward_pass
+
+
+def make_ray_cache(config):
+    return RayCache(max_bytes=config.ray_cache_max_mb * 2**20 if config.ray_cache_max_mb else None)
+
+
+def bake_model(config, model, model_fine, scene_aabb, height, width, intrinsics, test_pose, test_image, device=None):
+
+    """
+    Bake the (fine) network into a sparse spherical harmonics voxel grid saved to config.bake_path, and
+    compare the baked grid with the network on the held-out view.
+
+    Returns:
+    baked_image (torch.Tensor): Rendering of the held-out view from the baked grid. Shape: (height, width, 3).
+    """
+
+    baked = bake_sparse_grid(model_fine if model_fine is not None else model, config.num_x_frequencies, config.num_d_frequencies,
+                             scene_aabb, resolution=config.bake_resolution, sh_degree=config.bake_sh_degree,
+                             density_threshold=config.occupancy_threshold)
+    save_baked_grid(baked, config.bake_path)
+
+    return evaluate_baked(config, height, width, intrinsics, test_pose, test_image, device)
+
+
+def evaluate_baked(config, height, width, intrinsics, test_pose, test_image, device=None):
+
+    """
+    Render the held-out view from the baked grid of config.bake_path, print its size, PSNR and speed and
+    save it next to config.output_image.
+    """
+
+    baked = load_baked_grid(config.bake_path, device=device)
+    t = time.time()
+    baked_image = render_baked(baked, height, width, intrinsics, test_pose, config.near, config.far,
+                               config.samples + config.fine_samples * config.hierarchical)
+    baked_psnr = compute_psnr(baked_image, test_image)
+    print("Baked grid: %.1f MB, PSNR: %.2f, %.3f secs per frame" % (os.path.getsize(config.bake_path) / 2**20, baked_psnr.item(), time.time() - t))
+    save_image(os.path.splitext(config.output_image)[0] + '_baked.png', baked_image)
+
+    return baked_image
+
+
+def train(config, device=None, step_callbacks=()):
+
+    """
+    Train the network(s) described by config, evaluating them on the held-out view every config.display
+    iterations (see nerf.evaluation) and writing a checkpoint every config.checkpoint_every iterations,
+    then save the rendering of the held-out view and the weights. With config.resume, training continues from the latest checkpoint.
+
+    In a process of a distributed training (see train_distributed), the steps are sharded across the
+    processes and only rank 0 evaluates, writes the checkpoints and saves the results. A missing lego
+    dataset is downloaded once per machine, and a resumed run gets the checkpoint of rank 0.
+
+    Args:
+    config: The NerfConfig of the run.
+    device (optional, torch.device): Device of the training, the GPU if available by default.
+    step_callbacks (optional, list): Functions callback(iteration, loss, profiler) called after every
+      training step. profiler is the Profiler of the run (None without config.profile or
+      config.profile_trace_dir), its totals are reset at every display.
+
+    Returns:
+    model: The trained network, the coarse one with hierarchical sampling.
+    model_fine: The trained fine network, None without hierarchical sampling.
+    psnrs (list): PSNR of the full resolution held-out view at each full evaluation.
+    iternums (list): Iteration of each full evaluation.
+    """
+
+    device = device if device is not None else get_device()
+    rank, world_size = get_rank(), get_world_size()
+
+    if world_size > 1:
+        # Download a missing dataset on rank 0, then on the first process of the machines that do not share its storage
+        local_rank = rank - config.node_rank * config.processes_per_node
+        for downloads in (rank == 0, local_rank == 0):
+            if downloads and not os.path.exists(config.data_path):
+                download(LEGO_DATA_URL, config.data_path)
+            barrier()
+
+    # The training images are read on demand, only the poses and the held-out view are kept on the device
+    dataset = open_dataset(config.data_path, device, config.num_train_images)
+    poses, intrinsics = dataset.poses, dataset.intrinsics
+    height, width = dataset.height, dataset.width
+    test_image, test_pose = dataset.load_image(config.test_index), poses[config.test_index]
+
+    scene_aabb = get_scene_aabb(poses, config.far)
+
+    model, model_fine = build_models(config, scene_aabb, device)
+    model.apply(weights_init)
+    parameters = list(model.parameters())
+    if model_fine is not None:
+        model_fine.apply(weights_init)
+        parameters += list(model_fine.parameters())
+
+    optimizer = torch.optim.Adam(parameters, lr=config.learning_rate)
+
+    ray_cache = make_ray_cache(config)
+
+    occupancy_grid = OccupancyGrid(scene_aabb, config.occupancy_resolution, config.occupancy_threshold) if config.use_occupancy_grid else None
+
+    # Full resolution and quick PSNRs, kept apart (see nerf.evaluation)
+    psnr_history = new_psnr_history()
+
+    start_iteration = 0
+    ray_batch_seed = None
+    if config.resume:
+        # Only rank 0 writes checkpoints: the other ranks, possibly on machines without access to them, get its copy
+        resume_path = latest_checkpoint(config.checkpoint_dir) if rank == 0 else None
+        checkpoint = load_checkpoint(resume_path) if resume_path is not None else None
+        if world_size > 1:
+            resume_path, checkpoint = broadcast_object((resume_path, checkpoint))
+        if resume_path is None:
+            if rank == 0:
+                print("No checkpoint in %s, training from scratch" % config.checkpoint_dir)
+        else:
+            iteration, psnr_history, ray_batch_seed = restore_checkpoint(checkpoint, model, model_fine, optimizer, occupancy_grid)
+            del checkpoint
+            start_iteration = iteration + 1
+            if rank == 0:
+                print("Resumed from %s at iteration %d" % (resume_path, start_iteration))
+
+    if world_size > 1:
+        # Same initial weights everywhere, and a shared seed from which every rank draws its own shard
+        broadcast_parameters([model, model_fine])
+        ray_batch_seed = broadcast_object(ray_batch_seed if ray_batch_seed is not None else int(np.random.randint(2**31)))
+        # Different jitter and occupancy cells on every rank (the restored generator states are the same)
+        torch.manual_seed(int(np.random.SeedSequence((ray_batch_seed, start_iteration, rank)).generate_state(1)[0]))
+
+    if config.training_mode == 'rays':
+        # Read the pixels of the next minibatches of rays in a background thread
+        if config.ray_store:
+            # Every training pixel once per epoch, sliced from the precomputed rays
+            t_store = time.time()
+            ray_store = open_ray_store(dataset, config.ray_store_path)
+            if rank == 0:
+                print("Ray store: %d rays, %.0f MB (%.1f secs)" % (len(ray_store), ray_store.nbytes() / 2**20, time.time() - t_store))
+            ray_batches = RayStorePrefetcher(ray_store, config.ray_batch_size // world_size, device, num_prefetch=config.prefetch_batches,
+                                             seed=ray_batch_seed, start_batch=start_iteration,
+                                             shard=rank if world_size > 1 else None, num_shards=world_size)
+        else:
+            ray_batches = RayBatchPrefetcher(dataset, config.ray_batch_size // world_size, device, num_prefetch=config.prefetch_batches,
+                                             images_per_batch=config.images_per_batch, seed=ray_batch_seed, start_batch=start_iteration,
+                                             shard=rank if world_size > 1 else None)
+        ray_batch_seed = ray_batches.seed
+
+    checkpoint_writer = CheckpointWriter(config.checkpoint_dir, config.keep_checkpoints) if config.checkpoint_every > 0 and rank == 0 else None
+
+    view = HeldOutView(config, height, width, intrinsics, test_pose, test_image)
+
+    def evaluate(iteration, full, models):
+        # The ray cache is only used from the training thread
+        return evaluate_held_out(config, view, *models, scene_aabb=scene_aabb, full=full, ray_cache=ray_cache if evaluator is None else None)
+
+    evaluator = BackgroundEvaluator(evaluate) if config.eval_in_background and rank == 0 else None
+    # Last full resolution rendering of the held-out view and its iteration
+    test_rec_image, test_rec_iteration = None, None
+
+    # Steps, rays rendered and time spent in training steps since the last display, to report secs/iter and rays/sec
+    steps_since_display = 0
+    rays_trained = 0
+    train_time = 0.
+
+    # Stage timers (see nerf.profiling) and a torch.profiler trace of a few steps
+    profiler = Profiler(synchronize=True) if config.profile or config.profile_trace_dir else None
+    trace = trace_profiler(config.profile_trace_dir, config.profile_trace_steps) if config.profile_trace_dir and rank == 0 else None
+    if trace is not None:
+        trace.start()
+
+    t = time.time()
+    t0 = time.time()
+
+    # The profiler is active in this context during the training loop only (also if it raises)
+    with profiling(profiler):
+        for i in range(start_iteration, config.iterations+1):
+
+            t_step = time.time()
+
+            if config.training_mode == 'rays':
+                # Draw a random minibatch of rays across all the training images
+                with stage('data'):
+                    ray_origins, ray_directions, target_img = ray_batches.next()
+
+                # Run one iteration of NeRF and get the rendered RGB color of every ray.
+                rec_image, rec_image_coarse = render_rays(ray_origins, ray_directions, config.near, config.far, config.samples, model,
+                                                          config.num_x_frequencies, config.num_d_frequencies,
+                                                          perturb=config.perturb, model_fine=model_fine, fine_samples=config.fine_samples,
+                                                          return_coarse=True, occupancy_grid=occupancy_grid)
+            else:
+                # Choose a random image for the forward pass
+                if world_size > 1:
+                    img_idx = int(np.random.default_rng((ray_batch_seed, i, rank)).integers(len(dataset)))  # Every rank its own image
+                else:
+                    img_idx = np.random.randint(len(dataset))  # Randomly select an image index
+                with stage('data'):
+                    target_img = dataset.load_image(img_idx)  # Get the target image
+                pose = poses[img_idx]  # Get the corresponding camera pose
+
+                # Run one iteration of NeRF and get the rendered RGB image.
+                rec_image, rec_image_coarse = one_forward_pass(height, width, intrinsics, pose, config.near, config.far, config.samples, model,
+                                                               config.num_x_frequencies, config.num_d_frequencies,
+                                                               perturb=config.perturb, model_fine=model_fine, fine_samples=config.fine_samples,
+                                                               return_coarse=True, occupancy_grid=occupancy_grid,
+                                                               ray_cache=ray_cache, pose_index=img_idx)
+
+            # Compute mean-squared error between the predicted and target images. Backprop!
+            loss = F.mse_loss(rec_image, target_img)  # Calculate the loss
+            if rec_image_coarse is not None:
+                loss = loss + F.mse_loss(rec_image_coarse, target_img)  # The coarse network is supervised as well
+            with stage('backward'):
+                loss.backward()  # Backpropagate the loss
+            if world_size > 1:
+                with stage('all_reduce'):
+                    all_reduce_gradients(parameters, world_size)  # Average the gradients of the shards
+            with stage('optimizer'):
+                optimizer.step()  # Update model weights
+                optimizer.zero_grad() # Clear gradients for the next iteration
+
+            # Refresh the occupancy grid from the densities predicted by the (fine) network
+            if occupancy_grid is not None and i >= config.occupancy_warmup and i % config.occupancy_update_every == 0:
+                with stage('occupancy'):
+                    occupancy_grid.update(model_fine if model_fine is not None else model, config.num_x_frequencies, config.num_d_frequencies,
+                                          num_cells=config.occupancy_cells_per_update // world_size)
+                    if world_size > 1:
+                        sync_occupancy_grid(occupancy_grid)
+
+            steps_since_display += 1
+            rays_trained += world_size * (target_img.numel() // 3)
+            train_time += time.time() - t_step
+            for callback in step_callbacks:
+                callback(i, loss, profiler)
+            if trace is not None:
+                trace.step()
+
+            # Display stats and evaluate the held-out view (quick every config.display iterations, full every config.full_eval_every)
+            full = config.full_eval_every > 0 and i % config.full_eval_every == 0
+            if rank == 0:
+                results = evaluator.poll() if evaluator is not None else []
+                if full or i % config.display == 0:
+                    print("Iteration %d " % i, "Loss: %.4f " % loss.item(), \
+                            "Time: %.2f secs per iter, " % ((time.time() - t) / steps_since_display), "%.2f mins in total, " % ((time.time() - t0)/60), \
+                            "%.0f rays/sec" % (rays_trained / max(train_time, 1e-9)))
+                    if occupancy_grid is not None:
+                        print("Occupied cells: %.1f%%" % (100 * occupancy_grid.occupancy_fraction()))
+                    if config.profile:
+                        print(profiler.report())
+                        profiler.reset()
+
+                    if evaluator is not None:
+                        evaluator.submit(i, full, snapshot(model, model_fine, occupancy_grid))
+                    else:
+                        t_eval = time.time()
+                        # Timed as one stage, the rendering stages of the evaluation are not mixed with those of training
+                        with stage('evaluation'), profiling(None):
+                            result = evaluate(i, full, (model, model_fine, occupancy_grid))
+                        results.append((i, full, result, time.time() - t_eval))
+
+                    t = time.time()
+                    steps_since_display = 0
+                    rays_trained = 0
+                    train_time = 0.
+
+                for iteration, full_eval, result, secs in results:
+                    image = record_evaluation(config, view, iteration, full_eval, result, secs, psnr_history)
+                    if image is not None:
+                        test_rec_image, test_rec_iteration = image, iteration
+
+            # Snapshot the run, it is written in the background while training continues
+            if checkpoint_writer is not None and i > 0 and (i % config.checkpoint_every == 0 or i == config.iterations):
+                checkpoint_writer.save(i, make_checkpoint(i, model, model_fine, optimizer, occupancy_grid, psnr_history, ray_batch_seed))
+
+    if trace is not None:
+        trace.stop()
+
+    if config.training_mode == 'rays':
+        ray_batches.close()
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+    if evaluator is not None:
+        for iteration, full_eval, result, secs in evaluator.close():
+            image = record_evaluation(config, view, iteration, full_eval, result, secs, psnr_history)
+            if image is not None:
+                test_rec_image, test_rec_iteration = image, iteration
+
+    psnrs, iternums = psnr_history['full']['psnrs'], psnr_history['full']['iternums']
+    if rank != 0:
+        return model, model_fine, psnrs, iternums
+
+    # Full resolution evaluation of the final weights, unless the last evaluation was one
+    if test_rec_iteration != config.iterations:
+        t_eval = time.time()
+        result = evaluate_held_out(config, view, model, model_fine, occupancy_grid, scene_aabb, full=True, ray_cache=ray_cache)
+        test_rec_image = record_evaluation(config, view, config.iterations, True, result, time.time() - t_eval, psnr_history)
+
+    save_image(config.output_image, test_rec_image)
+    torch.save(model.state_dict(), config.checkpoint_path)
+    if model_fine is not None:
+        torch.save(model_fine.state_dict(), config.checkpoint_fine_path)
+
+    if config.bake_after_training:
+        bake_model(config, model, model_fine, scene_aabb, height, width, intrinsics, test_pose, test_image, device)
+
+    return model, model_fine, psnrs, iternums
+
+
+def run_training_process(local_rank, config):
+    rank = config.node_rank * config.processes_per_node + local_rank
+    init_process_group(rank, config.processes_per_node * config.num_nodes, config.master_addr, config.master_port)
+
+    # Split the cores of the machine between its processes instead of oversubscribing them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // config.processes_per_node))
+    try:
+        train(config, torch.device('cpu'))
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+def train_distributed(config):
+
+    """
+    Train with config.processes_per_node processes on this machine, each on its shard of every step, with
+    the gradients all-reduced over gloo. On several machines, run it on each of them with the same
+    num_nodes, master_addr and master_port and its own node_rank; node 0 saves the results.
+    """
+
+    mp.spawn(run_training_process, args=(config,), nprocs=config.processes_per_node, join=True)